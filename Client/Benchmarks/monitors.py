@@ -0,0 +1,108 @@
+"""
+Check that the strategy and trade monitors given in the global settings keep
+each stock's trades apart, and time them.
+
+A day of random bars is run through the OfflineEngine for two symbols at
+once, with the monitors set once for every stock, and then for each symbol
+on its own. Every stock must end with the same open and closed trades either
+way: a monitor which is shared between the stocks would close (or lose) one
+stock's trades on another stock's bars, and a strategy which is shared would
+be bound to the last stock, and decide for every stock from its bars. The
+strategy is run both with its decide_batch, and bar by bar.
+
+Run from the Client directory with:
+    python -m Benchmarks.monitors [bars]
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import sys
+import time
+import random
+
+from Core.engine import OfflineEngine
+from Core.loggable import configureLogging
+from Core.strategy import MovingAverageStrategy
+from Core.trademonitor import TimeLimitTradeMonitor, DailyStopLossTradeMonitor, MultiTradeMonitor
+
+SYMBOLS = ["AAA", "BBB"]
+
+def makeBars(symbol, count):
+    """ A random walk of `count` one minute bars, as history columns """
+    generator = random.Random(symbol)
+    columns = {name: [] for name in ("Time", "Open", "High", "Low", "Close", "Volume")}
+    close = 100.0
+    for i in range(count):
+        open_price = close
+        close = open_price + generator.gauss(0, 0.3)
+        columns["Time"].append(1514885400 * 10**9 + i * 60 * 10**9)
+        columns["Open"].append(open_price)
+        columns["High"].append(max(open_price, close) + 0.1)
+        columns["Low"].append(min(open_price, close) - 0.1)
+        columns["Close"].append(close)
+        columns["Volume"].append(100)
+    return columns
+
+def closedTrades(stock):
+    columns = stock.closed_trades.getColumns()
+    return list(zip(columns["open_time"].tolist(), columns["action"].tolist()))
+
+class BarByBarStrategy(MovingAverageStrategy):
+    """ The moving average strategy without its decide_batch, so that the
+    OfflineEngine calls it on each bar """
+    def decide_batch(self, columns):
+        return None
+
+def run(bars, make_monitor, strategy_class=MovingAverageStrategy):
+    """ Each stock's open and closed trades, as (open time, action) pairs, the
+    closed ones in the order they were closed """
+    engine = OfflineEngine({
+        "strategy": strategy_class(5, 20),
+        "trade_monitor": make_monitor()
+    })
+    stocks = engine.run(bars)
+    return {
+        symbol: (
+            [(trade.open_time, trade.action) for trade in stocks[symbol].open_trades],
+            closedTrades(stocks[symbol])
+        )
+        for symbol in stocks
+    }
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 390
+    configureLogging("ERROR", asynchronous=False)
+    bars = {symbol: makeBars(symbol, count) for symbol in SYMBOLS}
+    monitors = [
+        ("time limit", lambda: TimeLimitTradeMonitor(5)),
+        # BBB's loss reaches 200 during the day, but AAA's doesn't
+        ("daily stop", lambda: DailyStopLossTradeMonitor(200)),
+        ("time limit + daily stop", lambda: MultiTradeMonitor([
+            TimeLimitTradeMonitor(5),
+            DailyStopLossTradeMonitor(50)
+        ])),
+        ("bar by bar + time limit", lambda: TimeLimitTradeMonitor(5), BarByBarStrategy)
+    ]
+    failed = False
+    for (name, make_monitor, *strategy_class) in monitors:
+        start = time.perf_counter()
+        together = run(bars, make_monitor, *strategy_class)
+        elapsed = time.perf_counter() - start
+        for symbol in SYMBOLS:
+            alone = run({symbol: bars[symbol]}, make_monitor, *strategy_class)[symbol]
+            matches = together[symbol] == alone
+            failed = failed or not matches
+            print("{:24s} {:s}: {:3d} open, {:3d} closed, {:s}".format(
+                name,
+                symbol,
+                len(together[symbol][0]),
+                len(together[symbol][1]),
+                "same as alone" if matches else "DIFFERS from alone ({:d} open, {:d} closed)".format(
+                    len(alone[0]),
+                    len(alone[1])
+                )
+            ))
+        print("{:24s} {:.3f}s for {:d} bars of {:d} stocks".format(name, elapsed, count, len(SYMBOLS)))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,76 @@
+"""
+Measure the memory and construction cost of PriceBars, compared with the
+original dictionary-backed implementation.
+
+Run from the Client directory with:
+    python -m Benchmarks.pricebar [number of bars]
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import sys
+import timeit
+import tracemalloc
+
+from Core.pricebar import PriceBar
+
+class DictPriceBar:
+    """ The original PriceBar, which stores its fields in a per-instance __dict__ """
+    def __init__(self, bar_dict):
+        self.time = bar_dict['Time']
+        self.open = bar_dict['Open']
+        self.close = bar_dict['Close']
+        self.high = bar_dict['High']
+        self.low = bar_dict['Low']
+        self.volume = bar_dict['Volume']
+
+def makeBarDicts(count):
+    return [
+        {
+            'Time' : "20180102 {:02d}:{:02d}:00".format(9 + i // 60 % 8, i % 60),
+            'Open' : 100.0 + i % 7,
+            'High' : 101.0 + i % 7,
+            'Low' : 99.0 + i % 7,
+            'Close' : 100.5 + i % 7,
+            'Volume' : 1000 + i
+        }
+        for i in range(count)
+    ]
+
+def makeColumns(bar_dicts):
+    return {
+        field: [bar[field] for bar in bar_dicts]
+        for field in ('Time', 'Open', 'High', 'Low', 'Close', 'Volume')
+    }
+
+def measureMemory(create):
+    """ Return the number of bytes allocated by create() which are still retained """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    retained = create()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del retained
+    return after - before
+
+def measureTime(create, repeat=5):
+    """ Return the best time, in seconds, taken by create() """
+    return min(timeit.repeat(create, number=1, repeat=repeat))
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bar_dicts = makeBarDicts(count)
+    columns = makeColumns(bar_dicts)
+    cases = [
+        ("dict-backed, per bar", lambda: [DictPriceBar(bar) for bar in bar_dicts]),
+        ("slots, per bar", lambda: [PriceBar(bar) for bar in bar_dicts]),
+        ("slots, fromColumns", lambda: PriceBar.fromColumns(columns)),
+    ]
+    print("{:d} bars".format(count))
+    print("{:24s} {:>14s} {:>14s}".format("", "bytes / bar", "ns / bar"))
+    for (name, create) in cases:
+        memory = measureMemory(create)
+        seconds = measureTime(create)
+        print("{:24s} {:14.1f} {:14.1f}".format(name, memory / count, 1e9 * seconds / count))
@@ -0,0 +1,169 @@
+"""
+Measure the time from a bar's arrival to its stock's signal being sent, with
+the Controller waiting for every bar of the minute (the barrier) and with it
+streaming each bar to its stock as it arrives.
+
+A simulated gateway feeds the Controller. Each minute, the bars of the symbols
+arrive one after the other, `gap` microseconds apart, as they would from a
+live feed. Every stock's strategy goes long on every bar after doing `work`
+microseconds of computation, and its trades are closed a minute later.
+
+Run from the Client directory with:
+    python -m Benchmarks.streaming [symbols] [minutes] [gap] [work]
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import sys
+import time
+
+import numpy
+
+from Core.controller import Controller
+from Core.stock import Stock
+from Core.strategy import Strategy
+from Core.trademonitor import TimeLimitTradeMonitor
+from Core.signals import Handler
+from Core.pricebar import NANOSECONDS_PER_MINUTE
+
+class FeedFinished(Exception):
+    pass
+
+class FeedGateway:
+    """ Stands in for the Gateway, delivering each minute's bars one by one at
+    their arrival times, and recording when each bar was handed over. """
+    def __init__(self, symbols, minutes, gap):
+        self.metrics = None
+        self.request_to_stock = {}
+        self.arrivals = {}
+        self.messages = self.feed(symbols, minutes, gap / 1e6)
+
+    def getAccounts(self):
+        return ["Benchmark"]
+
+    def getStock(self, account, symbol, exchange, currency):
+        return Stock(self, symbol, exchange)
+
+    def feed(self, symbols, minutes, gap):
+        start_time = 1514903400 * 10**9
+        for minute in range(minutes):
+            yield {"Type": "Prepare for Live Bars"}
+            tick_start = time.perf_counter()
+            for (request_id, symbol) in enumerate(symbols):
+                self.request_to_stock[request_id] = symbol
+                # wait for the bar to arrive
+                arrival = tick_start + request_id * gap
+                while time.perf_counter() < arrival:
+                    pass
+                price = 100.0 + minute % 7
+                yield {
+                    "Type": "Live Bar",
+                    "RequestID": request_id,
+                    "Bar": {
+                        "Time": start_time + minute * NANOSECONDS_PER_MINUTE,
+                        "Open": price,
+                        "High": price + 1,
+                        "Low": price - 1,
+                        "Close": price,
+                        "Volume": 1000
+                    }
+                }
+            yield {"Type": "End of Live Bars"}
+
+    def listen(self):
+        message = next(self.messages, None)
+        if message is None:
+            raise FeedFinished()
+        if message["Type"] == "Live Bar":
+            self.arrivals[self.request_to_stock[message["RequestID"]]] = time.perf_counter()
+        return message
+
+    def finalise(self):
+        pass
+
+class BusyStrategy(Strategy):
+    """ Goes long on every bar, after `work` microseconds of computation """
+    def __init__(self, work):
+        self.work = work / 1e6
+
+    def add_record(self, record):
+        pass
+
+    def decide(self):
+        end = time.perf_counter() + self.work
+        while time.perf_counter() < end:
+            pass
+        return 1
+
+class LatencySignaller(Handler):
+    """ Records the time from each bar's arrival until its orders are flushed """
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.pending = []
+        self.latencies = []
+
+    def initialise(self):
+        pass
+
+    def startOrder(self, stock, trade):
+        self.pending.append(stock.symbol)
+
+    def closeOrder(self, stock, trade):
+        pass
+
+    def closeAll(self, stock, time):
+        pass
+
+    def flush(self):
+        now = time.perf_counter()
+        for symbol in self.pending:
+            self.latencies.append(now - self.gateway.arrivals[symbol])
+        self.pending = []
+
+def measure(streaming, symbols, minutes, gap, work):
+    """ The latencies, in seconds, of every signal sent """
+    gateway = FeedGateway(symbols, minutes, gap)
+    signaller = LatencySignaller(gateway)
+    settings = {
+        "exchange": "EXMPL",
+        "currency": "CUR",
+        "log_level": "ERROR",
+        "metrics": False,
+        "streaming": streaming,
+        "signaller": signaller
+    }
+    controller = Controller("Example", "Backtest", settings, 1, symbols, gateway)
+    for symbol in controller.stocks:
+        stock = controller.stocks[symbol]
+        stock.strategy = BusyStrategy(work)
+        stock.strategy.bind(stock)
+        stock.trade_monitor = TimeLimitTradeMonitor(1)
+        stock.is_backtest = True
+    try:
+        controller.listen()
+    except FeedFinished:
+        pass
+    return numpy.array(signaller.latencies)
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    minutes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    gap = float(sys.argv[3]) if len(sys.argv) > 3 else 100.0
+    work = float(sys.argv[4]) if len(sys.argv) > 4 else 200.0
+    symbols = ["S{:04d}".format(i) for i in range(count)]
+    print("{:d} symbols, {:d} minutes, bars {:.0f}us apart, {:.0f}us of work per bar".format(
+        count, minutes, gap, work
+    ))
+    print("bar arrival to signal, in milliseconds")
+    print("{:12s} {:>10s} {:>10s} {:>10s} {:>10s}".format("", "mean", "p50", "p99", "max"))
+    for (name, streaming) in [("barrier", False), ("streaming", True)]:
+        latencies = 1000 * measure(streaming, symbols, minutes, gap, work)
+        print("{:12s} {:10.3f} {:10.3f} {:10.3f} {:10.3f}".format(
+            name,
+            latencies.mean(),
+            numpy.percentile(latencies, 50),
+            numpy.percentile(latencies, 99),
+            latencies.max()
+        ))
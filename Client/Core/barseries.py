@@ -0,0 +1,103 @@
+""" Contains the BarSeries class, a fixed-size history of a stock's price bars.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import numpy
+
+class BarSeries:
+    """ A ring buffer holding the most recent price bars of a stock, one NumPy
+    column per field.
+
+    Each Stock owns a BarSeries, which is filled as bars arrive, so strategies
+    no longer need to keep their own history. All of a stock's strategies share
+    the same series, and its memory is fixed by its capacity.
+
+    Every bar is written twice, at its position in the ring and again one
+    capacity further along. The last N values of any field are then always
+    contiguous in memory, so they can be returned as a view rather than a copy.
+    Views are only valid until the next bar is added: copy them if they
+    need to be kept.
+    """
+    FIELDS = ("open", "high", "low", "close", "volume")
+
+    def __init__(self, capacity):
+        assert capacity > 0, "capacity must be greater than zero"
+        self.capacity = capacity
+        self.time_values = numpy.zeros(2 * capacity, dtype=numpy.int64)
+        self.values = numpy.zeros((len(self.FIELDS), 2 * capacity), dtype=numpy.float64)
+        # the index at which the next bar will be written, and the number of bars added so far.
+        self.position = 0
+        self.count = 0
+
+    def append(self, price_bar):
+        """ Add a bar to the series, overwriting the oldest if it is full """
+        position = self.position
+        mirror = position + self.capacity
+        self.time_values[position] = self.time_values[mirror] = price_bar.time
+        values = self.values
+        values[0, position] = values[0, mirror] = price_bar.open
+        values[1, position] = values[1, mirror] = price_bar.high
+        values[2, position] = values[2, mirror] = price_bar.low
+        values[3, position] = values[3, mirror] = price_bar.close
+        values[4, position] = values[4, mirror] = price_bar.volume
+        self.position = position + 1 if position + 1 < self.capacity else 0
+        self.count += 1
+
+    def __len__(self):
+        """ The number of bars available, up to the capacity """
+        return self.count if self.count < self.capacity else self.capacity
+
+    def window(self, row, length):
+        """ A view of the last `length` values of a row of the given array """
+        available = len(self)
+        if length is None or length > available:
+            length = available
+        end = self.position + self.capacity
+        return row[end - length:end]
+
+    def times(self, length=None):
+        """ The times of the last `length` bars (or all available bars), oldest first """
+        return self.window(self.time_values, length)
+
+    def opens(self, length=None):
+        return self.window(self.values[0], length)
+
+    def highs(self, length=None):
+        return self.window(self.values[1], length)
+
+    def lows(self, length=None):
+        return self.window(self.values[2], length)
+
+    def closes(self, length=None):
+        return self.window(self.values[3], length)
+
+    def volumes(self, length=None):
+        return self.window(self.values[4], length)
+
+    def field(self, name, length=None):
+        """ The last `length` values of a field, by name """
+        if name == "time":
+            return self.times(length)
+        return self.window(self.values[self.FIELDS.index(name)], length)
+
+    def snapshot(self):
+        """ A copy of the bars held, oldest first, for restore() in a later session """
+        return {
+            "count": self.count,
+            "times": self.times().copy(),
+            "values": numpy.array([self.field(name) for name in self.FIELDS])
+        }
+
+    def restore(self, state):
+        """ Replace the bars held with those of a snapshot. If this series is
+        smaller than the one snapshotted, only the most recent bars are kept. """
+        bars = min(len(state["times"]), self.capacity)
+        capacity = self.capacity
+        for offset in (0, capacity):
+            self.time_values[offset:offset + bars] = state["times"][len(state["times"]) - bars:]
+            self.values[:, offset:offset + bars] = state["values"][:, state["values"].shape[1] - bars:]
+        self.position = bars % capacity
+        self.count = state["count"] if bars == capacity else bars
@@ -8,24 +8,81 @@ in the project root for full license information.
 """
 import sys
 import datetime
-import smtplib
-import copy
-import importlib
+import ujson
 
 from .gateway import Gateway
 from .pricebar import PriceBar
+from .loggable import Loggable, configureLogging
+from .reporters import NullReporter
+from .executors import createExecutor
+from .position import Portfolio
+from .riskledger import RiskLedger
+from .tradeledger import TradeLedger
+from .metrics import Metrics
+from .settings import SettingsResolver, settingsHash
+from .snapshots import SnapshotStore
+from .pricebar import NANOSECONDS_PER_MINUTE
+from .profiler import PhaseProfiler
+from .warmup import WarmUp
 
-class Controller:
+class Controller(Loggable):
     """ Responsible for managing a set of stocks in one process.
     """
-    def __init__(self, version, environment, global_settings, client_id, symbols):
+    def __init__(self, version, environment, global_settings, client_id, symbols, gateway=None):
         self.version = version
         self.environment = environment
-        self.gateway = Gateway()
-        self.account = self.gateway.getAccounts()[0]
+        self.client_id = client_id
+        # Messages below log_level are dropped, and the rest are written in
+        # batches every log_flush_interval seconds. With log_structured, they
+        # are also written as JSON lines to Logs/Client-*.jsonl.
+        configureLogging(
+            global_settings.get("log_level", "INFO"),
+            global_settings.get("log_flush_interval", 0.5),
+            "Logs/Client-{:s}-{:s}{:s}-{:d}.jsonl".format(
+                version,
+                environment,
+                global_settings.get("log_tag", ""),
+                client_id
+            ) if global_settings.get("log_structured", False) else None
+        )
+        # With profile_startup (run.py --profile-startup), the time spent in each
+        # phase of starting up is reported once the stocks are subscribed.
+        self.profiler = PhaseProfiler(global_settings.get("profile_startup", False))
+        with self.profiler.phase("connect"):
+            # a gateway can be given, e.g. to run against a simulated feed
+            if gateway is None:
+                gateway = Gateway(connection_port=global_settings.get("connection_port", 92482))
+            self.gateway = gateway
+            self.account = self.gateway.getAccounts()[0]
         self.stocks = {}
+        # the settings each stock was loaded with, keyed by symbol
+        self.stock_settings = {}
         self.new_bars = {}
+        # the time of the latest bar, or None until the first bar arrives
+        self.current_time = None
         self.global_settings = global_settings
+        self.settings_resolver = SettingsResolver(version, environment)
+        with self.profiler.phase("settings_index"):
+            self.settings_resolver.load()
+        # With snapshots, each stock's state is saved at the end of the day (and
+        # every snapshot_interval minutes), and restored when the client next
+        # starts, so that only the bars since the snapshot are replayed. Each
+        # job (log_tag) and backtest date has its own directory, so that
+        # backtests run side by side (e.g. by grid.py) don't share snapshots.
+        self.snapshots = None
+        self.snapshot_keys = {}
+        self.snapshot_interval = global_settings.get("snapshot_interval", None)
+        self.last_snapshot_time = None
+        if global_settings.get("snapshots", False):
+            self.snapshots = SnapshotStore(global_settings.get(
+                "snapshot_directory",
+                "Cache/Snapshots/{:s}-{:s}{:s}{:s}".format(
+                    version,
+                    environment,
+                    global_settings.get("log_tag", ""),
+                    "".join("-" + date for date in global_settings.get("backtest_date", []))
+                )
+            ))
         self.loadStocks(symbols)
 
         if "reporter" not in global_settings:
@@ -33,9 +90,61 @@ class Controller:
 
         self.reporter = global_settings["reporter"]
         self.reporter.initiate(version, environment, client_id)
+        # The executor decides how stocks' bars are processed: one after the other
+        # ("serial"), on a pool of threads ("threads"), or on a set of worker
+        # processes which each own a subset of the stocks ("processes").
+        self.executor = createExecutor(
+            global_settings.get("executor", "serial"),
+            global_settings.get("executor_workers", None)
+        )
+        # An optional cross-sectional strategy, which decides for all stocks at once.
+        self.universe_strategy = global_settings.get("universe_strategy", None)
+        # An optional trade monitor over every stock's position, e.g. a
+        # DailyStopLossTradeMonitor for the whole portfolio.
+        self.portfolio_monitor = global_settings.get("portfolio_monitor", None)
+        self.portfolio = Portfolio(self.stocks)
+        # When run.py has created a risk ledger, this client publishes its
+        # portfolio's totals to it every minute, and the global monitor (e.g. a
+        # DailyStopLossTradeMonitor) is run over the totals of every client.
+        self.risk_ledger = None
+        if "risk_ledger_name" in global_settings:
+            self.risk_ledger = RiskLedger.attach(global_settings["risk_ledger_name"])
+        self.global_monitor = global_settings.get("global_monitor", None)
+        # Timings of each stage of the bar loop, and of each symbol, exported
+        # to Logs/Metrics-*.jsonl (or .prom) every metrics_interval seconds.
+        self.metrics = None
+        if global_settings.get("metrics", True):
+            export_format = global_settings.get("metrics_format", "jsonl")
+            self.metrics = Metrics(
+                global_settings.get(
+                    "metrics_file",
+                    "Logs/Metrics-{:s}-{:s}{:s}-{:d}.{:s}".format(
+                        version,
+                        environment,
+                        global_settings.get("log_tag", ""),
+                        client_id,
+                        "jsonl" if export_format == "jsonl" else "prom"
+                    )
+                ),
+                export_format,
+                global_settings.get("metrics_interval", 60),
+                {"version": version, "environment": environment, "client": client_id}
+            )
+            self.gateway.metrics = self.metrics
+            self.executor.metrics = self.metrics
+        # In streaming mode, each stock processes its bar as soon as it arrives,
+        # rather than waiting for every stock's bar of the minute (the barrier),
+        # and its signals are flushed straight away. A universe strategy, or any
+        # strategy with requires_barrier, needs every bar at once, so keeps the
+        # barrier. Bars from the tick bus arrive together, and are unaffected.
+        self.streaming = global_settings.get("streaming", False)
+        if self.streaming and self.requiresBarrier():
+            self.report("Streaming is off, as a strategy requires every bar of the minute at once")
+            self.streaming = False
+        self.tick_start = None
 
     def loadStock(self, symbol, exchange, currency):
-        self.report("Getting stock {:s} from gateway".format(symbol))
+        self.debug("Getting stock {:s} from gateway".format(symbol))
         return self.gateway.getStock(
             self.account,
             symbol,
@@ -45,66 +154,31 @@ class Controller:
 
     def loadStocks(self, symbols):
         for symbol in symbols:
-            stock_settings = self.getStockSettings(symbol)
-            stock = self.loadStock(
-                symbol,
-                stock_settings['exchange'],
-                stock_settings['currency']
-            )
-            for option_name in stock_settings:
-                if not hasattr(stock, option_name):
-                    self.report(
-                        "Warning: attribute {:s} hasn't got a default value".format(
-                            option_name
-                        )
-                    )
-                setattr(stock, option_name, stock_settings[option_name])
-            self.report("Initiating signallers")
-            stock.signaller.initialise()
+            with self.profiler.phase("settings"):
+                stock_settings = self.getStockSettings(symbol)
+            with self.profiler.phase("get_stock"):
+                stock = self.loadStock(
+                    symbol,
+                    stock_settings['exchange'],
+                    stock_settings['currency']
+                )
+            with self.profiler.phase("initialise"):
+                stock.applySettings(stock_settings)
+                self.debug("Initiating stock and signallers")
+                stock.initialise()
             # now we store the stock object in self.stocks, referenced by its
             # symbol.
             self.stocks[symbol] = stock
+            self.stock_settings[symbol] = stock_settings
+            if self.snapshots is not None:
+                # taken before any bars arrive, as the strategy's key may include its state
+                self.snapshot_keys[symbol] = settingsHash(symbol, stock_settings, stock.strategy).hexdigest()
 
     def getStockSettings(self, symbol):
-        self.report("getting settings for {:s}".format(symbol))
-        # Create a shallow copy of settings so that settings can be overwritten by each stock.
-        stock_settings = copy.copy(self.global_settings)
-        self.report("after copy")
-        self.report("copied settings for {:s}".format(symbol))
-        self.report("loading version file for {:s}".format(symbol))
-        try:
-            # try to load the generic index file for the stock
-            version_file = importlib.import_module(
-                "Versions.{:s}.Stocks.{:s}.index".format(
-                    self.version,
-                    symbol
-                )
-            )
-            self.report("loaded version file for {:s}".format(symbol))
-            stock_settings.update(version_file.settings)
-        except Exception as error:
-            self.report("Exception type: ", error)
-            self.report("Stock file {:s} has no index.py file, continuing anyway".format(
-                symbol
-            ))
-        self.report("loading version file for {:s}".format(symbol))
-        try:
-            # try to load the environment-specific file for the stock
-            environment_file = importlib.import_module(
-                "Versions.{:s}.Stocks.{:s}.{:s}".format(
-                    self.version,
-                    symbol,
-                    self.environment
-                )
-            )
-            self.report("loaded environment file for {:s}".format(symbol))
-            stock_settings.update(environment_file.settings)
-        except Exception as error:
-            self.report("Exception type: ", error)
-            self.report("Stock file {:s} has no {:s}.py file, continuing anyway".format(
-                symbol,
-                self.environment
-            ))
+        self.debug("getting settings for {:s}".format(symbol))
+        # A shallow copy of the global settings, overridden by the stock's manifest
+        # rows and settings files (see SettingsResolver)
+        stock_settings = self.settings_resolver.resolve(symbol, self.global_settings)
         # verify that we have the exchange and currency. If not, then
         # we don't have enough information to launch the client.
         if "exchange" not in stock_settings:
@@ -121,36 +195,197 @@ class Controller:
                     self.environment
                 )
             )
-        self.report("loaded all settings for {:s}".format(symbol))
+        self.debug("loaded all settings for {:s}".format(symbol))
         return stock_settings
 
     def goLive(self):
         # these are done in blocks rather than all-in-one, to allow separate stocks
         # to get to the same stage before moving on
+        # load each stock's data, and fit its strategy to it. The fitting is
+        # run on warm_up_workers processes, and cached in warm_up_cache, where
+        # analyses unused for warm_up_cache_days days are removed.
+        with self.profiler.phase("warm_up"):
+            warm_up = WarmUp(
+                self.global_settings.get("warm_up_workers", None),
+                self.global_settings.get("warm_up_cache", "Cache/WarmUp/{:s}".format(self.version)),
+                self.global_settings.get("warm_up_cache_days", 7)
+            )
+            warm_up.run(self.stocks, self.stock_settings)
+        restored = 0
         for symbol in self.stocks:
-            # load the stock data from 2012 to the current year
-            # (this also performs detection, classification, learning)
-            self.report("Loading Stock Data", symbol)
-            self.stocks[symbol].load()
-        for symbol in self.stocks:
-            self.stocks[symbol].analyse()
-        for symbol in self.stocks:
+            stock = self.stocks[symbol]
+            # Restore the stock's state from its last snapshot, if it has one,
+            # so that only the bars since the snapshot need to be replayed
+            since = None
+            if self.snapshots is not None:
+                with self.profiler.phase("restore"):
+                    state = self.snapshots.load(symbol, self.snapshot_keys[symbol])
+                    if state is not None and state["time"] is not None:
+                        stock.restore(state)
+                        # the snapshot holds the analysis of the data it was
+                        # taken with, so the analysis of today's data is applied again
+                        if symbol in warm_up.analyses:
+                            stock.strategy.apply_analysis(warm_up.analyses[symbol])
+                        since = state["time"]
+                        restored += 1
             # Grab historical data from the stock. This is just in case
             # this client starts up after the market opens or misses the previous
             # day, etc.
-            self.report(
+            self.debug(
                 "Requesting historical data for stock '" + symbol + "'")
-            self.stocks[symbol].addHistoricalPriceBars(
-                self.gateway.getHistory(self.stocks[symbol])
-            )
+            with self.profiler.phase("history"):
+                stock.addHistoricalPriceBars(
+                    self.gateway.getHistory(
+                        stock,
+                        since=None if since is None else stock.getServerTime(since)
+                    ),
+                    since=since
+                )
+        if self.snapshots is not None:
+            self.report("Restored {:d} of {:d} stocks from snapshots".format(restored, len(self.stocks)))
         for symbol in self.stocks:
             # Subscribe to live market data
-            self.report("Requesting live data for stock '" + symbol + "'")
-            self.gateway.subscribeToMarketData(self.stocks[symbol])
+            self.debug("Requesting live data for stock '" + symbol + "'")
+            with self.profiler.phase("subscribe"):
+                self.gateway.subscribeToMarketData(self.stocks[symbol])
         self.gateway.finalise()
+        if self.profiler.enabled:
+            self.report("Started {:d} stocks. Time per phase:\n{:s}".format(
+                len(self.stocks),
+                self.profiler.format()
+            ))
         # Run the listening loop.
         self.listen()
 
+    def requiresBarrier(self):
+        """ Whether bars must be processed together, once all of them are in """
+        if self.universe_strategy is not None:
+            return True
+        return any(self.stocks[symbol].strategy.requires_barrier for symbol in self.stocks)
+
+    def processStreamingBar(self, symbol, price_bar):
+        """ In streaming mode, process a stock's bar as soon as it arrives, and
+        send its signals straight away. """
+        metrics = self.metrics
+        if metrics is not None:
+            start = metrics.clock()
+        self.executor.process(self.stocks, {symbol: price_bar})
+        stock = self.stocks[symbol]
+        self.current_time = stock.current_time
+        stock.signaller.flush()
+        if metrics is not None:
+            metrics.record("stream_bar", start)
+
+    def processBars(self):
+        """ Once all of the bars for a minute are in, pass them to the stocks
+        and process them. """
+        metrics = self.metrics
+        if metrics is not None:
+            tick_start = start = metrics.clock()
+        self.report("All bars are in. Processing them...")
+        decisions = None
+        if self.universe_strategy is not None and self.new_bars:
+            symbols = list(self.new_bars)
+            decision_vector = self.universe_strategy.decide(
+                symbols,
+                self.universe_strategy.getBarArray(symbols, self.new_bars)
+            )
+            decisions = {
+                symbol: int(decision)
+                for (symbol, decision) in zip(symbols, decision_vector)
+            }
+            if metrics is not None:
+                metrics.record("universe", start)
+        if metrics is not None:
+            start = metrics.clock()
+        self.executor.process(self.stocks, self.new_bars, decisions)
+        for symbol in self.new_bars:
+            self.current_time = self.stocks[symbol].current_time
+        if metrics is not None:
+            metrics.record("executor", start)
+            self.finishBars(tick_start)
+        else:
+            self.finishBars()
+
+    def finishBars(self, tick_start=None):
+        """ Once every stock has processed its bar for the minute, run the
+        portfolio monitors, flush the signallers, report, and tell the server. """
+        metrics = self.metrics
+        if metrics is not None:
+            start = metrics.clock()
+        if self.portfolio_monitor is not None:
+            if not self.portfolio_monitor.notify_multiple(self.portfolio, None):
+                self.executor.closeAll(self.stocks)
+        if self.risk_ledger is not None:
+            self.risk_ledger.publish(self.client_id - 1, self.current_time, self.portfolio)
+            if self.global_monitor is not None:
+                if not self.global_monitor.notify_multiple(self.risk_ledger, None):
+                    self.executor.closeAll(self.stocks)
+        if metrics is not None:
+            metrics.record("portfolio", start)
+            start = metrics.clock()
+        self.report("Done. Flushing signallers.")
+        for symbol in self.stocks:
+            self.stocks[symbol].signaller.flush()
+        if metrics is not None:
+            metrics.record("flush", start)
+            start = metrics.clock()
+        self.reporter.newBars(self, self.current_time)
+        if metrics is not None:
+            metrics.record("report", start)
+            start = metrics.clock()
+        # now tell the Arrow Server that we are done processing, for bookkeeping purposes.
+        self.gateway.finalise()
+        if metrics is not None:
+            metrics.record("finalise", start)
+            if tick_start is not None:
+                metrics.record("tick", tick_start)
+            metrics.exportIfDue(self.current_time)
+        # checkpoint every snapshot_interval minutes
+        if self.snapshots is not None and self.snapshot_interval is not None and self.current_time is not None:
+            if self.last_snapshot_time is None:
+                self.last_snapshot_time = self.current_time
+            elif self.current_time - self.last_snapshot_time >= self.snapshot_interval * NANOSECONDS_PER_MINUTE:
+                self.saveSnapshots()
+
+    def saveSnapshots(self):
+        """ Save the snapshot of every stock """
+        snapshots = self.executor.snapshot(self.stocks)
+        for symbol in snapshots:
+            self.snapshots.save(symbol, self.snapshot_keys[symbol], snapshots[symbol])
+        self.last_snapshot_time = self.current_time
+        self.debug("Saved snapshots of {:d} stocks".format(len(snapshots)))
+
+    def closeSignallers(self):
+        """ Close each signaller once, as they may be shared between stocks """
+        signallers = {}
+        for symbol in self.stocks:
+            signallers[id(self.stocks[symbol].signaller)] = self.stocks[symbol].signaller
+        for signaller in signallers.values():
+            signaller.close()
+
+    def getStatistics(self):
+        """ Statistics of the trades closed by every stock, from their ledgers,
+        along with the number of trades that are still open (including those
+        whose close hasn't been filled). """
+        statistics = TradeLedger.statistics(
+            TradeLedger.combine([self.stocks[symbol].closed_trades for symbol in self.stocks])
+        )
+        statistics["open_trades"] = sum(
+            len(self.stocks[symbol].open_trades) + len(self.stocks[symbol].close_orders)
+            for symbol in self.stocks
+        )
+        return statistics
+
+    def writeResults(self, filename):
+        """ Write a summary of the trades made by this client, as JSON, so that
+        runs launched by grid.py can be collected into one table. """
+        summary = self.getStatistics()
+        summary["client_id"] = self.client_id
+        summary["symbols"] = len(self.stocks)
+        with open(filename, "w") as results_file:
+            results_file.write(ujson.dumps(summary))
+
     def getLogTag(self):
         return "Controller"
     
@@ -161,32 +396,53 @@ class Controller:
             listen_input = self.gateway.listen()
             if listen_input["Type"] == "Prepare for Live Bars":
                 # PriceBars are going to come in - store them all and process in bulk afterwards,
-                # so that the message queue isn't blocked
+                # so that the message queue isn't blocked (unless streaming)
                 self.new_bars = {}
+                if self.metrics is not None:
+                    self.tick_start = self.metrics.clock()
             # We have received a live bar, pass it to the stock.
             elif listen_input["Type"] == "Live Bar":
                 # Find the stock based on the returned live data request's ID
                 symbol = self.gateway.request_to_stock[listen_input['RequestID']]
                 stock = self.stocks[symbol]
                 # Pass the new bar to the stock
-                self.new_bars[symbol] = PriceBar(listen_input['Bar'])
+                price_bar = PriceBar(listen_input['Bar'])
+                self.new_bars[symbol] = price_bar
+                if self.streaming:
+                    self.processStreamingBar(symbol, price_bar)
             elif listen_input["Type"] == "End of Live Bars":
-                self.report("All bars are in. Adding them to the stock...")
-                for symbol in self.new_bars:
-                    self.stocks[symbol].addLivePriceBar(self.new_bars[symbol])
-                self.report("Ready to process!")
-                for symbol in self.new_bars:
-                    self.stocks[symbol].processNewBar()
-                    self.current_time = self.stocks[symbol].current_time
-                self.report("Done. Flushing signallers.")
-                for symbol in self.stocks:
-                    self.stocks[symbol].signaller.flush()
-                self.reporter.newBars(self, self.current_time)
-                # now tell the Arrow Server that we are done processing, for bookkeeping purposes.
-                self.gateway.finalise()
+                if self.streaming:
+                    self.finishBars(self.tick_start)
+                else:
+                    self.processBars()
+            elif listen_input["Type"] == "Tick Bus":
+                # The server is on this machine, and will put bars in shared memory
+                # rather than sending them to us.
+                self.gateway.attachTickBus(listen_input)
+            elif listen_input["Type"] == "Shared Live Bars":
+                # A whole tick has been written to the tick bus. Read our bars from it.
+                if self.metrics is not None:
+                    start = self.metrics.clock()
+                self.new_bars = self.gateway.readSharedBars(listen_input["Sequence"])
+                if self.metrics is not None:
+                    self.metrics.record("read_shared_bars", start)
+                self.processBars()
             elif listen_input["Type"] == "Server Exit":
+                self.gateway.detachTickBus()
+                if self.risk_ledger is not None:
+                    self.risk_ledger.close()
                 self.report("Server has closed.")
+                if self.snapshots is not None:
+                    self.saveSnapshots()
+                self.executor.finish(self.stocks)
+                self.closeSignallers()
                 self.report("Generating complete report.")
-                self.report("Trades:", sum(len(self.stocks[symbol].closed_trades) for symbol in self.stocks))
+                statistics = self.getStatistics()
+                for name in sorted(statistics):
+                    self.report("{:s}: {:s}".format(name, str(statistics[name])))
                 self.reporter.endOfDay(self)
+                if self.metrics is not None:
+                    self.metrics.export(self.current_time)
+                if "results_file" in self.global_settings:
+                    self.writeResults(self.global_settings["results_file"].format(self.client_id))
                 sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,125 @@
+""" Run strategies over historical bars in-process, without the server or ZMQ.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import copy
+import numpy
+
+from .loggable import Loggable
+from .stock import Stock
+from .pricebar import PriceBar
+from .strategy import NullStrategy
+from .executors import createExecutor
+from .position import Portfolio
+
+class OfflineEngine(Loggable):
+    """ Backtests a set of stocks directly from arrays of bars.
+
+    The full backtest needs run.py, the BacktestServer, the Gateway and the
+    Controller, with every bar serialised and sent through ZMQ. For research,
+    this engine feeds the bars straight into the same Stock, Trade, strategy
+    and trade monitor classes, minute by minute, in the same order as the
+    Controller does, so that the same trades are made.
+
+    If a stock's strategy implements decide_batch(columns) (see Strategy), its
+    decisions for the whole day are made in one vectorised call before the day
+    is replayed, and the strategy is not called bar by bar. Only the trade
+    handling and monitoring is then done per bar.
+
+    Settings are given in the same form as those loaded by the Controller: the
+    global settings, and optionally a dictionary of settings per symbol that
+    override them.
+    """
+    def __init__(self, settings, symbol_settings=None):
+        self.settings = settings
+        self.symbol_settings = symbol_settings or {}
+        self.stocks = {}
+        self.current_time = None
+
+    def createStock(self, symbol):
+        stock_settings = copy.copy(self.settings)
+        stock_settings.setdefault("is_backtest", True)
+        stock_settings.update(self.symbol_settings.get(symbol, {}))
+        stock = Stock(None, symbol, stock_settings.get("exchange", "N/A"))
+        stock.applySettings(stock_settings)
+        return stock
+
+    @staticmethod
+    def getColumns(price_bars):
+        """ Convert a list of PriceBars into a dictionary of NumPy arrays """
+        columns = {
+            field: numpy.array([getattr(price_bar, field) for price_bar in price_bars])
+            for field in ("open", "high", "low", "close", "volume")
+        }
+        columns["time"] = numpy.array([price_bar.time for price_bar in price_bars], dtype=numpy.int64)
+        return columns
+
+    def run(self, bars):
+        """ Run the stocks over a set of bars.
+        :param bars a dictionary of symbol -> columns, where columns is a dictionary
+                    with Time, Open, High, Low, Close and Volume keys, each holding
+                    an array or list of values (the format of history responses).
+        :return a dictionary of symbol -> Stock, holding the trades that were made.
+        """
+        # time -> {symbol -> (bar, decision)}, where the decision is None unless
+        # it was made in advance by decide_batch.
+        ticks = {}
+        for symbol in bars:
+            stock = self.createStock(symbol)
+            price_bars = PriceBar.fromColumns(bars[symbol])
+            decisions = stock.strategy.decide_batch(self.getColumns(price_bars))
+            if decisions is not None:
+                # The strategy has decided for the whole day at once, so it doesn't
+                # need to see each bar.
+                decisions = decisions.tolist()
+                stock.strategy = NullStrategy()
+            else:
+                decisions = [None] * len(price_bars)
+            stock.initialise()
+            self.stocks[symbol] = stock
+            for (price_bar, decision) in zip(price_bars, decisions):
+                ticks.setdefault(price_bar.time, {})[symbol] = (price_bar, decision)
+
+        executor = createExecutor(
+            self.settings.get("executor", "serial"),
+            self.settings.get("executor_workers", None)
+        )
+        universe_strategy = self.settings.get("universe_strategy", None)
+        portfolio_monitor = self.settings.get("portfolio_monitor", None)
+        portfolio = Portfolio(self.stocks)
+        for time in sorted(ticks):
+            tick = ticks[time]
+            new_bars = {symbol: tick[symbol][0] for symbol in tick}
+            decisions = {}
+            if universe_strategy is not None:
+                symbols = list(new_bars)
+                decision_vector = universe_strategy.decide(
+                    symbols,
+                    universe_strategy.getBarArray(symbols, new_bars)
+                )
+                decisions = {
+                    symbol: int(decision)
+                    for (symbol, decision) in zip(symbols, decision_vector)
+                }
+            for symbol in tick:
+                if tick[symbol][1] is not None:
+                    decisions[symbol] = int(tick[symbol][1])
+            executor.process(self.stocks, new_bars, decisions)
+            for symbol in new_bars:
+                self.current_time = self.stocks[symbol].current_time
+            if portfolio_monitor is not None:
+                if not portfolio_monitor.notify_multiple(portfolio, None):
+                    executor.closeAll(self.stocks)
+            for symbol in self.stocks:
+                self.stocks[symbol].signaller.flush()
+        executor.finish(self.stocks)
+        signallers = {id(stock.signaller): stock.signaller for stock in self.stocks.values()}
+        for signaller in signallers.values():
+            signaller.close()
+        return self.stocks
+
+    def getLogTag(self):
+        return "OfflineEngine"
@@ -0,0 +1,304 @@
+""" Contains the executors used by the Controller to process each minute's bars.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import multiprocessing
+import traceback
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from .loggable import Loggable, flushLogs
+from .signals import DeferredHandler
+
+class StockExecutor(Loggable):
+    """ Passes each minute's bars to their stocks and processes them.
+
+    The Controller hands every set of bars to an executor once they have all
+    arrived. Whatever the executor does internally, by the time process()
+    returns every stock must have processed its bar and every signal must
+    have been passed to the stocks' signallers, in the order of the symbols
+    in new_bars. The Controller flushes the signallers afterwards.
+
+    If the Controller gives the executor a Metrics object, executors that can
+    time their stages record them there.
+    """
+    metrics = None
+
+    @abstractmethod
+    def process(self, stocks, new_bars, decisions=None):
+        """ Add each bar to its stock and process it.
+        :param stocks a dictionary of symbol -> Stock
+        :param new_bars a dictionary of symbol -> PriceBar
+        :param decisions an optional dictionary of symbol -> decision, made by a
+                         universe strategy, to be used instead of the stocks' strategies.
+        """
+        pass
+
+    def finish(self, stocks):
+        """ Called when the server exits, before the final report is generated. """
+        pass
+
+    def closeAll(self, stocks):
+        """ Close every open trade of every stock, e.g. when a portfolio monitor
+        has stopped trading. The signals are passed to the stocks' signallers. """
+        for symbol in sorted(stocks):
+            stocks[symbol].closeAllTrades()
+
+    def snapshot(self, stocks):
+        """ The snapshot of every stock (see Stock.snapshot), keyed by symbol """
+        return {symbol: stocks[symbol].snapshot() for symbol in stocks}
+
+    def getLogTag(self):
+        return self.__class__.__name__
+
+class SerialExecutor(StockExecutor):
+    """ Processes each stock in turn. This is the default.
+    With metrics, it records the time taken to add the bars, and the time
+    that each symbol's strategy and monitors take to process its bar. """
+    def process(self, stocks, new_bars, decisions=None):
+        decisions = decisions or {}
+        metrics = self.metrics
+        if metrics is None:
+            for symbol in new_bars:
+                stocks[symbol].addLivePriceBar(new_bars[symbol])
+            for symbol in new_bars:
+                stocks[symbol].processNewBar(decisions.get(symbol))
+            return
+        start = metrics.clock()
+        for symbol in new_bars:
+            stocks[symbol].addLivePriceBar(new_bars[symbol])
+        metrics.record("add_bars", start)
+        for symbol in new_bars:
+            start = metrics.clock()
+            stocks[symbol].processNewBar(decisions.get(symbol))
+            metrics.recordSymbol(symbol, start)
+
+class ThreadExecutor(StockExecutor):
+    """ Processes stocks on a pool of threads.
+
+    This only helps when strategies spend their time in code that releases the
+    GIL, such as NumPy. Signals raised by each stock are deferred while the
+    pool is running, then replayed stock-by-stock once every stock is done,
+    so that the signallers see the same order as with the SerialExecutor.
+    """
+    def __init__(self, workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process(self, stocks, new_bars, decisions=None):
+        decisions = decisions or {}
+        for symbol in new_bars:
+            stocks[symbol].addLivePriceBar(new_bars[symbol])
+        deferred = {}
+        for symbol in new_bars:
+            deferred[symbol] = DeferredHandler(stocks[symbol].signaller)
+            stocks[symbol].signaller = deferred[symbol]
+        try:
+            futures = [
+                self.pool.submit(stocks[symbol].processNewBar, decisions.get(symbol))
+                for symbol in new_bars
+            ]
+            for future in futures:
+                # re-raise any exception from the strategies
+                future.result()
+        finally:
+            for symbol in new_bars:
+                stocks[symbol].signaller = deferred[symbol].handler
+        for symbol in new_bars:
+            deferred[symbol].replay(stocks[symbol])
+
+    def finish(self, stocks):
+        self.pool.shutdown()
+
+def _processWorker(connection, stocks):
+    """ The main loop of a ProcessExecutor worker. The worker owns its own copies
+    of its stocks, inherited when it was forked, and processes their bars as
+    they are sent through the connection. """
+    for symbol in stocks:
+        stocks[symbol].signaller = DeferredHandler(None)
+    while True:
+        command, payload = connection.recv()
+        try:
+            if command == "process":
+                for symbol, bar, _ in payload:
+                    stocks[symbol].addLivePriceBar(bar)
+                results = []
+                for symbol, _, decision in payload:
+                    stock = stocks[symbol]
+                    stock.processNewBar(decision)
+                    results.append((
+                        symbol, stock.current_time, stock.current_bar,
+                        stock.position, stock.signaller.records
+                    ))
+                    stock.signaller.records = []
+                connection.send(("ok", results))
+            elif command == "closeAll":
+                results = []
+                for symbol in payload:
+                    stocks[symbol].closeAllTrades()
+                    results.append((symbol, stocks[symbol].signaller.records))
+                    stocks[symbol].signaller.records = []
+                connection.send(("ok", results))
+            elif command == "snapshot":
+                connection.send(("ok", {symbol: stocks[symbol].snapshot() for symbol in stocks}))
+            elif command == "finish":
+                connection.send((
+                    "ok",
+                    {
+                        symbol: (
+                            stocks[symbol].open_trades,
+                            stocks[symbol].closed_trades,
+                            stocks[symbol].close_orders
+                        )
+                        for symbol in stocks
+                    }
+                ))
+                # the worker exits without running atexit handlers
+                flushLogs()
+                return
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+
+class ProcessExecutor(StockExecutor):
+    """ Processes stocks on a set of persistent worker processes.
+
+    This is for pure-Python strategies, which cannot run concurrently on threads.
+    Each stock is assigned to the same worker for the whole session, and that
+    worker holds the stock's state. Workers are forked on the first bar, so they
+    inherit stocks which have already been loaded and given their history.
+
+    Each minute, the bars are sent to the workers, which record any signals
+    rather than sending them. The signals are returned along with each stock's
+    current bar and time, and replayed on the Controller's stocks in symbol
+    order. Trade lists are only copied back when the session finishes, so a
+    reporter run during the session sees the stocks' times and positions but not
+    their trades.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.connections = []
+        self.processes = []
+        self.affinity = {}
+
+    def start(self, stocks):
+        context = multiprocessing.get_context("fork")
+        symbols = sorted(stocks)
+        workers = min(self.workers, len(symbols))
+        for worker in range(workers):
+            worker_symbols = symbols[worker::workers]
+            for symbol in worker_symbols:
+                self.affinity[symbol] = worker
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_processWorker,
+                args=(child_connection, {symbol: stocks[symbol] for symbol in worker_symbols}),
+                daemon=True
+            )
+            process.start()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+        self.report("Started {:d} worker processes".format(workers))
+
+    def receive(self, connection):
+        status, payload = connection.recv()
+        if status == "error":
+            raise RuntimeError("Worker process failed:\n" + payload)
+        return payload
+
+    def process(self, stocks, new_bars, decisions=None):
+        decisions = decisions or {}
+        if not self.processes:
+            self.start(stocks)
+        payloads = [[] for _ in self.connections]
+        for symbol in new_bars:
+            payloads[self.affinity[symbol]].append(
+                (symbol, new_bars[symbol], decisions.get(symbol))
+            )
+        for connection, payload in zip(self.connections, payloads):
+            if payload:
+                connection.send(("process", payload))
+        results = {}
+        for connection, payload in zip(self.connections, payloads):
+            if payload:
+                for (symbol, current_time, current_bar, position, records) in self.receive(connection):
+                    results[symbol] = (current_time, current_bar, position, records)
+        for symbol in new_bars:
+            stock = stocks[symbol]
+            current_time, current_bar, position, records = results[symbol]
+            stock.previous_time = stock.current_time
+            stock.current_time = current_time
+            stock.current_bar = current_bar
+            # positions are small, so they are copied every minute for portfolio monitors
+            stock.position = position
+            self.replay(stock, records)
+
+    def replay(self, stock, records):
+        """ Pass the signals recorded by a worker to the stock's signaller """
+        for (method, argument) in records:
+            if method != "closeAll":
+                argument.stock = stock
+            getattr(stock.signaller, method)(stock, argument)
+
+    def closeAll(self, stocks):
+        if not self.processes:
+            return StockExecutor.closeAll(self, stocks)
+        symbols = sorted(stocks)
+        for worker, connection in enumerate(self.connections):
+            connection.send(("closeAll", [symbol for symbol in symbols if self.affinity[symbol] == worker]))
+        results = {}
+        for connection in self.connections:
+            for (symbol, records) in self.receive(connection):
+                results[symbol] = records
+        for symbol in symbols:
+            self.replay(stocks[symbol], results[symbol])
+
+    def snapshot(self, stocks):
+        """ The workers' stocks hold the up to date state, so they are snapshotted there """
+        if not self.processes:
+            return StockExecutor.snapshot(self, stocks)
+        for connection in self.connections:
+            connection.send(("snapshot", None))
+        snapshots = {}
+        for connection in self.connections:
+            snapshots.update(self.receive(connection))
+        return snapshots
+
+    def finish(self, stocks):
+        """ Copy each stock's trades back from the workers, and stop them. """
+        for connection in self.connections:
+            connection.send(("finish", None))
+        for connection in self.connections:
+            for symbol, (open_trades, closed_trades, close_orders) in self.receive(connection).items():
+                for trade in list(open_trades) + list(close_orders.values()):
+                    trade.stock = stocks[symbol]
+                stocks[symbol].open_trades = open_trades
+                stocks[symbol].closed_trades = closed_trades
+                stocks[symbol].close_orders = close_orders
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+executors = {
+    "serial" : SerialExecutor,
+    "threads" : ThreadExecutor,
+    "processes" : ProcessExecutor
+}
+
+def createExecutor(executor, workers=None):
+    """ Create an executor from its name in the settings, or pass through an executor
+    object that has been created in the settings file. """
+    if isinstance(executor, StockExecutor):
+        return executor
+    if executor not in executors:
+        raise ValueError(
+            "Unknown executor '{:s}', should be one of {:s}".format(
+                str(executor),
+                ", ".join(executors)
+            )
+        )
+    if executor == "serial":
+        return SerialExecutor()
+    return executors[executor](workers)
@@ -15,6 +15,8 @@ import ujson
 from .loggable import Loggable
 from .pricebar import PriceBar
 from .stock import Stock
+from .tickbus import TickBus
+
 class Gateway(Loggable):
     """ The gateway between the Controller and the Server
 
@@ -48,12 +50,12 @@ class Gateway(Loggable):
         # This is the socket we're using to send requests
         self.socket_out_poller = zmq.Poller()
         self.socket_out = self.zmq_context.socket(zmq.PUSH)
-        self.socket_out.connect("tcp://" + serverIP + ":" + str(out_port))
+        self.socket_out.connect("tcp://" + self.server_ip + ":" + str(out_port))
         self.socket_out_poller.register(self.socket_out, zmq.POLLOUT)
         # This is the socket that we get responses from
         self.socket_in_poller = zmq.Poller()
         self.socket_in = self.zmq_context.socket(zmq.PULL)
-        self.socket_in.connect("tcp://" + serverIP + ":" + str(in_port))
+        self.socket_in.connect("tcp://" + self.server_ip + ":" + str(in_port))
         self.socket_in_poller.register(self.socket_in, zmq.POLLIN)
         # An incrementing request ID so that responses can be
         # matched to requests
@@ -69,6 +71,12 @@ class Gateway(Loggable):
         # When pricebars are returned, we want to make sure that
         # there is no request.
         self.request_to_stock = {}
+        # If the server shares bars through shared memory, this is the bus they
+        # are read from, along with the slot that each of our symbols occupies.
+        self.tick_bus = None
+        self.slot_to_stock = {}
+        # Optional Metrics, set by the Controller, to time message decoding.
+        self.metrics = None
 
     # Establish the initial connection. To do this, we communicate
     # with a static Request socket. The server application allocates a unique
@@ -77,7 +85,7 @@ class Gateway(Loggable):
     # the server and multiple clients.
     def connect(self):
         initial_connection_socket = self.zmq_context.socket(zmq.REQ)
-        initial_connection_socket.connect("tcp://{:s}/{:d}".format(self.server_ip, self.connection_port))
+        initial_connection_socket.connect("tcp://{:s}:{:d}".format(self.server_ip, self.connection_port))
         poller = zmq.Poller()
         poller.register(initial_connection_socket)
         connected = False
@@ -125,7 +133,7 @@ class Gateway(Loggable):
         if timeout is None:
             timeout = self.timeout
         if self.socket_in_poller.poll(timeout):
-            self.report("polling is okay")
+            self.debug("polling is okay")
             return True
         return False
     
@@ -141,7 +149,7 @@ class Gateway(Loggable):
         """ Raw sending of dicts """
         for _ in range(attempts):
             if self.pollOutput():
-                self.report("Sending: ", to_send)
+                self.debug("Sending: ", to_send)
                 self.socket_out.send_string(ujson.dumps(to_send))
                 return True
         return False
@@ -162,9 +170,15 @@ class Gateway(Loggable):
             if ignore_timeout or self.pollInput():
                 # The message will be in JSON format once converted to ASCII
                 # Receive the message and convert the JSON string into a dict.
-                self.report("Trying to receive...")
-                result = ujson.loads(self.socket_in.recv().decode('ascii'))
-                self.report("Received: ", result)
+                self.debug("Trying to receive...")
+                message = self.socket_in.recv()
+                if self.metrics is not None:
+                    start = self.metrics.clock()
+                    result = ujson.loads(message.decode('ascii'))
+                    self.metrics.record("decode", start)
+                else:
+                    result = ujson.loads(message.decode('ascii'))
+                self.debug("Received: ", result)
 
                 # Check that it's the corresponding request ID.
                 # If not, cache it.
@@ -226,18 +240,24 @@ class Gateway(Loggable):
         })
         return Stock(self, message['Stock'])
     
-    def getHistory(self, stock, days_backwards = 1):
-        message = self.request({
+    def getHistory(self, stock, days_backwards = 1, since=None):
+        """ Request the stock's recent bars. With `since` (a time in nanoseconds
+        since the epoch, as the server sends them), only bars after it are asked for. """
+        request = {
             "Type" : "Request Historical Data",
             "AccountID" : self.account,
             "Symbol" : stock.symbol,
             "Exchange" : stock.exchange,
             "Timespan" : days_backwards
-        })
-        price_bars = []
-        for price_bar in message['Bars']:
-            price_bars.append(PriceBar(price_bar))
-        return price_bars
+        }
+        if since is not None:
+            request["Since"] = since
+        message = self.request(request)
+        # Servers can send history either as columns (one list per field),
+        # which is cheaper to send and to convert, or as a list of bars.
+        if 'Columns' in message:
+            return PriceBar.fromColumns(message['Columns'])
+        return [PriceBar(price_bar) for price_bar in message['Bars']]
 
     def subscribeToMarketData(self, stock):
         request_id = self.send({
@@ -248,6 +268,28 @@ class Gateway(Loggable):
         })
         self.request_to_stock[request_id] = stock.symbol
 
+    def attachTickBus(self, message):
+        """ Attach to the server's shared memory tick bus, using the slots it allocated """
+        self.tick_bus = TickBus.attach(message['Name'])
+        self.slot_to_stock = {
+            slot: self.request_to_stock[request_id]
+            for (request_id, slot) in message['Slots']
+        }
+        self.report("Attached to tick bus", message['Name'])
+
+    def readSharedBars(self, sequence):
+        """ Read this client's bars for a given tick from the tick bus """
+        bars = self.tick_bus.read(sequence, self.slot_to_stock)
+        return {
+            self.slot_to_stock[slot]: PriceBar(bar)
+            for slot, bar in bars.items()
+        }
+
+    def detachTickBus(self):
+        if self.tick_bus is not None:
+            self.tick_bus.close()
+            self.tick_bus = None
+
     def makeOrder(self, stock, shares):
         return stock.addOrder(shares)
 
@@ -0,0 +1,244 @@
+""" Incremental indicators for use in strategies.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import copy
+import math
+from abc import ABCMeta, abstractmethod
+from collections import deque
+
+from .pricebar import NANOSECONDS_PER_DAY
+
+# The price (or volume) of a bar that an indicator is calculated from.
+sources = {
+    "open" : lambda bar: bar.open,
+    "high" : lambda bar: bar.high,
+    "low" : lambda bar: bar.low,
+    "close" : lambda bar: bar.close,
+    "volume" : lambda bar: bar.volume,
+    "typical" : lambda bar: (bar.high + bar.low + bar.close) / 3,
+    "ohlc_average" : lambda bar: (bar.open + bar.high + bar.low + bar.close) / 4
+}
+
+class Indicator(metaclass=ABCMeta):
+    """
+    An indicator which is updated with each new bar, in constant time.
+
+    Indicators should be created through stock.getIndicator(IndicatorClass, ...)
+    in a strategy's bind() method. The stock keeps a single instance for each
+    class and set of arguments, and updates it once per bar before the strategies
+    see the bar, so strategies that use the same indicator share its computation.
+    However long the window, each update costs the same.
+    """
+    def __init__(self, source="close"):
+        assert source in sources, "source must be one of " + ", ".join(sources)
+        self.source = source
+        self.get = sources[source]
+        self.value = None
+        self.count = 0
+
+    @property
+    def ready(self):
+        """ Whether enough bars have been seen for the value to be meaningful """
+        return self.value is not None
+
+    @abstractmethod
+    def update(self, price_bar):
+        """ Update the indicator with a new bar """
+        pass
+
+    def snapshot(self):
+        """ A copy of the indicator's state, for restore() in a later session.
+        Callables, such as the source, are set by the constructor and left out. """
+        return copy.deepcopy({
+            name: value for (name, value) in vars(self).items()
+            if not callable(value)
+        })
+
+    def restore(self, state):
+        vars(self).update(state)
+
+class RollingSum(Indicator):
+    """ The sum over the last `length` bars """
+    def __init__(self, length, source="close"):
+        assert length > 0, "length must be greater than zero"
+        Indicator.__init__(self, source)
+        self.length = length
+        self.window = deque(maxlen=length)
+        self.total = 0.0
+
+    def push(self, value):
+        """ Add a value to the window, keeping the running total """
+        if len(self.window) == self.length:
+            self.total -= self.window[0]
+        self.window.append(value)
+        self.count += 1
+        if self.count % self.length == 0:
+            # Re-sum once per window, so rounding errors can't build up. This keeps
+            # the amortised cost of each update constant.
+            self.total = math.fsum(self.window)
+        else:
+            self.total += value
+
+    def update(self, price_bar):
+        self.push(self.get(price_bar))
+        if len(self.window) == self.length:
+            self.value = self.total
+
+class RollingMean(RollingSum):
+    """ The simple moving average over the last `length` bars """
+    def update(self, price_bar):
+        self.push(self.get(price_bar))
+        if len(self.window) == self.length:
+            self.value = self.total / self.length
+
+class ExponentialMovingAverage(Indicator):
+    """ The exponential moving average, with a smoothing factor of 2 / (length + 1).
+    It is ready once `length` bars have been seen. """
+    def __init__(self, length, source="close"):
+        assert length > 0, "length must be greater than zero"
+        Indicator.__init__(self, source)
+        self.length = length
+        self.alpha = 2 / (length + 1)
+        self.average = None
+
+    def update(self, price_bar):
+        value = self.get(price_bar)
+        if self.average is None:
+            self.average = value
+        else:
+            self.average += self.alpha * (value - self.average)
+        self.count += 1
+        if self.count >= self.length:
+            self.value = self.average
+
+class RollingVariance(Indicator):
+    """ The (population) variance over the last `length` bars.
+    Uses Welford's method, adapted to a sliding window, to remain stable. """
+    def __init__(self, length, source="close"):
+        assert length > 1, "length must be greater than one"
+        Indicator.__init__(self, source)
+        self.length = length
+        self.window = deque(maxlen=length)
+        self.mean = 0.0
+        self.squares = 0.0
+
+    def update(self, price_bar):
+        value = self.get(price_bar)
+        if len(self.window) < self.length:
+            self.window.append(value)
+            old_mean = self.mean
+            self.mean += (value - old_mean) / len(self.window)
+            self.squares += (value - old_mean) * (value - self.mean)
+        else:
+            removed = self.window[0]
+            self.window.append(value)
+            old_mean = self.mean
+            self.mean += (value - removed) / self.length
+            self.squares += (value - removed) * (value - self.mean + removed - old_mean)
+        self.count += 1
+        if len(self.window) == self.length:
+            self.value = max(self.squares, 0.0) / self.length
+
+class RollingStandardDeviation(RollingVariance):
+    """ The (population) standard deviation over the last `length` bars """
+    def update(self, price_bar):
+        RollingVariance.update(self, price_bar)
+        if self.value is not None:
+            self.value = math.sqrt(self.value)
+
+class RollingExtreme(Indicator):
+    """ The maximum or minimum over the last `length` bars, kept with a
+    monotonic deque so that each update is amortised constant time. """
+    def __init__(self, length, source, is_better):
+        assert length > 0, "length must be greater than zero"
+        Indicator.__init__(self, source)
+        self.length = length
+        self.is_better = is_better
+        # (index, value) pairs, whose values get worse from front to back
+        self.candidates = deque()
+
+    def update(self, price_bar):
+        value = self.get(price_bar)
+        candidates = self.candidates
+        while candidates and not self.is_better(candidates[-1][1], value):
+            candidates.pop()
+        candidates.append((self.count, value))
+        if candidates[0][0] <= self.count - self.length:
+            candidates.popleft()
+        self.count += 1
+        if self.count >= self.length:
+            self.value = candidates[0][1]
+
+class RollingMax(RollingExtreme):
+    """ The highest value over the last `length` bars """
+    def __init__(self, length, source="high"):
+        RollingExtreme.__init__(self, length, source, lambda kept, new: kept > new)
+
+class RollingMin(RollingExtreme):
+    """ The lowest value over the last `length` bars """
+    def __init__(self, length, source="low"):
+        RollingExtreme.__init__(self, length, source, lambda kept, new: kept < new)
+
+class VolumeWeightedAveragePrice(Indicator):
+    """ The volume weighted average price. Without a length, it covers the
+    current session and resets at the first bar of each day. With a length,
+    it covers the last `length` bars. """
+    def __init__(self, length=None, source="typical"):
+        Indicator.__init__(self, source)
+        self.length = length
+        self.day = None
+        self.weighted = RollingSum(length, "volume") if length else None
+        self.volumes = RollingSum(length, "volume") if length else None
+        self.total_weighted = 0.0
+        self.total_volume = 0.0
+
+    def update(self, price_bar):
+        weighted = self.get(price_bar) * price_bar.volume
+        self.count += 1
+        if self.length:
+            self.weighted.push(weighted)
+            self.volumes.push(price_bar.volume)
+            if len(self.volumes.window) < self.length:
+                return
+            total_weighted, total_volume = self.weighted.total, self.volumes.total
+        else:
+            day = price_bar.time // NANOSECONDS_PER_DAY
+            if day != self.day:
+                self.day = day
+                self.total_weighted = 0.0
+                self.total_volume = 0.0
+            self.total_weighted += weighted
+            self.total_volume += price_bar.volume
+            total_weighted, total_volume = self.total_weighted, self.total_volume
+        if total_volume > 0:
+            self.value = total_weighted / total_volume
+
+class AverageTrueRange(Indicator):
+    """ The average true range, with Wilder's smoothing over `length` bars """
+    def __init__(self, length=14):
+        assert length > 0, "length must be greater than zero"
+        Indicator.__init__(self, "close")
+        self.length = length
+        self.previous_close = None
+        self.total = 0.0
+
+    def update(self, price_bar):
+        true_range = price_bar.high - price_bar.low
+        if self.previous_close is not None:
+            true_range = max(
+                true_range,
+                abs(price_bar.high - self.previous_close),
+                abs(price_bar.low - self.previous_close)
+            )
+        self.previous_close = price_bar.close
+        self.count += 1
+        if self.count < self.length:
+            self.total += true_range
+        elif self.count == self.length:
+            self.value = (self.total + true_range) / self.length
+        else:
+            self.value += (true_range - self.value) / self.length
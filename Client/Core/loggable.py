@@ -1,14 +1,156 @@
-""" Contains the Loggable abstract class.
+""" Contains the Loggable abstract class, and the LogWriter that writes its records.
 
 Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
 Licensed under the MIT License. See LICENSE file
 in the project root for full license information.
 
 """
+import atexit
+import collections
 import datetime
+import os
 import sys
+import threading
+import time
 from abc import ABCMeta, abstractmethod
-class Loggable(ABCMeta):
+
+import ujson
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {
+    "DEBUG": DEBUG,
+    "INFO": INFO,
+    "WARNING": WARNING,
+    "ERROR": ERROR
+}
+LEVEL_NAMES = {level: name for (name, level) in LEVELS.items()}
+
+class LogWriter:
+    """ Writes log records to stdout and stderr in batches.
+
+    Loggables only append their records to a queue. A background thread wakes
+    every `flush_interval` seconds (or as soon as an error is logged), and
+    writes and flushes everything that has been queued, so that the cost of
+    the write and flush syscalls is shared by every record in the batch.
+    Records below `level` are dropped before they are formatted.
+
+    If `structured_file` is given, each record is also appended to it as a
+    line of JSON, with its time (in nanoseconds since the epoch), level, tag
+    and message.
+
+    Records are flushed when the process exits, and before it forks, so that
+    a forked child doesn't write its parent's records again. Processes which
+    exit through os._exit (e.g. multiprocessing children) should call
+    flushLogs() themselves.
+    """
+    def __init__(self, level=INFO, flush_interval=0.5, structured_file=None, asynchronous=True):
+        self.level = level
+        self.flush_interval = flush_interval
+        self.structured_file = structured_file
+        self.asynchronous = asynchronous
+        self.records = collections.deque()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.structured = None
+
+    def submit(self, level, tag, message):
+        """ Queue a record. The message has already been formatted. """
+        self.records.append((time.time_ns(), level, tag, message))
+        if not self.asynchronous:
+            self.flush()
+            return
+        if self.thread is None:
+            self.start()
+        if level >= ERROR:
+            self.wake.set()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="LogWriter", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """ Write every queued record """
+        with self.lock:
+            records = []
+            while self.records:
+                records.append(self.records.popleft())
+            if not records:
+                return
+            out = []
+            errors = []
+            for (timestamp, level, tag, message) in records:
+                line = "{:s} ~ {:s} >  {:s}\n".format(
+                    str(datetime.datetime.fromtimestamp(timestamp / 1e9))[:23],
+                    tag,
+                    message
+                )
+                (errors if level >= ERROR else out).append(line)
+            if out:
+                sys.stdout.write("".join(out))
+                sys.stdout.flush()
+            if errors:
+                sys.stderr.write("".join(errors))
+                sys.stderr.flush()
+            if self.structured_file is not None:
+                if self.structured is None:
+                    directory = os.path.dirname(self.structured_file)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self.structured = open(self.structured_file, "a")
+                self.structured.write("".join(
+                    ujson.dumps({
+                        "time": timestamp,
+                        "level": LEVEL_NAMES.get(level, str(level)),
+                        "tag": tag,
+                        "message": message
+                    }) + "\n"
+                    for (timestamp, level, tag, message) in records
+                ))
+                self.structured.flush()
+
+    def afterFork(self):
+        """ The writer thread isn't copied into a forked child, so start afresh """
+        self.records = collections.deque()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+log_writer = LogWriter()
+
+def configureLogging(level="INFO", flush_interval=0.5, structured_file=None, asynchronous=True):
+    """ Set the level (a name from LEVELS, or a number) below which records are
+    dropped, how often records are written, and an optional JSON lines file """
+    log_writer.flush()
+    log_writer.level = LEVELS[level] if isinstance(level, str) else level
+    log_writer.flush_interval = flush_interval
+    log_writer.asynchronous = asynchronous
+    if structured_file != log_writer.structured_file:
+        if log_writer.structured is not None:
+            log_writer.structured.close()
+            log_writer.structured = None
+        log_writer.structured_file = structured_file
+
+def flushLogs():
+    log_writer.flush()
+
+atexit.register(flushLogs)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=flushLogs, after_in_child=log_writer.afterFork)
+
+class Loggable(metaclass=ABCMeta):
     """A class used to log state information.
 
     Each child class needs to implement a getLogTag(self) method.
@@ -16,31 +158,37 @@ class Loggable(ABCMeta):
     into the log, so that the origin of each logged statement can be
     easily identified. Alongside this tag, a millisecond-precision
     timestamp is provided.
+
+    Messages are only formatted (the arguments converted to strings) if
+    their level is being logged, so debug messages in the hot path cost a
+    comparison when the level is INFO. Where building the arguments is
+    itself expensive, guard the call with isLogging(DEBUG).
     """
     @abstractmethod
     def getLogTag(self):
         """ Return a unique string identifying the origin of the log entry """
         pass
+    def isLogging(self, level):
+        """ Whether messages of the given level are being logged """
+        return level >= log_writer.level
+    def log(self, level, *arg):
+        """ Log a message at the given level, with a timestamp and a unique tag from getLogTag """
+        if level < log_writer.level:
+            return
+        log_writer.submit(level, self.getLogTag(), " ".join([str(part) for part in arg]))
+    def debug(self, *arg):
+        """ Log a message at the DEBUG level """
+        if DEBUG < log_writer.level:
+            return
+        log_writer.submit(DEBUG, self.getLogTag(), " ".join([str(part) for part in arg]))
     def report(self, *arg):
-        """ Log a message to stdout, with a timestamp and a unique tag from getLogTag """
-        print(
-            "{:s} ~ {:s} > ".format(
-                str(datetime.datetime.now())[:23],
-                self.getLogTag()
-            ),
-            *arg
-        )
-        # in cases that the output is piped to a file, flush it to the file
-        sys.stdout.flush()
+        """ Log a message to stdout at the INFO level """
+        if INFO < log_writer.level:
+            return
+        log_writer.submit(INFO, self.getLogTag(), " ".join([str(part) for part in arg]))
+    def reportWarning(self, *arg):
+        """ Log a message to stdout at the WARNING level """
+        self.log(WARNING, *arg)
     def reportError(self, *arg):
-        """ Log a message to stderr, with a timestamp and a unique tag from getLogTag """
-        print(
-            "{:s} ~ {:s} > ".format(
-                str(datetime.datetime.now())[:23],
-                self.getLogTag()
-            ),
-            *arg,
-            file=sys.stderr
-        )
-        # in cases that the output is piped to a file, flush it to the file
-        sys.stderr.flush()
+        """ Log a message to stderr at the ERROR level """
+        self.log(ERROR, *arg)
@@ -0,0 +1,197 @@
+""" Timers for the stages of processing a minute's bars, and their export.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import os
+import time
+import numpy
+import ujson
+
+class Histogram:
+    """ A histogram of durations, in nanoseconds, with logarithmic buckets.
+
+    Each power of two is split into four buckets, so that percentiles are
+    accurate to within 25%. The count, total and maximum are exact.
+
+    Recording a duration only appends it to a list. The durations are sorted
+    into the buckets in one vectorised pass when fold() is called, which
+    Metrics does every so often and before reading the histogram.
+    """
+    BUCKETS = 4 * 64
+
+    def __init__(self):
+        self.counts = numpy.zeros(self.BUCKETS, dtype=numpy.int64)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.pending = []
+        self.record = self.pending.append
+
+    def fold(self):
+        """ Add the recorded durations to the buckets """
+        if not self.pending:
+            return
+        durations = numpy.maximum(numpy.array(self.pending, dtype=numpy.int64), 0)
+        del self.pending[:]
+        self.count += len(durations)
+        self.total += int(durations.sum())
+        self.max = max(self.max, int(durations.max()))
+        # the number of bits in each duration (frexp is exact for these integers)
+        bits = numpy.frexp(durations.astype(numpy.float64))[1].astype(numpy.int64)
+        shifts = numpy.maximum(bits - 3, 0)
+        # the bucket is given by the position and the two bits below the leading bit
+        indices = numpy.where(bits <= 3, durations, shifts * 4 + (durations >> shifts))
+        self.counts += numpy.bincount(indices, minlength=self.BUCKETS)[:self.BUCKETS]
+
+    @staticmethod
+    def upperBound(index):
+        """ The largest duration that falls in a bucket """
+        if index < 8:
+            return index
+        shift = index // 4 - 1
+        return ((index % 4 + 4) << shift) + (1 << shift) - 1
+
+    def percentile(self, fraction):
+        """ An upper bound on the given percentile (as a fraction), in nanoseconds """
+        self.fold()
+        if self.count == 0:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts.tolist()):
+            seen += count
+            if count and seen >= target:
+                return min(self.upperBound(index), self.max)
+        return self.max
+
+    def summary(self):
+        """ The count, and the mean, 50th and 99th percentiles and maximum, in microseconds """
+        self.fold()
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count / 1000,
+            "p50_us": self.percentile(0.5) / 1000,
+            "p99_us": self.percentile(0.99) / 1000,
+            "max_us": self.max / 1000
+        }
+
+class Metrics:
+    """ Histograms of the time spent in each stage of a client's bar loop, and
+    in each symbol's processing, exported to a file every `interval` seconds.
+
+    Stages are timed with the monotonic clock:
+        start = metrics.clock()
+        ...
+        metrics.record("stage", start)
+
+    The export is either JSONL, where a line with every histogram's summary
+    is appended at each export, or Prometheus' text format, where the file is
+    rewritten with the latest values of every histogram (as a summary, with
+    quantiles, sum and count, in seconds).
+    """
+    # the number of durations held before they are sorted into buckets
+    FOLD_EVERY = 65536
+
+    def __init__(self, filename=None, export_format="jsonl", interval=60, labels=None):
+        assert export_format in ("jsonl", "prometheus"), "export_format must be jsonl or prometheus"
+        self.filename = filename
+        self.export_format = export_format
+        self.interval = interval
+        self.labels = labels or {}
+        self.stages = {}
+        self.symbols = {}
+        self.clock = time.perf_counter_ns
+        self.last_export = time.monotonic()
+        self.recorded = 0
+
+    def record(self, stage, start):
+        """ Record the time since `start` (from clock()) against a stage """
+        duration = self.clock() - start
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.record(duration)
+        self.recorded += 1
+
+    def recordSymbol(self, symbol, start):
+        """ Record the time since `start` (from clock()) against a symbol """
+        duration = self.clock() - start
+        histogram = self.symbols.get(symbol)
+        if histogram is None:
+            histogram = self.symbols[symbol] = Histogram()
+        histogram.record(duration)
+        self.recorded += 1
+
+    def fold(self):
+        for histogram in list(self.stages.values()) + list(self.symbols.values()):
+            histogram.fold()
+        self.recorded = 0
+
+    def summary(self):
+        return {
+            "stages": {stage: self.stages[stage].summary() for stage in self.stages},
+            "symbols": {symbol: self.symbols[symbol].summary() for symbol in self.symbols}
+        }
+
+    def exportIfDue(self, time_ns=None):
+        """ Export the metrics if `interval` seconds have passed since the last export """
+        if self.recorded >= self.FOLD_EVERY:
+            self.fold()
+        if time.monotonic() - self.last_export >= self.interval:
+            self.export(time_ns)
+
+    def export(self, time_ns=None):
+        """ Write the metrics to the file """
+        self.last_export = time.monotonic()
+        if self.filename is None:
+            return
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.export_format == "jsonl":
+            line = dict(self.labels)
+            line["time"] = time_ns
+            line.update(self.summary())
+            with open(self.filename, "a") as metrics_file:
+                metrics_file.write(ujson.dumps(line) + "\n")
+        else:
+            with open(self.filename + ".tmp", "w") as metrics_file:
+                metrics_file.write(self.formatPrometheus())
+            os.replace(self.filename + ".tmp", self.filename)
+
+    def formatPrometheus(self):
+        self.fold()
+        lines = []
+        for (name, key, histograms) in [
+            ("tarrow_stage_seconds", "stage", self.stages),
+            ("tarrow_symbol_seconds", "symbol", self.symbols)
+        ]:
+            lines.append("# TYPE {:s} summary".format(name))
+            for label in sorted(histograms):
+                histogram = histograms[label]
+                if histogram.count == 0:
+                    continue
+                labels = dict(self.labels)
+                labels[key] = label
+                for quantile in (0.5, 0.99, 1.0):
+                    value = histogram.max if quantile == 1.0 else histogram.percentile(quantile)
+                    lines.append("{:s}{{{:s}}} {:.9f}".format(
+                        name,
+                        self.formatLabels(labels, quantile=quantile),
+                        value / 1e9
+                    ))
+                lines.append("{:s}_sum{{{:s}}} {:.9f}".format(name, self.formatLabels(labels), histogram.total / 1e9))
+                lines.append("{:s}_count{{{:s}}} {:d}".format(name, self.formatLabels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def formatLabels(labels, quantile=None):
+        pairs = ['{:s}="{:s}"'.format(key, str(labels[key])) for key in sorted(labels)]
+        if quantile is not None:
+            pairs.append('quantile="{:g}"'.format(quantile))
+        return ",".join(pairs)
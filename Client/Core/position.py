@@ -0,0 +1,98 @@
+""" Contains the Position and Portfolio classes, running totals of a stock's trades.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+
+class Position:
+    """ Running totals of the trades made on a stock.
+
+    The stock updates its position as trades are filled and as each bar
+    arrives. Every update is constant time, however many trades are open, so
+    monitors (see TradeMonitor.notify_multiple) can check the profit of the
+    day without summing over the trades on every bar.
+
+    Only filled trades are counted: a trade counts towards the open position
+    once it has an open price, and towards the realized profit once it has a
+    close price.
+    """
+    def __init__(self):
+        # shares held, positive for long and negative for short
+        self.net_shares = 0
+        # what was paid for the shares held (negative for short positions)
+        self.cost_basis = 0.0
+        self.realized_profit = 0.0
+        self.unrealized_profit = 0.0
+        self.last_price = None
+        self.time = None
+
+    def fillOpen(self, trade):
+        """ A trade has been filled at its open price """
+        shares = trade.shares * trade.action
+        self.net_shares += shares
+        self.cost_basis += shares * trade.open_price
+        if self.last_price is not None:
+            self.unrealized_profit += (self.last_price - trade.open_price) * shares
+
+    def fillClose(self, trade):
+        """ A trade has been filled at its close price """
+        shares = trade.shares * trade.action
+        if self.last_price is not None:
+            self.unrealized_profit -= (self.last_price - trade.open_price) * shares
+        self.net_shares -= shares
+        self.cost_basis -= shares * trade.open_price
+        self.realized_profit += trade.profit
+
+    def mark(self, price, time):
+        """ Mark the open position to a new price """
+        if self.last_price is None:
+            self.unrealized_profit = self.net_shares * price - self.cost_basis
+        else:
+            self.unrealized_profit += (price - self.last_price) * self.net_shares
+        self.last_price = price
+        self.time = time
+
+    @property
+    def exposure(self):
+        """ The market value of the shares held """
+        return self.net_shares * (self.last_price or 0.0)
+
+    @property
+    def total_profit(self):
+        return self.realized_profit + self.unrealized_profit
+
+class Portfolio:
+    """ The combined position of a set of stocks, as seen by a portfolio
+    monitor. Totals are summed over the stocks when read, so they cost one
+    addition per stock rather than one per trade. """
+    def __init__(self, stocks):
+        self.stocks = stocks
+
+    def total(self, attribute):
+        return sum(getattr(self.stocks[symbol].position, attribute) for symbol in self.stocks)
+
+    @property
+    def realized_profit(self):
+        return self.total("realized_profit")
+
+    @property
+    def unrealized_profit(self):
+        return self.total("unrealized_profit")
+
+    @property
+    def total_profit(self):
+        return self.total("total_profit")
+
+    @property
+    def exposure(self):
+        return self.total("exposure")
+
+    @property
+    def time(self):
+        times = [
+            self.stocks[symbol].position.time for symbol in self.stocks
+            if self.stocks[symbol].position.time is not None
+        ]
+        return max(times) if times else None
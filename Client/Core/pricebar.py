@@ -1,13 +1,68 @@
 """
 
-Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.  
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
 Licensed under the MIT License. See LICENSE file
-in the project root for full license information.  
+in the project root for full license information.
 
 """
+import calendar
+import datetime
+
+# Bar times are integers, counting nanoseconds since the epoch (UTC).
+NANOSECONDS_PER_SECOND = 1000000000
+NANOSECONDS_PER_MINUTE = 60 * NANOSECONDS_PER_SECOND
+NANOSECONDS_PER_DAY = 24 * 60 * NANOSECONDS_PER_MINUTE
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Midnight of each day seen by parseTime, so that each date is only parsed once.
+_midnights = {}
+
+def parseTime(time):
+    """ Convert a bar's time into nanoseconds since the epoch.
+
+    Times are normally already integers. Some feeds send them as strings in
+    several formats, such as "20180102 09:30:00" or "2018-01-02  09:30:00", so
+    these are converted, parsing each date only once.
+    """
+    if not isinstance(time, str):
+        return int(time)
+    time = time.replace("  ", " ").replace("/", "").replace("-", "")
+    day, _, clock = time.partition(" ")
+    midnight = _midnights.get(day)
+    if midnight is None:
+        midnight = calendar.timegm(
+            datetime.datetime.strptime(day, "%Y%m%d").timetuple()
+        ) * NANOSECONDS_PER_SECOND
+        _midnights[day] = midnight
+    hours, minutes, seconds = clock.split(":")
+    return midnight + ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * NANOSECONDS_PER_SECOND
+
+def toDatetime(time):
+    """ Convert nanoseconds since the epoch into a datetime, for logging and reporting """
+    if time is None:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=time // 1000)
+
+def toNanoseconds(delta):
+    """ Convert a timedelta into an integer number of nanoseconds """
+    return (delta.days * 86400 + delta.seconds) * NANOSECONDS_PER_SECOND + delta.microseconds * 1000
+
+def formatTime(time):
+    """ Format nanoseconds since the epoch as a readable string """
+    return str(toDatetime(time))
 
 class PriceBar:
-    """ Represents a pricebar from gateway """
+    """ Represents a pricebar from gateway
+
+    A PriceBar is created for every stock, every minute, and strategies keep
+    many of them in their history, so it is stored without a per-instance
+    __dict__. Only the attributes below can be set.
+
+    The time is an integer number of nanoseconds since the epoch. A datetime
+    is only created when it is asked for, through the datetime property.
+    """
+    __slots__ = ("time", "open", "high", "low", "close", "volume")
+
     def __init__(self, bar_dict):
         """ Create a pricebar from a dictionary
         The dictionary should contain Time, Open,
@@ -20,9 +75,53 @@ class PriceBar:
         self.low = bar_dict['Low']
         self.volume = bar_dict['Volume']
 
+    @classmethod
+    def fromArrays(cls, times, opens, highs, lows, closes, volumes):
+        """ Create a list of pricebars from one array (or list) per field.
+        This is much cheaper than creating each bar from its own dictionary,
+        and is used for history responses, which can contain days of bars.
+        """
+        # NumPy scalars are far larger and slower than python floats, so
+        # convert whole arrays at once where we can.
+        columns = [
+            column.tolist() if hasattr(column, "tolist") else column
+            for column in (times, opens, highs, lows, closes, volumes)
+        ]
+        new = cls.__new__
+        price_bars = []
+        append = price_bars.append
+        for (time, open, high, low, close, volume) in zip(*columns):
+            price_bar = new(cls)
+            price_bar.time = time
+            price_bar.open = open
+            price_bar.high = high
+            price_bar.low = low
+            price_bar.close = close
+            price_bar.volume = volume
+            append(price_bar)
+        return price_bars
+
+    @classmethod
+    def fromColumns(cls, columns):
+        """ Create a list of pricebars from a dictionary of field -> list, with
+        the same keys as the dictionary given to the constructor. """
+        return cls.fromArrays(
+            columns['Time'],
+            columns['Open'],
+            columns['High'],
+            columns['Low'],
+            columns['Close'],
+            columns['Volume']
+        )
+
+    @property
+    def datetime(self):
+        """ The bar's time as a datetime object """
+        return toDatetime(self.time)
+
     def __repr__(self):
         """ Get the string representation of the pricebar """
-        return str(self.time)  + "," + \
+        return formatTime(self.time) + "," + \
                str(self.open)  + "," + \
                str(self.high)  + "," + \
                str(self.low)   + "," + \
@@ -0,0 +1,56 @@
+""" Contains the PhaseProfiler class, which times the phases of starting a client.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import time
+from contextlib import contextmanager
+
+class PhaseProfiler:
+    """ Accumulates the wall-clock time spent in named phases, e.g.
+
+        with profiler.phase("settings"):
+            ...
+
+    A phase can be entered many times (e.g. once per symbol), in which case
+    its time and count are summed. Phases are reported in the order they were
+    first entered. A disabled profiler times nothing, so the calls can be
+    left in place.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.totals = {}
+        self.counts = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds, count=1):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def format(self):
+        """ A table of the phases, with their total and mean time """
+        elapsed = time.perf_counter() - self.started
+        lines = ["{:24s} {:>6s} {:>10s} {:>10s} {:>6s}".format("phase", "count", "total (s)", "mean (ms)", "%")]
+        for name in self.totals:
+            lines.append("{:24s} {:6d} {:10.3f} {:10.3f} {:6.1f}".format(
+                name,
+                self.counts[name],
+                self.totals[name],
+                1000 * self.totals[name] / self.counts[name],
+                100 * self.totals[name] / elapsed if elapsed > 0 else 0.0
+            ))
+        lines.append("{:24s} {:6s} {:10.3f}".format("elapsed", "", elapsed))
+        return "\n".join(lines)
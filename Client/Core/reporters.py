@@ -7,8 +7,15 @@ Licensed under the MIT License. See LICENSE file
 in the project root for full license information.  
 
 """
+import threading
+import queue
+import traceback
 from abc import ABCMeta, abstractmethod
 
+import numpy
+
+from .loggable import Loggable
+
 class Reporter:
     """ Generic reporter class, used to report progress for the current clients' trades. """
     @abstractmethod
@@ -21,7 +28,7 @@ class Reporter:
     def newBars(self, controller, time):
         """ After each minutes' bars have been processed, this method is called. It should determine
         whether it is the right time to make a report (e.g. for an email every 10 minutes), and action
-        it accordingly """
+        it accordingly. The time is given in nanoseconds since the epoch. """
         pass
     @abstractmethod
     def endOfDay(self, controller):
@@ -50,4 +57,159 @@ class MultiReporter:
             reporter.newBars(controller, time)
     def endOfDay(self, controller):
         for reporter in self.child_reporters:
-            reporter.endOfDay(controller)
\ No newline at end of file
+            reporter.endOfDay(controller)
+
+class ControllerSnapshot:
+    """ A copy of the state of a Controller after a minute's bars, small enough
+    to be made every minute and safe to read from another thread. It has the
+    controller's version, environment, client_id and current_time, and for
+    each symbol in `positions`, a dictionary of its position's totals along
+    with its numbers of open and closed trades, and the number of trades it
+    has opened in all.
+
+    It also has the trade events since the previous snapshot, as dictionaries
+    of symbol -> NumPy columns: `opened`, the trades opened since then (with
+    the TradeBook's columns), and `closed`, the trades whose close has been
+    filled since then (with the TradeLedger's columns). A trade that opens and
+    closes between two snapshots is in both. The events are only copied for
+    the symbols whose trade counts have changed since the previous snapshot,
+    so that a minute without trades costs little more than the totals.
+    """
+    def __init__(self, controller, time, previous=None):
+        self.version = controller.version
+        self.environment = controller.environment
+        self.client_id = getattr(controller, "client_id", None)
+        self.current_time = time
+        self.positions = {}
+        self.opened = {}
+        self.closed = {}
+        since = None if previous is None else previous.current_time
+        for symbol in controller.stocks:
+            stock = controller.stocks[symbol]
+            position = stock.position
+            self.positions[symbol] = {
+                "net_shares": position.net_shares,
+                "last_price": position.last_price,
+                "realized_profit": position.realized_profit,
+                "unrealized_profit": position.unrealized_profit,
+                "exposure": position.exposure,
+                "open_trades": len(stock.open_trades),
+                "closed_trades": len(stock.closed_trades),
+                "opened_trades": stock.open_trades.appended
+            }
+            closed_before = 0
+            opened_before = 0
+            if previous is not None and symbol in previous.positions:
+                closed_before = previous.positions[symbol]["closed_trades"]
+                opened_before = previous.positions[symbol]["opened_trades"]
+            closed_count = self.positions[symbol]["closed_trades"] - closed_before
+            if closed_count > 0:
+                self.closed[symbol] = stock.closed_trades.latest(closed_count)
+            opened_count = self.positions[symbol]["opened_trades"] - opened_before
+            if opened_count == 0:
+                continue
+            # the trades opened since the previous snapshot, both those still
+            # open, which are among the last rows of the book, and those
+            # already closed
+            open_trades = stock.open_trades
+            first = 0 if opened_count < 0 else max(len(open_trades) - opened_count, 0)
+            sources = [{column: open_trades.view(column)[first:] for column in open_trades.COLUMNS}]
+            if symbol in self.closed:
+                sources.append(self.closed[symbol])
+            opened = {
+                column: numpy.concatenate([source[column] for source in sources]).astype(open_trades.view(column).dtype)
+                for column in open_trades.COLUMNS
+            }
+            if since is not None:
+                new = opened["open_time"] > since
+                opened = {column: values[new] for (column, values) in opened.items()}
+            if len(opened["open_time"]):
+                order = numpy.argsort(opened["open_time"], kind="stable")
+                self.opened[symbol] = {column: values[order] for (column, values) in opened.items()}
+
+    def total(self, name):
+        """ The sum of a value over every symbol """
+        return sum(position[name] for position in self.positions.values())
+
+    def addEarlier(self, earlier):
+        """ Add the trade events of an earlier snapshot which is being skipped, so
+        that this snapshot holds every event since the last one reported """
+        for (own, other) in ((self.opened, earlier.opened), (self.closed, earlier.closed)):
+            for symbol in other:
+                if symbol in own:
+                    own[symbol] = {
+                        column: numpy.concatenate((other[symbol][column], own[symbol][column]))
+                        for column in own[symbol]
+                    }
+                else:
+                    own[symbol] = other[symbol]
+
+class AsyncReporter(Loggable):
+    """ Runs a reporter on a background thread, so that reports (e.g. emails)
+    never hold up the processing of bars.
+
+    After each minute, the controller's state is copied into a
+    ControllerSnapshot, which is passed to the wrapped reporter's newBars in
+    place of the controller. If the reporter is still busy with an earlier
+    snapshot, the snapshots waiting for it are coalesced: only the latest is
+    reported, and the rest are counted in `coalesced`. The snapshot's totals
+    are cumulative, and the trade events of the skipped snapshots are added
+    to it, so nothing is lost by skipping one.
+
+    A report that raises an exception is logged, with its traceback, and
+    counted in `errors`; the thread carries on with the next snapshot.
+
+    endOfDay waits for the thread to finish, then passes the controller itself
+    to the wrapped reporter, as the bars have stopped by then.
+    """
+    def __init__(self, reporter):
+        self.reporter = reporter
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.previous = None
+        self.reported = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def initiate(self, version, environment, client_id):
+        self.reporter.initiate(version, environment, client_id)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def newBars(self, controller, time):
+        self.previous = ControllerSnapshot(controller, time, self.previous)
+        self.queue.put(self.previous)
+
+    def run(self):
+        """ The background thread: report the latest snapshot whenever one is waiting """
+        while True:
+            snapshot = self.queue.get()
+            finished = snapshot is None
+            while not finished and not self.queue.empty():
+                latest = self.queue.get()
+                if latest is None:
+                    finished = True
+                else:
+                    latest.addEarlier(snapshot)
+                    snapshot = latest
+                    self.coalesced += 1
+            if snapshot is not None:
+                try:
+                    self.reporter.newBars(snapshot, snapshot.current_time)
+                    self.reported += 1
+                except Exception:
+                    self.errors += 1
+                    self.reportError("Report failed:\n" + traceback.format_exc())
+            if finished:
+                return
+
+    def endOfDay(self, controller):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.previous = None
+        self.reporter.endOfDay(controller)
+
+    def getLogTag(self):
+        return "AsyncReporter"
@@ -0,0 +1,109 @@
+""" Contains the RiskLedger, the positions of every client process in shared memory.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import numpy
+
+from .sharedblock import SharedBlock
+
+class RiskLedger(SharedBlock):
+    """ A table in shared memory holding the profit and exposure of every
+    client process, so that limits can be applied to the whole portfolio.
+
+    run.py splits the symbols across several client processes, none of which
+    sees the others' trades. When the "risk_ledger" setting is on, run.py
+    creates a ledger with one row per client. After each minute, every
+    Controller writes its Portfolio's totals into its own row, and reads the
+    totals over all rows, without any messages being sent.
+
+    Each row is guarded by a sequence number (a seqlock). The writer makes the
+    number odd while it writes the row and even once it has finished, and
+    readers retry any row whose number was odd or changed while they read it.
+    As each row has a single writer, no locks are needed.
+
+    The ledger has the same totals as a Position, summed over the clients, so
+    it can be passed to a trade monitor's notify_multiple (see the
+    "global_monitor" setting).
+
+    The ledger is a SharedBlock, holding:
+        header    int64[4]                   clients, reserved
+        sequences int64[clients]             seqlock sequence number of each row
+        times     int64[clients]             time of each row, nanoseconds since the epoch
+        values    float64[clients, fields]   one column per field in FIELDS
+    """
+    FIELDS = ("realized_profit", "unrealized_profit", "exposure")
+
+    def layout(self):
+        self.clients = int(self.header[0])
+        self.view("sequences", (self.clients,), numpy.int64)
+        self.view("times", (self.clients,), numpy.int64)
+        self.view("values", (self.clients, len(self.FIELDS)), numpy.float64)
+
+    @staticmethod
+    def size(clients):
+        """ The number of bytes needed for a ledger with a given number of clients """
+        return 8 * (4 + clients * (2 + len(RiskLedger.FIELDS)))
+
+    @classmethod
+    def create(cls, clients):
+        """ Allocate a new ledger. Only run.py should do this, and it is responsible
+        for calling unlink() once every client has finished with it. """
+        ledger = cls.allocate(cls.size(clients), (clients, 0, 0, 0))
+        ledger.sequences[:] = 0
+        ledger.times[:] = 0
+        ledger.values[:] = 0.0
+        return ledger
+
+    def publish(self, row, time, position):
+        """ Write a client's totals into its row.
+        :param row the client's row, which no other client writes to
+        :param time the time of the totals, in nanoseconds since the epoch
+        :param position a Position or Portfolio holding the totals
+        """
+        self.sequences[row] += 1
+        self.times[row] = time or 0
+        for field_index, field in enumerate(self.FIELDS):
+            self.values[row, field_index] = getattr(position, field)
+        self.sequences[row] += 1
+
+    def read(self):
+        """ A consistent copy of every row's values """
+        before = self.sequences.copy()
+        values = self.values.copy()
+        after = self.sequences.copy()
+        pending = numpy.flatnonzero((before != after) | (before % 2 == 1))
+        while len(pending):
+            before = self.sequences[pending].copy()
+            values[pending] = self.values[pending]
+            after = self.sequences[pending]
+            # rows which were being written to while we copied them are read again
+            pending = pending[(before != after) | (before % 2 == 1)]
+        return values
+
+    def total(self, field):
+        return float(self.read()[:, self.FIELDS.index(field)].sum())
+
+    @property
+    def realized_profit(self):
+        return self.total("realized_profit")
+
+    @property
+    def unrealized_profit(self):
+        return self.total("unrealized_profit")
+
+    @property
+    def total_profit(self):
+        values = self.read()
+        return float(values[:, 0].sum() + values[:, 1].sum())
+
+    @property
+    def exposure(self):
+        return self.total("exposure")
+
+    @property
+    def time(self):
+        time = int(self.times.max())
+        return time if time > 0 else None
@@ -0,0 +1,46 @@
+""" Contains the DeadlineScheduler class, used for time-based trade rules.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import heapq
+
+class DeadlineScheduler:
+    """ Holds items until a deadline, in a min-heap keyed on the deadline.
+
+    Rules such as "close the trade after 30 minutes" or "close everything at
+    the end of the session" know when each trade is due as soon as it opens.
+    Scheduling the trade then means that each bar only pops the items that
+    are due, rather than checking every item against the clock: the cost of
+    a bar doesn't depend on how many items are waiting.
+
+    Deadlines are in nanoseconds since the epoch, as bar times are.
+    """
+    def __init__(self):
+        self.heap = []
+        # ties are broken in the order that items were scheduled
+        self.counter = 0
+
+    def schedule(self, deadline, item):
+        """ Hold an item until the given deadline """
+        self.counter += 1
+        heapq.heappush(self.heap, (deadline, self.counter, item))
+
+    def due(self, time):
+        """ Remove and return the items whose deadlines are at or before `time`,
+        earliest first """
+        items = []
+        heap = self.heap
+        while heap and heap[0][0] <= time:
+            items.append(heapq.heappop(heap)[2])
+        return items
+
+    @property
+    def next_deadline(self):
+        """ The earliest deadline, or None if nothing is scheduled """
+        return self.heap[0][0] if self.heap else None
+
+    def __len__(self):
+        return len(self.heap)
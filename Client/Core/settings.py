@@ -0,0 +1,234 @@
+""" Contains the SettingsResolver class, which finds the settings of every stock in a version.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import os
+import ast
+import csv
+import copy
+import pickle
+import hashlib
+import tempfile
+import importlib
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+def plainSettings(settings):
+    """ The settings with plain values: numbers, strings, and lists and
+    dictionaries of them """
+    def isPlain(value):
+        if isinstance(value, (bool, int, float, str, type(None))):
+            return True
+        if isinstance(value, (list, tuple)):
+            return all(isPlain(item) for item in value)
+        if isinstance(value, dict):
+            return all(isinstance(key, str) and isPlain(item) for (key, item) in value.items())
+        return False
+    return {name: settings[name] for name in settings if isPlain(settings[name])}
+
+def settingsHash(symbol, settings, strategy):
+    """ A hash of a stock's symbol, its plain settings and its strategy's
+    analysis_key(), which changes if any of them do. Objects such as
+    signallers and reporters don't affect it. It should be taken before any
+    bars have arrived, as strategies' keys may include their state. """
+    key = hashlib.sha256()
+    key.update(symbol.encode())
+    key.update(repr(sorted(plainSettings(settings).items())).encode())
+    key.update(strategy.analysis_key().encode())
+    return key
+
+class SettingsResolver:
+    """ Resolves each stock's settings for a version and an environment.
+
+    A stock's settings are, from lowest to highest priority:
+        the version and environment settings (Versions/[version]/[index|environment].py)
+        its row in Versions/[version]/Stocks.csv (or Stocks.toml)
+        Versions/[version]/Stocks/[symbol]/index.py
+        its row in Versions/[version]/Stocks-[environment].csv (or .toml)
+        Versions/[version]/Stocks/[symbol]/[environment].py
+
+    The manifests hold plain values (exchange, currency, thresholds...) for
+    any number of stocks in one file, with one row (or table) per symbol; the
+    Python files are still needed for objects such as strategies. In a CSV
+    manifest, the first column is the symbol, and the other cells are read as
+    Python literals where possible (otherwise as strings), with empty cells
+    left unset. In a TOML manifest, each symbol is a table.
+
+    The manifests and the list of which stocks have which Python files are
+    read in one pass over the version's directory, and cached (in the
+    version's __pycache__ directory) until the modification time of a
+    manifest or a stock directory changes. A stock's Python files are only
+    imported if they exist, rather than by trying and failing.
+    """
+    # increased whenever the layout of the cache changes
+    CACHE_FORMAT = 1
+
+    def __init__(self, version, environment):
+        self.version = version
+        self.environment = environment
+        self.directory = os.path.join("Versions", version)
+        self.stocks_directory = os.path.join(self.directory, "Stocks")
+        self.cache_file = os.path.join(
+            self.directory,
+            "__pycache__",
+            "settings-{:s}.pickle".format(environment)
+        )
+        self.loaded = False
+        # symbol -> settings, from Stocks.csv / Stocks.toml
+        self.manifest = {}
+        # symbol -> settings, from Stocks-[environment].csv / .toml
+        self.environment_manifest = {}
+        # symbol -> (whether it has an index.py, whether it has an [environment].py)
+        self.files = {}
+
+    def manifestFiles(self, suffix=""):
+        return [
+            os.path.join(self.directory, "Stocks{:s}.{:s}".format(suffix, extension))
+            for extension in ("csv", "toml")
+        ]
+
+    def stamps(self):
+        """ The modification time of each manifest and stock directory """
+        stamps = {}
+        for filename in self.manifestFiles() + self.manifestFiles("-" + self.environment):
+            try:
+                stamps[filename] = os.stat(filename).st_mtime_ns
+            except FileNotFoundError:
+                pass
+        try:
+            stamps[self.stocks_directory] = os.stat(self.stocks_directory).st_mtime_ns
+            with os.scandir(self.stocks_directory) as entries:
+                for entry in entries:
+                    if entry.is_dir() and entry.name != "__pycache__":
+                        stamps[entry.path] = entry.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+        return stamps
+
+    def load(self):
+        """ Read the manifests and find the stocks' Python files, from the cache if
+        nothing has changed since it was written """
+        stamps = self.stamps()
+        cache = self.readCache()
+        if cache is not None and cache["format"] == self.CACHE_FORMAT and cache["stamps"] == stamps:
+            self.manifest = cache["manifest"]
+            self.environment_manifest = cache["environment_manifest"]
+            self.files = cache["files"]
+        else:
+            self.manifest = self.readManifests(self.manifestFiles())
+            self.environment_manifest = self.readManifests(self.manifestFiles("-" + self.environment))
+            self.files = {}
+            environment_file = self.environment + ".py"
+            for path in stamps:
+                if os.path.dirname(path) == self.stocks_directory:
+                    names = set(os.listdir(path))
+                    self.files[os.path.basename(path)] = ("index.py" in names, environment_file in names)
+            self.writeCache({
+                "format": self.CACHE_FORMAT,
+                "stamps": stamps,
+                "manifest": self.manifest,
+                "environment_manifest": self.environment_manifest,
+                "files": self.files
+            })
+        self.loaded = True
+
+    def readCache(self):
+        try:
+            with open(self.cache_file, "rb") as cache_file:
+                return pickle.load(cache_file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def writeCache(self, cache):
+        # every client resolves its settings as it starts, so several may write
+        # the cache at once, each through a temporary file of its own
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(self.cache_file),
+                suffix=".tmp",
+                delete=False
+            ) as cache_file:
+                try:
+                    pickle.dump(cache, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+                except BaseException:
+                    cache_file.close()
+                    os.remove(cache_file.name)
+                    raise
+            os.replace(cache_file.name, self.cache_file)
+        except OSError:
+            # the cache only saves time, so a read-only directory is not an error
+            pass
+
+    def readManifests(self, filenames):
+        settings = {}
+        for filename in filenames:
+            if not os.path.exists(filename):
+                continue
+            if filename.endswith(".csv"):
+                manifest = self.readCSV(filename)
+            else:
+                manifest = self.readTOML(filename)
+            for symbol in manifest:
+                settings.setdefault(symbol, {}).update(manifest[symbol])
+        return settings
+
+    @staticmethod
+    def parseValue(value):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+
+    def readCSV(self, filename):
+        manifest = {}
+        with open(filename, newline="") as manifest_file:
+            rows = csv.reader(manifest_file)
+            header = [name.strip() for name in next(rows, [])]
+            for row in rows:
+                if not row or not row[0].strip():
+                    continue
+                manifest[row[0].strip()] = {
+                    name: self.parseValue(value.strip())
+                    for (name, value) in zip(header[1:], row[1:])
+                    if value.strip() != ""
+                }
+        return manifest
+
+    @staticmethod
+    def readTOML(filename):
+        if tomllib is None:
+            raise ImportError("Reading {:s} requires python 3.11 or later (tomllib)".format(filename))
+        with open(filename, "rb") as manifest_file:
+            return tomllib.load(manifest_file)
+
+    def symbols(self):
+        """ Every symbol with a manifest row or a stock directory """
+        if not self.loaded:
+            self.load()
+        return sorted(set(self.manifest) | set(self.files))
+
+    def resolve(self, symbol, global_settings):
+        """ The settings of a stock: a shallow copy of the global settings, overridden
+        by the stock's manifest rows and Python files """
+        if not self.loaded:
+            self.load()
+        stock_settings = copy.copy(global_settings)
+        has_index, has_environment = self.files.get(symbol, (False, False))
+        stock_settings.update(self.manifest.get(symbol, {}))
+        if has_index:
+            stock_settings.update(importlib.import_module(
+                "Versions.{:s}.Stocks.{:s}.index".format(self.version, symbol)
+            ).settings)
+        stock_settings.update(self.environment_manifest.get(symbol, {}))
+        if has_environment:
+            stock_settings.update(importlib.import_module(
+                "Versions.{:s}.Stocks.{:s}.{:s}".format(self.version, symbol, self.environment)
+            ).settings)
+        return stock_settings
@@ -0,0 +1,84 @@
+""" Contains the SharedBlock class, the base of the structures kept in shared memory.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy
+
+class SharedBlock:
+    """ A multiprocessing.shared_memory block, viewed as a set of NumPy arrays.
+
+    The block starts with a header of four int64 values, which tells the
+    processes that attach to it how large its arrays are. Subclasses lay out
+    their arrays after the header in layout(), by calling view() for each of
+    them in order. Arrays are little-endian and 8 byte aligned.
+
+    One process creates the block, and is responsible for calling unlink()
+    once every other process has finished with it. The others attach() to it
+    by name, and close() it when they are done.
+    """
+    HEADER_LENGTH = 4
+
+    def __init__(self, memory, owner):
+        """ Wrap an existing shared memory block. Use create() or attach() instead. """
+        self.memory = memory
+        self.owner = owner
+        # the names of the attributes viewing the memory, released by close()
+        self.views = []
+        self.offset = 0
+        self.view("header", (self.HEADER_LENGTH,), numpy.int64)
+        self.layout()
+
+    def layout(self):
+        """ Read the sizes from the header, and view() each array """
+        pass
+
+    def view(self, attribute, shape, dtype):
+        """ Set an attribute to an array of the given shape, placed after the
+        arrays viewed so far """
+        array = numpy.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=self.offset)
+        self.offset += array.nbytes
+        self.views.append(attribute)
+        setattr(self, attribute, array)
+        return array
+
+    @classmethod
+    def allocate(cls, size, header):
+        """ Create a new block of `size` bytes, with the given header values """
+        memory = shared_memory.SharedMemory(create=True, size=size)
+        header_view = numpy.ndarray((cls.HEADER_LENGTH,), dtype=numpy.int64, buffer=memory.buf)
+        header_view[:] = header
+        del header_view
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """ Attach to a block that was created by another process """
+        try:
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before python 3.13, attaching registers the block with this process'
+            # resource tracker, which would unlink it from under its creator on exit.
+            memory = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(memory._name, "shared_memory")
+        return cls(memory, owner=False)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def close(self):
+        """ Release the arrays, and detach from the shared memory """
+        for attribute in self.views:
+            delattr(self, attribute)
+        self.views = []
+        self.memory.close()
+
+    def unlink(self):
+        """ Destroy the shared memory block. Only the creator should call this. """
+        if self.owner:
+            self.memory.unlink()
@@ -5,10 +5,15 @@ Licensed under the MIT License. See LICENSE file
 in the project root for full license information.  
 
 """
+import threading
+import queue
+from time import perf_counter
+from collections import deque
 from .loggable import Loggable
+from .pricebar import formatTime
 from abc import ABCMeta, abstractmethod
 
-class Handler(ABCMeta, Loggable):
+class Handler(Loggable):
     """ Generic abstract class defining the methods that a signaller requires """
     @abstractmethod
     def initialise(self):
@@ -33,6 +38,18 @@ class Handler(ABCMeta, Loggable):
         """ Transmit a signal to close all open orders on a stock """
         #Close all orders
         pass
+    def netOrder(self, stock, shares, time):
+        """ Transmit an order for a net number of shares of a stock (positive to
+        buy, negative to sell). This is only sent by a NettingSignaller, in place
+        of the individual orders that it has netted. """
+        raise NotImplementedError(
+            "{:s} can't receive net orders".format(self.__class__.__name__)
+        )
+    def acceptsNetOrders(self):
+        """ Whether netOrder is implemented, i.e. whether this handler can be
+        wrapped by a NettingSignaller. Handlers that pass netOrder on to other
+        handlers accept it only if those do. """
+        return type(self).netOrder is not Handler.netOrder
     def flush(self):
         """ Flush any transmissions.
         This is called after all stocks have been processed, and is useful
@@ -40,6 +57,11 @@ class Handler(ABCMeta, Loggable):
         """
         # useful for signalling methods that introduce latency
         pass
+    def close(self):
+        """ Called when the session ends, after the final flush. Signallers that
+        hold resources such as threads or connections should release them here.
+        It may be called more than once. """
+        pass
     def getLogTag(self):
         return self.__class__.__name__
 
@@ -67,9 +89,17 @@ class MultiHandler(Handler):
     def closeAll(self, stock, time):
         for handler in self.handlers:
             handler.closeAll(stock, time)
+    def netOrder(self, stock, shares, time):
+        for handler in self.handlers:
+            handler.netOrder(stock, shares, time)
+    def acceptsNetOrders(self):
+        return all(handler.acceptsNetOrders() for handler in self.handlers)
     def flush(self):
         for handler in self.handlers:
             handler.flush()
+    def close(self):
+        for handler in self.handlers:
+            handler.close()
 
 class NullHandler(Handler):
     """ Sends no signals, useful for a stand-in when no signalling is required """
@@ -79,6 +109,8 @@ class NullHandler(Handler):
         pass
     def closeAll(self, stock, time):
         pass
+    def netOrder(self, stock, shares, time):
+        pass
     def initialise(self):
         pass
 
@@ -90,11 +122,227 @@ class BacktestSignaller(NullHandler):
         self.report("--- simulated signal ---")
         self.report("Start Order")
         self.report("Action: {:s}".format("Buy" if trade.action == 1 else "Sell"))
-        self.report("Time  : {:s}", str(trade.open_time))
+        self.report("Time  : {:s}".format(formatTime(trade.open_time)))
     def closeOrder(self, stock, trade):
         self.report("--- simulated signal ---")
         self.report("Closing Order")
-        self.report("Time  : {:s}", str(trade.close_time))
+        self.report("Time  : {:s}".format(formatTime(trade.close_time)))
     def closeAll(self, stock, time):
         self.report("--- simulated signal ---")
-        self.report("Closing ALL orders")
\ No newline at end of file
+        self.report("Closing ALL orders")
+    def netOrder(self, stock, shares, time):
+        self.report("--- simulated signal ---")
+        self.report("Net Order")
+        self.report("Action: {:s} {:d}".format("Buy" if shares > 0 else "Sell", abs(shares)))
+        self.report("Time  : {:s}".format(formatTime(time)))
+class DeferredHandler(Handler):
+    """ Records signals instead of transmitting them, so that they can be replayed
+    later in a deterministic order. This is used when stocks are processed
+    concurrently, where the order in which signals are raised depends on
+    scheduling rather than on the order of the stocks.
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.records = []
+    def initialise(self):
+        pass
+    def startOrder(self, stock, trade):
+        self.records.append(("startOrder", trade))
+    def closeOrder(self, stock, trade):
+        self.records.append(("closeOrder", trade))
+    def closeAll(self, stock, time):
+        self.records.append(("closeAll", time))
+    def replay(self, stock, handler=None):
+        """ Send the recorded signals to the wrapped handler (or to a given handler),
+        in the order in which they were raised. """
+        if handler is None:
+            handler = self.handler
+        for (method, argument) in self.records:
+            getattr(handler, method)(stock, argument)
+        self.records = []
+
+class AsyncSignaller(Handler):
+    """ Wraps a handler so that its signals are sent on a background thread.
+
+    Signals are raised from inside the bar loop, so a handler that does slow
+    I/O (HTTP, a FIX bridge, email) holds up every stock behind it. This
+    handler only appends each signal to a batch, which costs no I/O or
+    locking. When flush() is called at the end of the minute, the batch is
+    handed to a background thread through a queue, and the thread passes the
+    signals to the wrapped handler, in order, followed by its flush().
+
+    The trade objects are passed by reference, so the wrapped handler sees
+    them as they are when the signal is dispatched rather than when it was
+    raised.
+
+    getStatistics() gives the number of signals waiting to be sent (the queue
+    depth) and the latency of each signal, from being raised to being
+    dispatched.
+    """
+    def __init__(self, handler, latency_samples=1000):
+        self.handler = handler
+        self.batch = []
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        # Each counter is only written by one thread: submitted by the bar
+        # loop, and the rest by the background thread.
+        self.submitted = 0
+        self.dispatched = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.latencies = deque(maxlen=latency_samples)
+
+    def initialise(self):
+        if self.thread is not None:
+            return
+        self.handler.initialise()
+        self.thread = threading.Thread(target=self.dispatch, daemon=True)
+        self.thread.start()
+
+    def startOrder(self, stock, trade):
+        self.batch.append(("startOrder", stock, trade, perf_counter()))
+    def closeOrder(self, stock, trade):
+        self.batch.append(("closeOrder", stock, trade, perf_counter()))
+    def closeAll(self, stock, time):
+        self.batch.append(("closeAll", stock, time, perf_counter()))
+    def netOrder(self, stock, shares, time):
+        self.batch.append(("netOrder", stock, (shares, time), perf_counter()))
+
+    def acceptsNetOrders(self):
+        return self.handler.acceptsNetOrders()
+
+    def flush(self):
+        """ Hand the signals raised since the last flush to the background thread """
+        if self.thread is None:
+            self.initialise()
+        batch = self.batch
+        self.batch = []
+        self.submitted += len(batch)
+        self.queue.put(batch)
+
+    def dispatch(self):
+        """ The background thread: send each batch to the wrapped handler """
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            for (method, stock, argument, raised) in batch:
+                try:
+                    if method == "netOrder":
+                        self.handler.netOrder(stock, *argument)
+                    else:
+                        getattr(self.handler, method)(stock, argument)
+                except Exception as error:
+                    self.errors += 1
+                    self.reportError("{:s} failed: {:s}".format(method, str(error)))
+                latency = perf_counter() - raised
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+                self.latencies.append(latency)
+                self.dispatched += 1
+            try:
+                self.handler.flush()
+            except Exception as error:
+                self.errors += 1
+                self.reportError("flush failed: {:s}".format(str(error)))
+
+    def getStatistics(self):
+        """ The queue depth and signal latencies (in seconds) so far """
+        latencies = sorted(self.latencies)
+        return {
+            "submitted": self.submitted,
+            "dispatched": self.dispatched,
+            "queue_depth": self.submitted - self.dispatched,
+            "errors": self.errors,
+            "mean_latency": self.total_latency / self.dispatched if self.dispatched else None,
+            "median_latency": latencies[len(latencies) // 2] if latencies else None,
+            "max_latency": self.max_latency
+        }
+
+    def close(self):
+        """ Send any remaining signals, and wait for the background thread to finish """
+        if self.thread is None:
+            return
+        if self.batch:
+            self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.handler.close()
+
+    def getLogTag(self):
+        return "AsyncSignaller - " + self.handler.getLogTag()
+
+class NettingSignaller(Handler):
+    """ Nets the orders raised for each symbol during a minute, and sends only
+    the net change in position when flush() is called.
+
+    Strategies on the same symbol can raise opposing or duplicate orders in the
+    same minute, e.g. one trade closing while another opens in the same
+    direction. Rather than sending each order to the wrapped handler (and from
+    there, perhaps, to several handlers through a MultiHandler), this handler
+    adds up the change in shares that each order makes, and at flush() sends a
+    single netOrder for each symbol whose position has changed. Orders that
+    cancel out send nothing.
+
+    closeAll is passed on at flush(), before the net order of any trades raised
+    after it; orders raised before it in the same minute are dropped, as they
+    would be closed by it anyway.
+
+    The wrapped handler must implement netOrder, which is checked here rather
+    than at the first flush() with orders to send.
+    """
+    def __init__(self, handler):
+        if not handler.acceptsNetOrders():
+            raise TypeError(
+                "NettingSignaller can't wrap {:s}, as it (or a handler it wraps) doesn't implement netOrder".format(
+                    handler.__class__.__name__
+                )
+            )
+        self.handler = handler
+        # symbol -> [stock, net shares, closeAll time or None], in the order
+        # that the symbols first raised an order this minute
+        self.pending = {}
+        self.received = 0
+        self.sent = 0
+
+    def initialise(self):
+        self.handler.initialise()
+
+    def add(self, stock, shares):
+        entry = self.pending.setdefault(stock.symbol, [stock, 0, None])
+        entry[1] += shares
+        self.received += 1
+
+    def startOrder(self, stock, trade):
+        self.add(stock, trade.shares * trade.action)
+    def closeOrder(self, stock, trade):
+        self.add(stock, -trade.shares * trade.action)
+    def closeAll(self, stock, time):
+        self.pending[stock.symbol] = [stock, 0, time]
+        self.received += 1
+    def netOrder(self, stock, shares, time):
+        self.add(stock, shares)
+
+    def flush(self):
+        pending = self.pending
+        self.pending = {}
+        for (stock, shares, close_all_time) in pending.values():
+            if close_all_time is not None:
+                self.handler.closeAll(stock, close_all_time)
+                self.sent += 1
+            if shares != 0:
+                self.handler.netOrder(stock, shares, stock.current_time)
+                self.sent += 1
+        self.handler.flush()
+
+    def getStatistics(self):
+        """ The number of orders received, and the number sent after netting """
+        return {"received": self.received, "sent": self.sent}
+
+    def close(self):
+        self.handler.close()
+
+    def getLogTag(self):
+        return "NettingSignaller - " + self.handler.getLogTag()
@@ -0,0 +1,64 @@
+""" Contains the SnapshotStore class, which keeps the latest snapshot of each stock on disk.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import os
+import pickle
+import tempfile
+
+class SnapshotStore:
+    """ Saves and loads the snapshots of stocks (see Stock.snapshot), one file
+    per symbol in `directory`, so that a client can restore each stock's
+    history, indicators and strategy when it starts, and only replay the bars
+    that arrived since.
+
+    Each snapshot is saved with a key, the hash of the stock's settings (see
+    settingsHash), and is only loaded with the same key: a snapshot taken with
+    different parameters would give the strategy the wrong state. Snapshots
+    are pickled, so NumPy arrays are stored as raw bytes, and are replaced
+    atomically so that a client stopped while saving leaves the previous
+    snapshot intact. Each save is written to its own temporary file, so two
+    processes saving the same symbol can't interleave their writes.
+    """
+    # increased whenever the layout of a stock's snapshot changes
+    FORMAT = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def getFilename(self, symbol):
+        return os.path.join(self.directory, "{:s}.pickle".format(symbol))
+
+    def save(self, symbol, key, state):
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory,
+            prefix=symbol + ".",
+            suffix=".tmp",
+            delete=False
+        ) as snapshot_file:
+            try:
+                pickle.dump(
+                    {"format": self.FORMAT, "key": key, "state": state},
+                    snapshot_file,
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+            except BaseException:
+                snapshot_file.close()
+                os.remove(snapshot_file.name)
+                raise
+        os.replace(snapshot_file.name, self.getFilename(symbol))
+
+    def load(self, symbol, key):
+        """ The stock's snapshot, or None if there isn't one saved with this key """
+        try:
+            with open(self.getFilename(symbol), "rb") as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        if snapshot.get("format") != self.FORMAT or snapshot.get("key") != key:
+            return None
+        return snapshot["state"]
@@ -5,6 +5,7 @@ Licensed under the MIT License. See LICENSE file
 in the project root for full license information.  
 
 """
+import copy
 import datetime
 import sys
 
@@ -13,6 +14,11 @@ from .strategy import NullStrategy
 from .trademonitor import NullTradeMonitor
 from .signals import NullHandler
 from .trade import Trade
+from .pricebar import parseTime, toNanoseconds
+from .barseries import BarSeries
+from .tradebook import TradeBook
+from .position import Position
+from .tradeledger import TradeLedger
 
 class Stock(Loggable):
     def __init__(self, gateway, symbol, exchange):
@@ -24,6 +30,9 @@ class Stock(Loggable):
         self.exchange = exchange
         # difference between the timestamp on incoming bars and the market time
         self.time_offset = datetime.timedelta(minutes=0)
+        # time_offset in nanoseconds, converted when time_offset changes
+        self.cached_time_offset = None
+        self.time_offset_nanoseconds = 0
         # The strategy, used to handle trading decisions
         self.strategy = NullStrategy()
         # The trade monitor, used to determine when an open trade should be closed
@@ -45,28 +54,153 @@ class Stock(Loggable):
         self.current_bar = None
         self.current_time = None
         self.previous_time = None
-        self.open_trades = []
-        self.closed_trades = []
+        # The number of bars of history to keep (one trading day by default).
+        # This is raised if the strategy needs more. The history itself, a
+        # BarSeries shared by all strategies on this stock, is created in initialise().
+        self.history_length = 390
+        self.bars = None
+        # Indicators shared by this stock's strategies, keyed by their class and
+        # arguments, and updated once per bar. See getIndicator().
+        self.indicators = {}
+        # Values calculated from the current bar, shared between strategies and
+        # cleared when a new bar arrives. See memoise().
+        self.memo = {}
+        self.open_trades = TradeBook()
+        # Trades are moved from open_trades to closed_trades, a TradeLedger, once
+        # their close has been filled. With a directory, the ledger writes
+        # trades to disk every trade_ledger_capacity trades.
+        self.trade_ledger_directory = None
+        self.trade_ledger_capacity = 4096
+        self.closed_trades = TradeLedger(symbol)
+        # Running totals of the filled trades, for monitors. See Position.
+        self.position = Position()
+        # The data that the strategy is fitted to before trading, from load().
+        self.warm_up_data = None
         self.open_orders = {}
         self.close_orders = {}
         self.unique_id = 0
 
-    def addLivePriceBar(self, price_bar, adjustTimeZone):
+    def applySettings(self, settings):
+        """ Set the stock's attributes from a dictionary of settings. The stock
+        gets its own copy of the strategy and the trade monitor, as both keep
+        per-stock state (the stock a strategy is bound to and its indicators,
+        or the trades a monitor has scheduled to close), and those set in the
+        global or version settings would otherwise be shared by every stock. """
+        for option_name in settings:
+            if not hasattr(self, option_name):
+                self.reportWarning(
+                    "Warning: attribute {:s} hasn't got a default value".format(
+                        option_name
+                    )
+                )
+            value = settings[option_name]
+            if option_name in ("strategy", "trade_monitor"):
+                value = copy.deepcopy(value)
+            setattr(self, option_name, value)
+
+    def initialise(self):
+        """ Prepare the stock once its settings have been applied: create its
+        history, give the strategy its stock, and initialise the signaller. """
+        self.bars = BarSeries(max(self.history_length, self.strategy.required_history(), 1))
+        self.closed_trades = TradeLedger(
+            self.symbol,
+            self.trade_ledger_directory,
+            self.trade_ledger_capacity
+        )
+        self.strategy.bind(self)
+        self.signaller.initialise()
+
+    def getIndicator(self, indicator_class, *args, **kwargs):
+        """ Get an indicator on this stock's bars, creating it if no strategy has
+        asked for it yet. Strategies asking for the same class with the same
+        arguments share one instance, which is updated once per bar. """
+        key = (indicator_class, args, tuple(sorted(kwargs.items())))
+        if key not in self.indicators:
+            self.indicators[key] = indicator_class(*args, **kwargs)
+        return self.indicators[key]
+
+    def memoise(self, key, calculate):
+        """ Return the value stored under key for the current bar, calling
+        calculate() to work it out if no strategy has done so yet. """
+        if key not in self.memo:
+            self.memo[key] = calculate()
+        return self.memo[key]
+
+    def load(self):
+        """ Load the data that the strategy is fitted to (see Strategy.load_data) """
+        self.warm_up_data = self.strategy.load_data(self)
+
+    def analyse(self):
+        """ Fit the strategy to the loaded data. The Controller does this through
+        a WarmUp, which runs analyse() in worker processes and caches the results. """
+        self.strategy.apply_analysis(self.strategy.analyse(self.warm_up_data))
+
+    def snapshot(self):
+        """ The state built up from the bars seen so far: the history, the
+        indicators, and the strategy's and trade monitor's own state. Open
+        trades and positions aren't included. """
+        return {
+            "time": self.current_time,
+            "bars": self.bars.snapshot(),
+            "indicators": {key: indicator.snapshot() for (key, indicator) in self.indicators.items()},
+            "strategy": self.strategy.snapshot(),
+            "trade_monitor": self.trade_monitor.snapshot()
+        }
+
+    def restore(self, state):
+        """ Restore the state from snapshot(), once the stock has been initialised """
+        self.current_time = state["time"]
+        self.bars.restore(state["bars"])
+        for key in state["indicators"]:
+            if key in self.indicators:
+                self.indicators[key].restore(state["indicators"][key])
+        self.strategy.restore(state["strategy"])
+        self.trade_monitor.restore(state["trade_monitor"])
+
+    def getServerTime(self, time):
+        """ Convert a market time back into the time of the server's bars (see adjustBarTime) """
+        if self.is_backtest:
+            return time
+        return time - toNanoseconds(self.time_offset)
+
+    def updateIndicators(self, price_bar):
+        for indicator in self.indicators.values():
+            indicator.update(price_bar)
+
+    def addHistoricalPriceBars(self, price_bars, adjustTimeZone=True, since=None):
+        """ Add bars from before the client started, so that strategies
+        have some history to work with. If the stock was restored from a
+        snapshot, bars up to its time (`since`) are skipped. """
+        for price_bar in price_bars:
+            self.adjustBarTime(price_bar, adjustTimeZone)
+            if since is not None and price_bar.time <= since:
+                continue
+            self.memo = {}
+            self.bars.append(price_bar)
+            self.updateIndicators(price_bar)
+            self.strategy.add_record(price_bar)
+
+    def addLivePriceBar(self, price_bar, adjustTimeZone=True):
         """ When a live price bar is received through the Controller,
         it is passed to this method. It is best to keep processing minimal
         at this stage to allow minimalise blocking of the ZMQ socket. Once
         all stocks' pricebars are in, processNewBar is called, and this
         is where any heavier processing should occur. """
         self.adjustBarTime(price_bar, adjustTimeZone)
-        self.report("Received price bar: ", price_bar)
+        self.debug("Received price bar: ", price_bar)
         self.previous_time = self.current_time
         self.current_bar = price_bar
         self.current_time = self.current_bar.time
+        self.memo = {}
+        self.bars.append(self.current_bar)
+        self.updateIndicators(self.current_bar)
         self.strategy.add_record(self.current_bar)
 
-    def processNewBar(self):
-        # first, make a decision on whether to trade
-        decision = self.strategy.decide()
+    def processNewBar(self, decision=None):
+        # first, make a decision on whether to trade, unless the decision has
+        # already been made for us by a universe strategy.
+        if decision is None:
+            decision = self.strategy.decide()
         if decision != 0:
             self.startOrder(decision)
 
@@ -77,14 +211,29 @@ class Stock(Loggable):
             order_ids = list(self.open_orders) + list(self.close_orders)
             for order_id in order_ids:
                 self.setOrderFilled(order_id, self.current_bar.open)
+        self.position.mark(self.current_bar.close, self.current_time)
 
-        # Monitor open trades for opening and closing purposes.
-        for i in range(len(self.open_trades)):
-            trade = self.open_trades[i]
-            if not self.trade_monitor.notify_single(trade, self.current_bar):
+        # Monitor open trades for opening and closing purposes. Monitors that
+        # support it check every trade at once; otherwise each trade is checked
+        # in turn.
+        if len(self.open_trades) > 0:
+            keep = self.trade_monitor.notify_array(self.open_trades, self.current_bar)
+            if keep is None:
+                keep = [
+                    self.trade_monitor.notify_single(trade, self.current_bar)
+                    for trade in self.open_trades
+                ]
+            for trade in self.open_trades.keep(keep):
                 trade.close()
-                self.closed_trades.append(trade)
-                del self.open_trades[i]
+
+        # Then monitor the position as a whole, e.g. for a daily stop loss.
+        if not self.trade_monitor.notify_multiple(self.position, self.current_bar):
+            self.closeAllTrades()
+
+    def closeAllTrades(self):
+        """ Close every open trade """
+        for trade in self.open_trades.keep([False] * len(self.open_trades)):
+            trade.close()
 
     def startOrder(self, action):
         """ Create a Trade object
@@ -92,7 +241,12 @@ class Stock(Loggable):
         """
         current_price = self.current_bar.close
         shares = int(self.trade_amount * 100) // int(current_price * 100)
-        self.open_trades.append(Trade(self, shares, action))
+        trade = Trade(self, shares, action)
+        self.open_trades.append(trade)
+        trade.open()
+        # the open time is only known once the trade is opened
+        self.open_trades.update(trade)
+        self.trade_monitor.register(trade)
     def handleOpenOrder(self, trade):
         """Register the trade to receive the price at the next bar
         to be used as an opening value
@@ -111,25 +265,31 @@ class Stock(Loggable):
         # This can be used either from the gateway or from this class itself, depending
         # on whether you're doing a simple simulation or a real-life trade.
         if order_id in self.open_orders:
-            self.open_orders[order_id].openSuccess(averagePrice)
+            trade = self.open_orders[order_id]
+            trade.openSuccess(averagePrice)
+            self.position.fillOpen(trade)
+            if trade in self.open_trades:
+                self.open_trades.update(trade)
             del self.open_orders[order_id]
         elif order_id in self.close_orders:
-            self.close_orders[order_id].closeSuccess(averagePrice)
+            trade = self.close_orders[order_id]
+            trade.closeSuccess(averagePrice)
+            self.position.fillClose(trade)
+            self.closed_trades.append(trade)
             del self.close_orders[order_id]
 
     def adjustBarTime(self, price_bar, doAdjust=True):
-        """Convert a pricebar's string timestamp into a datetime object.
+        """Shift a pricebar's timestamp, in nanoseconds since the epoch, into market time.
 
-        Bar datetimes can come in different formats. This method tries to
-        catch several formats in one go.
+        Bars from feeds that still send string timestamps are converted first.
         """
-        time = price_bar.time
-        time = time.replace("  ", " ")
-        time = time.replace("/", "")
-        time = time.replace("-", "")
-        price_bar.time = datetime.datetime.strptime(price_bar.time, "%Y%m%d %H:%M:%S")
+        if isinstance(price_bar.time, str):
+            price_bar.time = parseTime(price_bar.time)
         if doAdjust and not self.is_backtest:
-            price_bar.time += self.time_offset
+            if self.time_offset is not self.cached_time_offset:
+                self.cached_time_offset = self.time_offset
+                self.time_offset_nanoseconds = toNanoseconds(self.time_offset)
+            price_bar.time += self.time_offset_nanoseconds
 
     def getLogTag(self):
         return "Stock - {:s}".format(self.symbol)
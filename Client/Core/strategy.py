@@ -6,14 +6,94 @@ in the project root for full license information.
 
 """
 from abc import abstractmethod, ABCMeta
-class Strategy(ABCMeta):
+import copy
+import numpy
+
+from .indicators import Indicator, RollingMean
+
+class Strategy(metaclass=ABCMeta):
     """
     Data storage and handling approaches can vary wildly, so we aim to provide
     a flexible way of allowing users of TArrow to handle data in their own way.
 
     This strategy class is our way of doing this. Users can customise how new
     bars are handled, and how decisions are made. The rest is handled by TArrow.
+
+    Each stock keeps its own history of bars in stock.bars, a BarSeries, which
+    every strategy on that stock shares. A strategy is given its stock through
+    bind() once the stock's settings are loaded, and should read its history
+    from there rather than storing bars itself. Rolling calculations should use
+    indicators from stock.getIndicator(), which are updated in constant time and
+    shared with the stock's other strategies. Other values that several strategies
+    calculate from the same bar can be shared through stock.memoise().
+
+    decide() may be skipped by a MultiStrategy once its vote is settled, so any
+    state should be updated in add_record(), leaving decide() free of side effects.
+
+    Strategies which are fitted before trading starts (e.g. a model trained on
+    past data) do so in three steps: load_data() reads the data, analyse() fits
+    to it and returns what was learnt, and apply_analysis() stores that. The
+    Controller runs analyse() for many stocks at once in worker processes, and
+    caches its results on disk, keyed on analysis_key() and the data (see
+    WarmUp), so that a restarted client doesn't fit every stock again.
+
+    With the "snapshots" setting, the state of each strategy is saved with its
+    stock's history and indicators (see Stock.snapshot), and restored when the
+    client next starts, so that only the bars since then need to be replayed.
     """
+    # A rough, relative, estimate of the cost of decide(). A MultiStrategy asks
+    # its cheapest children first. Override it, or set it on an instance.
+    cost = 1
+    # Whether the strategy needs every stock's bar of the minute to have arrived
+    # before it decides (e.g. it reads other stocks). If so, the Controller
+    # doesn't stream bars to stocks as they arrive (see the "streaming" setting).
+    requires_barrier = False
+    def bind(self, stock):
+        """ Called with the stock that this strategy trades, before any bars arrive """
+        self.stock = stock
+    def required_history(self):
+        """ The number of bars that this strategy needs the stock to keep """
+        return 0
+    def load_data(self, stock):
+        """ Return the data that analyse() fits this strategy to, e.g. read from disk """
+        return None
+    def analyse(self, data):
+        """ Fit the strategy to the data from load_data(), and return what was learnt.
+        This may run in a worker process, on a copy of the strategy, and its result
+        is cached, so it must depend only on the data and analysis_key(), and
+        return a picklable value rather than storing it. """
+        return None
+    def apply_analysis(self, analysis):
+        """ Store the result of analyse() """
+        pass
+    def needs_analysis(self):
+        """ Whether analyse() has been overridden """
+        return type(self).analyse is not Strategy.analyse
+    def snapshot(self):
+        """ A copy of the strategy's state, for restore() in a later session. By
+        default, every attribute other than its stock, the indicators it shares
+        with the stock (which the stock snapshots) and callables. This includes
+        whatever apply_analysis() stored, which the Controller replaces with the
+        analysis of the current data after restoring. """
+        return copy.deepcopy({
+            name: value for (name, value) in vars(self).items()
+            if name != "stock" and not isinstance(value, (Indicator, Strategy)) and not callable(value)
+        })
+    def restore(self, state):
+        """ Restore the state from snapshot(). This is called after bind(). """
+        vars(self).update(state)
+    def analysis_key(self):
+        """ A string identifying the parameters that analyse() depends on. By default,
+        the class name and every public attribute with a plain value. """
+        plain = (bool, int, float, str, type(None))
+        return "{:s}({:s})".format(
+            type(self).__qualname__,
+            ", ".join(
+                "{:s}={!r}".format(name, value)
+                for (name, value) in sorted(vars(self).items())
+                if not name.startswith("_") and isinstance(value, plain)
+            )
+        )
     @abstractmethod
     def add_record(self, record):
         pass
@@ -21,16 +101,59 @@ class Strategy(ABCMeta):
     def decide(self):
         """ Return 1 to go long, -1 to go short, 0 to do nothing. """
         pass
+    def decide_batch(self, columns):
+        """ Optionally, make the decisions for a whole day of bars at once.
+        This is used by the OfflineEngine. columns is a dictionary of NumPy arrays,
+        keyed by PriceBar attribute name (time, open, high, low, close, volume).
+        Return an array with one decision per bar, equal to what decide() would
+        have returned after that bar, or None if this isn't supported. """
+        return None
 
 class MultiStrategy(Strategy):
     """
     Combine multiple strategies with a vote-like system.
+
+    Children are asked for their decisions cheapest first (see Strategy.cost), and
+    the vote stops as soon as the remaining children can no longer change its outcome.
     """
     def __init__(self, child_strategies, minimal_agreement):
         assert hasattr(child_strategies, '__iter__'), "child_strategies must be iterable"
         assert minimal_agreement > 0, "minimal_agreement must be greater than zero"
         self.child_strategies = child_strategies
         self.minimal_agreement = minimal_agreement
+        # sorted() is stable, so children of equal cost keep their given order.
+        self.evaluation_order = sorted(child_strategies, key=lambda strategy: strategy.cost)
+        self.cost = sum(strategy.cost for strategy in child_strategies)
+        self.requires_barrier = any(strategy.requires_barrier for strategy in child_strategies)
+    def bind(self, stock):
+        """ Bind all child strategies to the stock, so that they share its history """
+        self.stock = stock
+        for strategy in self.child_strategies:
+            strategy.bind(stock)
+    def required_history(self):
+        return max([strategy.required_history() for strategy in self.child_strategies] + [0])
+    def load_data(self, stock):
+        return [strategy.load_data(stock) for strategy in self.child_strategies]
+    def analyse(self, data):
+        return [
+            strategy.analyse(child_data)
+            for (strategy, child_data) in zip(self.child_strategies, data)
+        ]
+    def apply_analysis(self, analysis):
+        for (strategy, child_analysis) in zip(self.child_strategies, analysis):
+            strategy.apply_analysis(child_analysis)
+    def needs_analysis(self):
+        return any(strategy.needs_analysis() for strategy in self.child_strategies)
+    def snapshot(self):
+        return [strategy.snapshot() for strategy in self.child_strategies]
+    def restore(self, state):
+        for (strategy, child_state) in zip(self.child_strategies, state):
+            strategy.restore(child_state)
+    def analysis_key(self):
+        return "MultiStrategy({:d}, [{:s}])".format(
+            self.minimal_agreement,
+            ", ".join(strategy.analysis_key() for strategy in self.child_strategies)
+        )
     def add_record(self, record):
         """ Add the bar to all child strategies """
         for strategy in self.child_strategies:
@@ -40,11 +163,33 @@ class MultiStrategy(Strategy):
         If the majority is greater than self.minimal_agreement,
         it is used as the final decision. """
         total = 0
-        for strategy in self.child_strategies:
+        remaining = len(self.evaluation_order)
+        for strategy in self.evaluation_order:
             total += strategy.decide()
+            remaining -= 1
+            if abs(total) + remaining < self.minimal_agreement:
+                # even if every remaining child agreed, there would be no majority
+                return 0
+            if abs(total) - remaining >= self.minimal_agreement:
+                # even if every remaining child disagreed, the majority would hold
+                break
         if abs(total) >= self.minimal_agreement:
-            return total / abs(total)
+            return 1 if total > 0 else -1
         return 0
+    def decide_batch(self, columns):
+        """ Tally the children's batch decisions, if they all support them """
+        totals = 0
+        for strategy in self.child_strategies:
+            decisions = strategy.decide_batch(columns)
+            if decisions is None:
+                return None
+            totals = totals + numpy.asarray(decisions, dtype=numpy.int64)
+        totals = numpy.broadcast_to(totals, columns["close"].shape)
+        return numpy.where(
+            numpy.abs(totals) >= self.minimal_agreement,
+            numpy.sign(totals),
+            0
+        ).astype(numpy.int8)
 
 class NullStrategy(Strategy):
     """
@@ -55,10 +200,71 @@ class NullStrategy(Strategy):
     def decide(self):
         return 0
 
-# Example strategy. Far too naive for real use.
+class UniverseStrategy(metaclass=ABCMeta):
+    """
+    A cross-sectional strategy, which makes decisions for every stock at once.
+
+    Rather than being called once per stock, a universe strategy is called once
+    per minute by the Controller with the bars of every stock that received one.
+    The bars are given as a (symbols x fields) array, with one column for each
+    PriceBar attribute named in self.fields, so that ranks, z-scores across the
+    universe and pairs can be computed with NumPy in one go.
+
+    It is set with the "universe_strategy" setting, and its decisions are used in
+    place of each stock's own strategy.
+    """
+    fields = ("open", "high", "low", "close", "volume")
+    @abstractmethod
+    def decide(self, symbols, bars):
+        """ Return an array with one decision per symbol, in the same order as symbols:
+        1 to go long, -1 to go short, 0 to do nothing. """
+        pass
+
+    def getBarArray(self, symbols, price_bars):
+        """ Convert a dictionary of symbol -> PriceBar into the array passed to decide() """
+        fields = self.fields
+        return numpy.array(
+            [[getattr(price_bars[symbol], field) for field in fields] for symbol in symbols],
+            dtype=numpy.float64
+        ).reshape(len(symbols), len(fields))
+
+# Example strategies. Far too naive for real use.
+
+class ZScoreUniverseStrategy(UniverseStrategy):
+    """
+    A simple cross-sectional mean reversion strategy.
+
+    Each minute, the return of every stock since its previous close is compared
+    with the returns of the rest of the universe. Stocks which have moved more
+    than `threshold` standard deviations above the average are shorted, and
+    those that have moved as far below it are bought.
+    """
+    fields = ("close",)
+    def __init__(self, threshold=2):
+        assert threshold > 0, "threshold must be greater than zero"
+        self.threshold = threshold
+        self.previous_closes = {}
+
+    def decide(self, symbols, bars):
+        closes = bars[:, 0]
+        previous = numpy.array(
+            [self.previous_closes.get(symbol, numpy.nan) for symbol in symbols]
+        )
+        self.previous_closes.update(zip(symbols, closes))
+        returns = closes / previous - 1
+        known = ~numpy.isnan(returns)
+        decisions = numpy.zeros(len(symbols), dtype=numpy.int8)
+        if known.sum() < 2:
+            return decisions
+        deviation = returns[known].std()
+        if deviation == 0:
+            return decisions
+        z_scores = (returns - returns[known].mean()) / deviation
+        decisions[known & (z_scores > self.threshold)] = -1
+        decisions[known & (z_scores < -self.threshold)] = 1
+        return decisions
 
-from collections import deque
-class MovingAverageStrategy(ABCMeta):
+class MovingAverageStrategy(Strategy):
     """
     A simply moving average strategy.
 
@@ -70,32 +276,53 @@ class MovingAverageStrategy(ABCMeta):
     no action is taken.
     """
     def __init__(self, small_timespan, large_timespan):
-        assert self.small_timespan < self.large_timespan, "small_timespan must be smaller than large_timespan"
-        assert self.small_timespan > 0, "timespans must be greater than zero minutes"
+        assert small_timespan < large_timespan, "small_timespan must be smaller than large_timespan"
+        assert small_timespan > 0, "timespans must be greater than zero minutes"
 
         self.small_timespan = small_timespan
         self.large_timespan = large_timespan
         self.small_large_ratio = None
-        self.prices = deque(maxlen=self.large_timespan)
-    
-    def add_record(self, record):
+        self.old_small_large_ratio = None
+
+    def bind(self, stock):
         """ Here we choose to average over the OHLC bar """
-        self.prices.append((record.Open + record.Close + record.High + record.Low) / 4)
-    
+        self.stock = stock
+        self.small_average = stock.getIndicator(RollingMean, self.small_timespan, "ohlc_average")
+        self.large_average = stock.getIndicator(RollingMean, self.large_timespan, "ohlc_average")
+
+    def add_record(self, record):
+        if not self.large_average.ready:
+            # not enough price history yet
+            return
+        self.old_small_large_ratio = self.small_large_ratio
+        self.small_large_ratio = self.small_average.value / self.large_average.value
+
     def decide(self):
-        if len(self.prices) < self.large_timespan:
+        if self.old_small_large_ratio is None:
             # not enough price history, do nothing
             return 0
-        new_large_average = sum(self.prices) / self.large_timespan
-        new_small_average = sum(self.prices[:-self.small_timespan]) / self.small_timespan
-        if self.small_large_ratio is not None:
-            old_small_large_ratio = self.small_large_ratio
-            self.small_large_ratio = new_small_average / new_large_average
-            if self.small_large_ratio > 1 and old_small_large_ratio < 1:
-                # the price is increasing, go long
-                return 1
-            elif self.small_large_ratio < 1 and old_small_large_ratio > 1:
-                # the price is falling, go short
-                return -1
-            else:
-                return 0
\ No newline at end of file
+        if self.small_large_ratio > 1 and self.old_small_large_ratio < 1:
+            # the price is increasing, go long
+            return 1
+        elif self.small_large_ratio < 1 and self.old_small_large_ratio > 1:
+            # the price is falling, go short
+            return -1
+        return 0
+
+    def decide_batch(self, columns):
+        """ The same decisions as decide(), with the averages of every window taken
+        from the cumulative sum of the prices. """
+        prices = (columns["open"] + columns["close"] + columns["high"] + columns["low"]) / 4
+        decisions = numpy.zeros(len(prices), dtype=numpy.int8)
+        if len(prices) <= self.large_timespan:
+            return decisions
+        sums = numpy.concatenate(([0.0], numpy.cumsum(prices)))
+        # the ends of each full large window, i.e. the bars from which a ratio exists
+        ends = numpy.arange(self.large_timespan, len(prices) + 1)
+        large_averages = (sums[ends] - sums[ends - self.large_timespan]) / self.large_timespan
+        small_averages = (sums[ends] - sums[ends - self.small_timespan]) / self.small_timespan
+        ratios = small_averages / large_averages
+        old_ratios, new_ratios = ratios[:-1], ratios[1:]
+        decisions[self.large_timespan:][(new_ratios > 1) & (old_ratios < 1)] = 1
+        decisions[self.large_timespan:][(new_ratios < 1) & (old_ratios > 1)] = -1
+        return decisions
\ No newline at end of file
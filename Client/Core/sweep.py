@@ -0,0 +1,133 @@
+""" Evaluate a grid of strategy parameters in a single vectorised pass over the bars.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import numpy
+
+from .pricebar import NANOSECONDS_PER_MINUTE
+
+class MovingAverageSweep:
+    """ Evaluates MovingAverageStrategy over every pair of small and large timespans.
+
+    Rather than backtesting each pair separately, the moving averages for every
+    timespan are taken from one cumulative sum of the prices, and the crossings
+    for all small timespans are found at once for each large timespan, by
+    broadcasting.
+
+    Trades follow the same rules as a Stock with a TimeLimitTradeMonitor: a trade
+    is made for trade_amount at the bar where the averages cross, at that bar's
+    open. It is closed at the first bar at least time_limit minutes later, and
+    filled at the open of the bar after that. Trades which haven't been filled by
+    the end of the bars are counted as open trades, and left out of the other columns.
+
+    The result is a table (a NumPy structured array) with one row per pair of
+    timespans, in the order of the grid, with the columns in COLUMNS.
+    """
+    COLUMNS = [
+        ("small_timespan", numpy.int64),
+        ("large_timespan", numpy.int64),
+        ("trades", numpy.int64),
+        ("open_trades", numpy.int64),
+        ("hits", numpy.int64),
+        ("hit_rate", numpy.float64),
+        ("total_return", numpy.float64),
+        ("mean_return", numpy.float64),
+        ("profit", numpy.float64)
+    ]
+
+    def __init__(self, small_timespans, large_timespans, time_limit=30, trade_amount=10000):
+        self.small_timespans = sorted(set(small_timespans))
+        self.large_timespans = sorted(set(large_timespans))
+        assert self.small_timespans[0] > 0, "timespans must be greater than zero minutes"
+        self.time_limit = time_limit
+        self.trade_amount = trade_amount
+
+    def getAverages(self, prices, timespan, sums):
+        """ The moving average of every window of `timespan` bars, aligned so that
+        index i holds the average of the window ending at bar i (NaN before that). """
+        averages = numpy.full(len(prices), numpy.nan)
+        if timespan <= len(prices):
+            averages[timespan - 1:] = (sums[timespan:] - sums[:-timespan]) / timespan
+        return averages
+
+    def getTradeOutcomes(self, columns):
+        """ For a long trade opened at each bar, its return, profit, and whether
+        it would be closed before the bars run out. Short trades are the negative,
+        and trades that aren't closed have no return or profit. """
+        opens = columns["open"]
+        times = columns["time"]
+        count = len(opens)
+        shares = int(self.trade_amount * 100) // (columns["close"] * 100).astype(numpy.int64)
+        # the bar at which the time limit is reached, and the bar after it, whose open fills the close
+        closing_bars = numpy.searchsorted(times, times + self.time_limit * NANOSECONDS_PER_MINUTE)
+        fill_bars = closing_bars + 1
+        closed = fill_bars < count
+        close_prices = opens[numpy.minimum(fill_bars, count - 1)]
+        returns = numpy.where(closed, close_prices / opens - 1, 0.0)
+        profits = numpy.where(closed, (close_prices - opens) * shares, 0.0)
+        return returns, profits, closed
+
+    def run(self, columns):
+        """ Evaluate the grid over a set of bars.
+        :param columns a dictionary of NumPy arrays keyed by PriceBar attribute
+                       (time, open, high, low, close), as used by decide_batch.
+        :return the table of results.
+        """
+        columns = {key: numpy.asarray(value) for key, value in columns.items()}
+        prices = (columns["open"] + columns["close"] + columns["high"] + columns["low"]) / 4
+        sums = numpy.concatenate(([0.0], numpy.cumsum(prices)))
+        averages = {
+            timespan: self.getAverages(prices, timespan, sums)
+            for timespan in set(self.small_timespans) | set(self.large_timespans)
+        }
+        returns, profits, closed = self.getTradeOutcomes(columns)
+        closed_weights = closed.astype(numpy.float64)
+        rows = []
+        for large_timespan in self.large_timespans:
+            small_timespans = [s for s in self.small_timespans if s < large_timespan]
+            if not small_timespans:
+                continue
+            # ratios[s, i] is small / large average at bar i, for each small timespan s
+            ratios = numpy.stack([averages[s] for s in small_timespans]) / averages[large_timespan]
+            old_ratios, new_ratios = ratios[:, :-1], ratios[:, 1:]
+            # NaN compares as False, so no crossings occur before both averages exist.
+            longs = numpy.zeros(ratios.shape, dtype=numpy.float64)
+            shorts = numpy.zeros(ratios.shape, dtype=numpy.float64)
+            longs[:, 1:] = (new_ratios > 1) & (old_ratios < 1)
+            shorts[:, 1:] = (new_ratios < 1) & (old_ratios > 1)
+            signals = longs + shorts
+            directions = longs - shorts
+            trades = signals @ closed_weights
+            open_trades = signals.sum(axis=1) - trades
+            hits = longs @ (closed & (returns > 0)) + shorts @ (closed & (returns < 0))
+            total_returns = directions @ returns
+            total_profits = directions @ profits
+            for index, small_timespan in enumerate(small_timespans):
+                rows.append((
+                    small_timespan,
+                    large_timespan,
+                    trades[index],
+                    open_trades[index],
+                    hits[index],
+                    hits[index] / trades[index] if trades[index] else numpy.nan,
+                    total_returns[index],
+                    total_returns[index] / trades[index] if trades[index] else numpy.nan,
+                    total_profits[index]
+                ))
+        return numpy.array(rows, dtype=self.COLUMNS)
+
+    @classmethod
+    def formatTable(cls, table):
+        """ Format a table of results for printing """
+        names = [name for (name, _) in cls.COLUMNS]
+        lines = [" ".join("{:>14s}".format(name) for name in names)]
+        for row in table:
+            lines.append(" ".join(
+                "{:14d}".format(int(row[name])) if numpy.issubdtype(type(row[name]), numpy.integer)
+                else "{:14.6f}".format(float(row[name]))
+                for name in names
+            ))
+        return "\n".join(lines)
@@ -0,0 +1,106 @@
+""" Contains the TickBus, a shared-memory ring buffer of price bars.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import numpy
+
+from .sharedblock import SharedBlock
+
+class TickBusOverrun(RuntimeError):
+    """ Raised when a reader asks for a tick that has already been overwritten """
+    pass
+
+class TickBus(SharedBlock):
+    """ A ring buffer of OHLCV bars living in shared memory.
+
+    When the server and its clients run on the same machine, there is no need
+    to serialise each bar into JSON and push it through a TCP socket once per
+    client. Instead the server writes every tick into this buffer once, and
+    only a small "doorbell" message carrying the tick's sequence number is
+    sent over ZMQ. Clients then read the rows for their own symbols directly.
+
+    Every symbol is given a fixed slot. For each position in the ring we store
+    one column per field, indexed by slot, along with the sequence number at
+    which each slot was last written. A slot only holds a bar for a given tick
+    if its sequence number matches that tick, so symbols without a bar in a
+    tick are simply skipped by readers.
+
+    The bus is a SharedBlock, holding:
+        header    int64[4]                  sequence, depth, slots, reserved
+        sequences int64[depth, slots]       sequence each slot was written at
+        times     int64[depth, slots]       bar time, nanoseconds since the epoch
+        values    float64[depth, 5, slots]  Open, High, Low, Close, Volume
+    """
+    FIELDS = ("Open", "High", "Low", "Close", "Volume")
+
+    def layout(self):
+        self.depth = int(self.header[1])
+        self.slots = int(self.header[2])
+        grid = (self.depth, self.slots)
+        self.view("sequences", grid, numpy.int64)
+        self.view("times", grid, numpy.int64)
+        self.view("values", (self.depth, len(self.FIELDS), self.slots), numpy.float64)
+
+    @staticmethod
+    def size(depth, slots):
+        """ The number of bytes needed for a bus of a given depth and number of slots """
+        return 8 * (4 + depth * slots * (2 + len(TickBus.FIELDS)))
+
+    @classmethod
+    def create(cls, slots, depth=64):
+        """ Allocate a new bus. Only the server should do this, and it is responsible
+        for calling unlink() once every client has finished with it. """
+        bus = cls.allocate(cls.size(depth, slots), (0, depth, slots, 0))
+        # sequence numbers start at 1, so zeroed slots are never mistaken for a tick.
+        bus.sequences[:] = 0
+        return bus
+
+    @property
+    def sequence(self):
+        """ The sequence number of the most recently published tick """
+        return int(self.header[0])
+
+    def publish(self, bars):
+        """ Write a tick into the ring and return its sequence number.
+        :param bars a dictionary of slot -> bar dictionary, containing Time
+                    along with each of the fields in FIELDS.
+        """
+        sequence = self.sequence + 1
+        position = sequence % self.depth
+        for slot, bar in bars.items():
+            self.times[position, slot] = bar['Time']
+            for field_index, field in enumerate(self.FIELDS):
+                self.values[position, field_index, slot] = bar[field]
+            self.sequences[position, slot] = sequence
+        # The header is written last, so a reader that sees the new sequence
+        # number is guaranteed to see the rows that belong to it.
+        self.header[0] = sequence
+        return sequence
+
+    def read(self, sequence, slots):
+        """ Read the bars for a set of slots at a given tick.
+        :param sequence the sequence number received in the doorbell message
+        :param slots an iterable of slots to read
+        :return a dictionary of slot -> bar dictionary, for the slots that
+                have a bar in this tick.
+        """
+        if self.sequence - sequence >= self.depth:
+            raise TickBusOverrun(
+                "Tick {:d} has been overwritten (latest is {:d})".format(sequence, self.sequence)
+            )
+        position = sequence % self.depth
+        written = self.sequences[position]
+        times = self.times[position]
+        values = self.values[position]
+        bars = {}
+        for slot in slots:
+            if written[slot] != sequence:
+                continue
+            bar = {"Time": int(times[slot])}
+            for field_index, field in enumerate(self.FIELDS):
+                bar[field] = float(values[field_index, slot])
+            bars[slot] = bar
+        return bars
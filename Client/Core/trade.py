@@ -6,7 +6,8 @@ in the project root for full license information.
 
 """
 from enum import Enum
-from .loggable import Loggable
+from .loggable import Loggable, DEBUG
+from .pricebar import formatTime
 
 class TradeState(Enum):
     OPEN = 1
@@ -32,9 +33,10 @@ class Trade(Loggable):
         self.open_time = self.stock.current_time
         self.stock.handleOpenOrder(self)
         self.stock.signaller.startOrder(self.stock, self)
-        self.report("Trade open triggered at {:s}".format(str(self.stock.current_time)))
-        self.report("\tShares : {:d}".format(self.shares * self.action))
-        self.report("\tRough price : {:.3f}".format(self.stock.current_bar.close))
+        if self.isLogging(DEBUG):
+            self.debug("Trade open triggered at {:s}".format(formatTime(self.stock.current_time)))
+            self.debug("\tShares : {:d}".format(self.shares * self.action))
+            self.debug("\tRough price : {:.3f}".format(self.stock.current_bar.close))
 
     def close(self):
         # Close the trade
@@ -42,10 +44,11 @@ class Trade(Loggable):
         self.close_time = self.stock.current_time
         self.stock.handleCloseOrder(self)
         self.stock.signaller.closeOrder(self.stock, self)
-        self.report("Trade close triggered at {:s}".format(str(self.stock.current_time)))
-        self.report("\tShares : {:d}".format(self.shares * self.action))
-        self.report("\tOpen price : {:.3f}".format(self.open_price))
-        self.report("\tRough close price : {:.3f}".format(self.stock.current_bar.close))
+        if self.isLogging(DEBUG):
+            self.debug("Trade close triggered at {:s}".format(formatTime(self.stock.current_time)))
+            self.debug("\tShares : {:d}".format(self.shares * self.action))
+            self.debug("\tOpen price : {:.3f}".format(self.open_price))
+            self.debug("\tRough close price : {:.3f}".format(self.stock.current_bar.close))
 
     def openSuccess(self, share_price):
         # This is called by the Stock object the minute after a trade has been opened.
@@ -53,10 +56,11 @@ class Trade(Loggable):
         # open of the next bar.
         self.status = TradeState.OPEN
         self.open_price = share_price
-        self.report("Trade from {:s} has updated information", self.stock.current_time)
-        self.report("\tShares : {:d}".format(self.shares * self.action))
-        self.report("\tPrice  : ${:.3f} / share".format(self.open_price))
-        self.report("\tTotal  : ${:.3f}".format(self.open_price*self.shares*self.action))
+        if self.isLogging(DEBUG):
+            self.debug("Trade from {:s} has updated information".format(formatTime(self.open_time)))
+            self.debug("\tShares : {:d}".format(self.shares * self.action))
+            self.debug("\tPrice  : ${:.3f} / share".format(self.open_price))
+            self.debug("\tTotal  : ${:.3f}".format(self.open_price*self.shares*self.action))
 
     def closeSuccess(self, share_price):
         # This is called by the Stock object the minute after a trade has closed, allowing for a
@@ -66,13 +70,21 @@ class Trade(Loggable):
         self.percent_return = ((self.close_price / self.open_price)-1) * self.action
         self.profit = (self.close_price - self.open_price) * self.shares * self.action
 
-        self.report("Closed trade at", self.stock.current_time)
-        self.report("\tStarted :", self.open_time)
-        self.report("\tShares :", self.shares * self.action)
-        self.report("\tOpen   : $%.2f / share" % self.open_price)
-        self.report("\tClose  : $%.2f / share" % self.close_price)
-        self.report("\tprofit : $%.3f" % self.profit)
-        self.report("\tReturn : %.4f%%\n" % (100 * self.percent_return))
+        if self.isLogging(DEBUG):
+            self.debug("Closed trade at", formatTime(self.stock.current_time))
+            self.debug("\tStarted :", formatTime(self.open_time))
+            self.debug("\tShares :", self.shares * self.action)
+            self.debug("\tOpen   : $%.2f / share" % self.open_price)
+            self.debug("\tClose  : $%.2f / share" % self.close_price)
+            self.debug("\tprofit : $%.3f" % self.profit)
+            self.debug("\tReturn : %.4f%%\n" % (100 * self.percent_return))
     
+    def __getstate__(self):
+        # Trades are passed between processes without their Stock, which holds
+        # the gateway's sockets. The receiving process re-attaches its own Stock.
+        state = self.__dict__.copy()
+        state['stock'] = None
+        return state
+
     def getLogTag(self):
         return "Trade - {:s}".format(self.stock.symbol)
\ No newline at end of file
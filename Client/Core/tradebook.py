@@ -0,0 +1,106 @@
+""" Contains the TradeBook class, which holds a stock's open trades as columns.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import numpy
+
+class TradeBook:
+    """ The open trades of a stock, with the values that trade monitors need
+    held in NumPy columns, one row per trade.
+
+    A trade monitor can then check every open trade in a single vectorised
+    comparison per bar (see TradeMonitor.notify_array), rather than being
+    called once for every trade. The Trade objects are kept alongside, in the
+    same order, and the book behaves as a list of them for everything else.
+
+    The columns are:
+        action      1 for long, -1 for short
+        shares      the number of shares
+        open_price  the price the trade was filled at, or NaN until it is filled
+        open_time   the time the trade was opened, in nanoseconds since the epoch
+
+    `appended` counts every trade added to the book, including those removed
+    since. Trades stay in the order they were added, so the trades added after
+    the count was n are the last (appended - n) rows, less any removed since.
+    """
+    COLUMNS = ("action", "shares", "open_price", "open_time")
+
+    def __init__(self, capacity=16):
+        self.trades = []
+        self.rows = {}
+        self.appended = 0
+        self.action = numpy.zeros(capacity, dtype=numpy.int64)
+        self.shares = numpy.zeros(capacity, dtype=numpy.int64)
+        self.open_price = numpy.full(capacity, numpy.nan)
+        self.open_time = numpy.zeros(capacity, dtype=numpy.int64)
+
+    def grow(self):
+        """ Double the capacity of the columns """
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            grown = numpy.full(2 * len(column), numpy.nan) if column.dtype.kind == "f" \
+                else numpy.zeros(2 * len(column), dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def append(self, trade):
+        """ Add a trade to the book """
+        if len(self.trades) == len(self.action):
+            self.grow()
+        self.rows[id(trade)] = len(self.trades)
+        self.trades.append(trade)
+        self.appended += 1
+        self.update(trade)
+
+    def update(self, trade):
+        """ Copy a trade's values into its row, e.g. once it has been filled """
+        row = self.rows[id(trade)]
+        self.action[row] = trade.action
+        self.shares[row] = trade.shares
+        self.open_price[row] = numpy.nan if trade.open_price is None else trade.open_price
+        self.open_time[row] = getattr(trade, "open_time", 0)
+
+    def __contains__(self, trade):
+        return id(trade) in self.rows
+
+    def view(self, name):
+        """ The values of a column for the trades in the book """
+        return getattr(self, name)[:len(self.trades)]
+
+    def keep(self, mask):
+        """ Remove the trades whose entries in the boolean mask are False,
+        returning the removed trades, in order. """
+        count = len(self.trades)
+        mask = numpy.asarray(mask, dtype=bool)
+        if mask.all():
+            return []
+        removed = [trade for (trade, kept) in zip(self.trades, mask) if not kept]
+        kept_count = count - len(removed)
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            column[:kept_count] = column[:count][mask]
+        self.trades = [trade for (trade, kept) in zip(self.trades, mask) if kept]
+        self.rows = {id(trade): row for (row, trade) in enumerate(self.trades)}
+        return removed
+
+    def __len__(self):
+        return len(self.trades)
+
+    def __iter__(self):
+        return iter(self.trades)
+
+    def __getitem__(self, index):
+        return self.trades[index]
+
+    def __getstate__(self):
+        # Row lookups are by object identity, which doesn't survive pickling.
+        state = self.__dict__.copy()
+        del state["rows"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.rows = {id(trade): row for (row, trade) in enumerate(self.trades)}
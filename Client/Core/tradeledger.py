@@ -0,0 +1,161 @@
+""" Contains the TradeLedger class, a columnar record of a stock's closed trades.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import os
+import time
+import uuid
+
+import numpy
+
+from .pricebar import NANOSECONDS_PER_MINUTE
+
+class TradeLedger:
+    """ The closed trades of a stock, with one NumPy column per value.
+
+    Once a trade's close has been filled, its values are copied into the
+    ledger and the Trade object is no longer kept. Statistics are then
+    calculated from the columns in a few vectorised operations (see
+    statistics()), rather than by walking a list of Trade objects.
+
+    If a directory is given, the ledger holds at most `capacity` trades in
+    memory: when it is full, they are written to a compressed .npz file in
+    the directory and the memory is reused, so that memory use stays flat
+    however long the run. Without a directory, the columns grow as needed.
+    The files are named after the ledger, the process, when the ledger was
+    created and a random suffix, so ledgers sharing a directory (e.g. grid
+    jobs, or a restarted client) never overwrite each other's files.
+
+    The columns are:
+        action          1 for long, -1 for short
+        shares          the number of shares
+        open_price      the price the trade was filled at when opening
+        close_price     the price the trade was filled at when closing
+        open_time       when the trade was opened, in nanoseconds since the epoch
+        close_time      when the trade was closed, in nanoseconds since the epoch
+        profit          the profit of the trade
+        percent_return  the return of the trade, as a fraction
+    """
+    COLUMNS = (
+        ("action", numpy.int8),
+        ("shares", numpy.int64),
+        ("open_price", numpy.float64),
+        ("close_price", numpy.float64),
+        ("open_time", numpy.int64),
+        ("close_time", numpy.int64),
+        ("profit", numpy.float64),
+        ("percent_return", numpy.float64)
+    )
+
+    def __init__(self, name="trades", directory=None, capacity=4096):
+        assert capacity > 0, "capacity must be greater than zero"
+        self.name = name
+        self.directory = directory
+        self.columns = {
+            column: numpy.zeros(capacity, dtype=dtype)
+            for (column, dtype) in self.COLUMNS
+        }
+        self.count = 0
+        # identifies this ledger's files in a shared directory
+        self.run_id = "{:d}-{:d}-{:s}".format(os.getpid(), time.time_ns(), uuid.uuid4().hex[:8])
+        # the files that have been written so far, and the number of trades in them
+        self.files = []
+        self.spilled = 0
+
+    def append(self, trade):
+        """ Record a trade whose close has been filled """
+        if self.count == len(self.columns["action"]):
+            if self.directory is None:
+                for column in self.columns:
+                    self.columns[column] = numpy.concatenate(
+                        (self.columns[column], numpy.zeros_like(self.columns[column]))
+                    )
+            else:
+                self.spill()
+        count = self.count
+        for (column, _) in self.COLUMNS:
+            self.columns[column][count] = getattr(trade, column)
+        self.count = count + 1
+
+    def spill(self):
+        """ Write the trades held in memory to a new file, and clear them """
+        if self.count == 0:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(
+            self.directory,
+            "{:s}-{:s}-{:d}.npz".format(self.name, self.run_id, len(self.files))
+        )
+        numpy.savez_compressed(
+            filename,
+            **{column: values[:self.count] for (column, values) in self.columns.items()}
+        )
+        self.files.append(filename)
+        self.spilled += self.count
+        self.count = 0
+
+    def __len__(self):
+        return self.spilled + self.count
+
+    def latest(self, count):
+        """ The columns of the last `count` trades recorded, in the order they
+        were closed. These are usually still in memory. """
+        if count <= self.count:
+            return {column: values[self.count - count:self.count].copy() for (column, values) in self.columns.items()}
+        columns = self.getColumns()
+        return {column: values[len(values) - count:] for (column, values) in columns.items()}
+
+    def getColumns(self):
+        """ Every trade recorded, including those written to disk, as a
+        dictionary of column name -> array, in the order they were closed """
+        parts = []
+        for filename in self.files:
+            with numpy.load(filename) as data:
+                parts.append({column: data[column] for (column, _) in self.COLUMNS})
+        parts.append({column: values[:self.count] for (column, values) in self.columns.items()})
+        return {
+            column: numpy.concatenate([part[column] for part in parts])
+            for (column, _) in self.COLUMNS
+        }
+
+    @classmethod
+    def combine(cls, ledgers):
+        """ The columns of several ledgers (e.g. one per stock) together, ordered
+        by close time """
+        ledger_columns = [ledger.getColumns() for ledger in ledgers]
+        if not ledger_columns:
+            return {column: numpy.zeros(0, dtype=dtype) for (column, dtype) in cls.COLUMNS}
+        columns = {
+            column: numpy.concatenate([part[column] for part in ledger_columns])
+            for (column, _) in cls.COLUMNS
+        }
+        order = numpy.argsort(columns["close_time"], kind="stable")
+        return {column: values[order] for (column, values) in columns.items()}
+
+    @staticmethod
+    def statistics(columns):
+        """ Summary statistics of a set of trades, given their columns.
+        :return a dictionary with the number of trades, the number of winning
+                trades (hits) and the hit rate, the total profit and return,
+                the mean return and holding time (in minutes), and the maximum
+                drawdown of the cumulative profit.
+        """
+        profits = columns["profit"]
+        trades = len(profits)
+        hits = int((profits > 0).sum())
+        cumulative = numpy.concatenate(([0.0], numpy.cumsum(profits)))
+        drawdowns = numpy.maximum.accumulate(cumulative) - cumulative
+        holding_times = (columns["close_time"] - columns["open_time"]) / NANOSECONDS_PER_MINUTE
+        return {
+            "trades": trades,
+            "hits": hits,
+            "hit_rate": hits / trades if trades else None,
+            "profit": float(profits.sum()),
+            "total_return": float(columns["percent_return"].sum()),
+            "mean_return": float(columns["percent_return"].mean()) if trades else None,
+            "mean_holding_time": float(holding_times.mean()) if trades else None,
+            "max_drawdown": float(drawdowns.max())
+        }
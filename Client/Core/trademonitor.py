@@ -6,12 +6,22 @@ in the project root for full license information.
 
 """
 import sys
-import datetime
+from abc import abstractmethod
+import numpy
 from .loggable import Loggable
+from .pricebar import NANOSECONDS_PER_MINUTE, NANOSECONDS_PER_DAY
+from .scheduler import DeadlineScheduler
+
 class TradeMonitor(Loggable):
     """ Used for monitoring open positions and determining when it is time to
     close them. This could be due to a timed position of n minutes, or because
     of a stop loss, or any monitoring tactic you want. """
+    def register(self, trade):
+        """ Called by the stock when a trade has been opened, before it is first
+        monitored. Monitors whose rules depend on when a trade opened can
+        schedule it here. """
+        pass
+
     def notify_single(self, trade, current_bar):
         """ Monitor a single trade given the current bar. This is useful for
         checking trade-specific metrics such as the current return or trading
@@ -20,13 +30,35 @@ class TradeMonitor(Loggable):
         """
         return True
 
-    def notify_multiple(self, open_trades, closed_trades, current_bar):
-        """ Monitor all trades opened so far, including closed trades.
+    def notify_array(self, trade_book, current_bar):
+        """ Monitor all open trades at once, given the TradeBook holding them.
+        Monitors with many open trades can implement this with vectorised
+        comparisons over the book's columns. An array of booleans, one per trade
+        in the book, is returned: True if the trade should remain open, False if
+        it should be closed. None means that the monitor doesn't implement this,
+        and notify_single is called for each trade instead.
+        """
+        return None
+
+    def notify_multiple(self, position, current_bar):
+        """ Monitor all trades made so far, through their running totals.
         This is useful for multi-trade metrics, such as the overall return
         so far in the day (e.g. for a daily stoploss to shut down all open
-        trades).
+        trades). The position is the stock's Position or, for a portfolio
+        monitor run by the Controller, a Portfolio of every stock, in which
+        case current_bar is None. True is returned if the trades should remain
+        open, False if all of them should be closed.
         """
-        raise NotImplementedError("Multiple trade monitoring is not yet implemented")
+        return True
+
+    def snapshot(self):
+        """ The monitor's state, for restore() in a later session. Open trades
+        aren't carried between sessions, so neither are any schedules of them.
+        Most monitors have no other state, and return None. """
+        return None
+
+    def restore(self, state):
+        pass
 
     def getLogTag(self):
         return self.__class__.__name__
@@ -34,6 +66,9 @@ class TradeMonitor(Loggable):
 class MultiTradeMonitor(TradeMonitor):
     def __init__(self, child_trade_monitors):
         self.child_trade_monitors = child_trade_monitors
+    def register(self, trade):
+        for monitor in self.child_trade_monitors:
+            monitor.register(trade)
     def notify_single(self, trade, current_bar):
         """ Run the child monitors on the trades. If one closes an order,
         it should return False to prevent other monitors from wasting time
@@ -41,10 +76,32 @@ class MultiTradeMonitor(TradeMonitor):
         for monitor in self.child_trade_monitors:
             if not monitor.notify_single(trade, current_bar):
                 return False
-            return True
-    def notify_multiple(self, open_trades, closed_trades, current_bar):
+        return True
+    def notify_array(self, trade_book, current_bar):
+        """ Combine the child monitors' decisions. Children that don't support
+        notify_array are asked about each trade that is still open. """
+        keep = numpy.ones(len(trade_book), dtype=bool)
         for monitor in self.child_trade_monitors:
-            monitor.notify_multiple(open_trades, closed_trades, current_bar)
+            child_keep = monitor.notify_array(trade_book, current_bar)
+            if child_keep is None:
+                child_keep = [
+                    kept and monitor.notify_single(trade, current_bar)
+                    for (kept, trade) in zip(keep, trade_book)
+                ]
+            keep &= numpy.asarray(child_keep, dtype=bool)
+        return keep
+    def notify_multiple(self, position, current_bar):
+        # every child sees every bar, as they may keep state of their own
+        results = [
+            monitor.notify_multiple(position, current_bar)
+            for monitor in self.child_trade_monitors
+        ]
+        return all(results)
+    def snapshot(self):
+        return [monitor.snapshot() for monitor in self.child_trade_monitors]
+    def restore(self, state):
+        for (monitor, child_state) in zip(self.child_trade_monitors, state):
+            monitor.restore(child_state)
 
 class NullTradeMonitor(TradeMonitor):
     pass
@@ -54,21 +111,129 @@ class BoundaryTradeMonitor(TradeMonitor):
         self.stop_loss_bp = stop_loss_bp
         self.take_profit_bp = take_profit_bp
     def notify_single(self, trade, current_bar):
-        current_return_bp = ((current_bar.close / trade.close_price) - 1) * 10000
-        if -current_return_bp > self.stop_loss_bp:
+        if trade.open_price is None:
+            # not filled yet
+            return True
+        current_return_bp = ((current_bar.close / trade.open_price) - 1) * 10000 * trade.action
+        if self.stop_loss_bp is not None and -current_return_bp > self.stop_loss_bp:
             #fire stop loss
             self.report("Stop loss triggered")
             return False
-        elif current_return_bp > self.take_profit_bp:
+        elif self.take_profit_bp is not None and current_return_bp > self.take_profit_bp:
             self.report("Take profit triggered")
             return False
         return True
+    def notify_array(self, trade_book, current_bar):
+        # Trades that haven't been filled have a NaN open price, and NaN
+        # comparisons are False, so they are kept open.
+        current_return_bp = (
+            (current_bar.close / trade_book.view("open_price")) - 1
+        ) * 10000 * trade_book.view("action")
+        keep = numpy.ones(len(trade_book), dtype=bool)
+        if self.stop_loss_bp is not None:
+            stopped = -current_return_bp > self.stop_loss_bp
+            if stopped.any():
+                self.report("Stop loss triggered for {:d} trades".format(int(stopped.sum())))
+                keep &= ~stopped
+        if self.take_profit_bp is not None:
+            taken = keep & (current_return_bp > self.take_profit_bp)
+            if taken.any():
+                self.report("Take profit triggered for {:d} trades".format(int(taken.sum())))
+                keep &= ~taken
+        return keep
 
-class TimeLimitTradeMonitor(TradeMonitor):
-    def __init__(self, time_limit):
-        self.timedelta = datetime.timedelta(minutes=time_limit)
+class ScheduledTradeMonitor(TradeMonitor):
+    """ A monitor which closes each trade at a deadline that is known when the
+    trade opens. Trades are held in a DeadlineScheduler, so each bar only
+    handles the trades that are due, however many trades are open. """
+    def __init__(self):
+        self.scheduler = DeadlineScheduler()
+    @abstractmethod
+    def getDeadline(self, trade):
+        """ The time, in nanoseconds since the epoch, to close the trade at """
+        pass
+    def register(self, trade):
+        self.scheduler.schedule(self.getDeadline(trade), trade)
     def notify_single(self, trade, current_bar):
-        if trade.open_time + self.timedelta >= current_bar.time:
-            self.report("Time limit triggered")
-            return False
-        return True
+        return current_bar.time < self.getDeadline(trade)
+    def notify_array(self, trade_book, current_bar):
+        keep = numpy.ones(len(trade_book), dtype=bool)
+        for trade in self.scheduler.due(current_bar.time):
+            # trades closed by another monitor are no longer in the book
+            row = trade_book.rows.get(id(trade))
+            if row is not None and trade_book[row] is trade:
+                keep[row] = False
+        if not keep.all():
+            self.report("{:s} for {:d} trades".format(self.getReason(), int((~keep).sum())))
+        return keep
+    def getReason(self):
+        return "Deadline reached"
+
+class TimeLimitTradeMonitor(ScheduledTradeMonitor):
+    def __init__(self, time_limit):
+        ScheduledTradeMonitor.__init__(self)
+        # bar times are in nanoseconds since the epoch
+        self.time_limit = time_limit * NANOSECONDS_PER_MINUTE
+    def getDeadline(self, trade):
+        return trade.open_time + self.time_limit
+    def getReason(self):
+        return "Time limit triggered"
+
+class SessionCloseTradeMonitor(ScheduledTradeMonitor):
+    """ Flattens all trades at the end of the session, so that none are held
+    overnight. Trades are closed at the first bar at or after `minutes_before`
+    minutes before the close time (as "HH:MM") of the day they were opened, or
+    of the next day if they were opened after it. """
+    def __init__(self, close_time="16:00", minutes_before=1):
+        ScheduledTradeMonitor.__init__(self)
+        (hours, minutes) = close_time.split(":")
+        self.close_offset = (int(hours) * 60 + int(minutes) - minutes_before) * NANOSECONDS_PER_MINUTE
+    def getDeadline(self, trade):
+        deadline = trade.open_time - trade.open_time % NANOSECONDS_PER_DAY + self.close_offset
+        if deadline <= trade.open_time:
+            deadline += NANOSECONDS_PER_DAY
+        return deadline
+    def getReason(self):
+        return "Session close flattening"
+
+class DailyStopLossTradeMonitor(TradeMonitor):
+    """ Closes all trades once the day's loss reaches max_loss (in the trading
+    currency), counting both closed trades and open trades marked to market.
+    Trades opened later in the same day are closed straight away. It can be
+    used on a stock, or on the whole portfolio through the "portfolio_monitor"
+    setting. The day's profit is kept on the monitor, so as a stock's
+    "trade_monitor" each stock needs its own instance, which
+    Stock.applySettings gives it. """
+    def __init__(self, max_loss):
+        self.max_loss = max_loss
+        self.day = None
+        self.starting_profit = 0.0
+        self.last_profit = 0.0
+        self.stopped = False
+    def notify_multiple(self, position, current_bar):
+        if position.time is None:
+            return True
+        day = position.time // NANOSECONDS_PER_DAY
+        if day != self.day:
+            # the day's profit is counted from the end of the previous bar
+            self.day = day
+            self.starting_profit = self.last_profit
+            self.stopped = False
+        self.last_profit = position.total_profit
+        if not self.stopped and self.last_profit - self.starting_profit <= -self.max_loss:
+            self.report("Daily stop loss triggered")
+            self.stopped = True
+        return not self.stopped
+    def snapshot(self):
+        return {
+            "day": self.day,
+            "day_profit": self.last_profit - self.starting_profit,
+            "stopped": self.stopped
+        }
+    def restore(self, state):
+        # the new session's position starts from zero, so the day's profit so
+        # far is carried over in the starting profit
+        self.day = state["day"]
+        self.stopped = state["stopped"]
+        self.last_profit = 0.0
+        self.starting_profit = -state["day_profit"]
@@ -0,0 +1,159 @@
+""" Contains the WarmUp class, which fits the stocks' strategies before trading starts.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+"""
+import os
+import time
+import pickle
+import tempfile
+import multiprocessing
+
+from .loggable import Loggable
+from .settings import settingsHash
+
+# the stocks being warmed up, inherited by forked workers
+_warm_up_stocks = {}
+
+def _analyseStock(symbol):
+    stock = _warm_up_stocks[symbol]
+    return symbol, stock.strategy.analyse(stock.warm_up_data)
+
+class WarmUp(Loggable):
+    """ Loads and analyses a set of stocks (see Stock.load and Stock.analyse),
+    with the analysis run on a pool of worker processes and memoised on disk.
+
+    Each stock's data is loaded in this process. The stock is then given a key,
+    a hash of its symbol, its settings and its data. If `cache_directory`
+    holds an analysis for that key, it is used as it is. Otherwise the stock's
+    strategy is analysed in a worker process, forked so that it inherits the
+    stock and its data, and the result is written to the cache. A restarted
+    client whose inputs haven't changed therefore only loads its data.
+
+    The settings are hashed by settingsHash (see Core/settings.py). Clients
+    with different settings can share a cache (e.g. the jobs of a grid), so
+    each key of a symbol has its own file, and analyses are only removed once
+    they haven't been used for `max_age` days. Each analysis is written to a
+    temporary file of its own before being moved into place, so processes
+    writing the same analysis at once don't corrupt it.
+
+    The analysis applied to each stock is also kept in `analyses`, so that it
+    can be applied again after a stock's state is restored from a snapshot.
+    """
+    def __init__(self, workers=None, cache_directory=None, max_age=7):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.cache_directory = cache_directory
+        self.max_age = max_age
+        # symbol -> the analysis applied to the stock
+        self.analyses = {}
+        self.hits = 0
+        self.misses = 0
+
+    def getLogTag(self):
+        return "WarmUp"
+
+    def getKey(self, stock, settings):
+        """ The hash of a stock's symbol, settings and data """
+        key = settingsHash(stock.symbol, settings, stock.strategy)
+        key.update(pickle.dumps(stock.warm_up_data, protocol=4))
+        return key.hexdigest()[:32]
+
+    def getFilename(self, symbol, key):
+        return os.path.join(self.cache_directory, "{:s}-{:s}.pickle".format(symbol, key))
+
+    def readCache(self, symbol, key):
+        filename = self.getFilename(symbol, key)
+        try:
+            with open(filename, "rb") as cache_file:
+                analysis = pickle.load(cache_file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False, None
+        try:
+            # mark the analysis as used, so that prune() keeps it
+            os.utime(filename)
+        except OSError:
+            pass
+        return True, analysis
+
+    def writeCache(self, symbol, key, analysis):
+        try:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=self.cache_directory,
+                prefix=symbol + ".",
+                suffix=".tmp",
+                delete=False
+            ) as cache_file:
+                try:
+                    pickle.dump(analysis, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+                except BaseException:
+                    cache_file.close()
+                    os.remove(cache_file.name)
+                    raise
+            os.replace(cache_file.name, self.getFilename(symbol, key))
+        except OSError as error:
+            self.reportWarning("Couldn't cache the analysis of {:s}: {:s}".format(symbol, str(error)))
+
+    def prune(self):
+        """ Remove the analyses (and any temporary files left by a stopped
+        client) that haven't been used for max_age days """
+        oldest = time.time() - self.max_age * 24 * 60 * 60
+        try:
+            with os.scandir(self.cache_directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith((".pickle", ".tmp")) and entry.stat().st_mtime < oldest:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            # removed by another client pruning at the same time
+                            pass
+        except OSError as error:
+            self.reportWarning("Couldn't prune the analysis cache: {:s}".format(str(error)))
+
+    def run(self, stocks, settings):
+        """ Load and analyse every stock.
+        :param stocks dictionary of symbol -> Stock
+        :param settings dictionary of symbol -> the stock's settings
+        """
+        global _warm_up_stocks
+        keys = {}
+        pending = []
+        for symbol in stocks:
+            stock = stocks[symbol]
+            stock.load()
+            if not stock.strategy.needs_analysis():
+                continue
+            if self.cache_directory is not None:
+                keys[symbol] = self.getKey(stock, settings[symbol])
+                found, analysis = self.readCache(symbol, keys[symbol])
+                if found:
+                    stock.strategy.apply_analysis(analysis)
+                    self.analyses[symbol] = analysis
+                    self.hits += 1
+                    continue
+            pending.append(symbol)
+        self.misses += len(pending)
+        if len(pending) <= 1 or self.workers <= 1:
+            results = [(symbol, stocks[symbol].strategy.analyse(stocks[symbol].warm_up_data)) for symbol in pending]
+        else:
+            _warm_up_stocks = stocks
+            try:
+                context = multiprocessing.get_context("fork")
+                with context.Pool(min(self.workers, len(pending))) as pool:
+                    results = pool.map(_analyseStock, pending, chunksize=1)
+            finally:
+                _warm_up_stocks = {}
+        for (symbol, analysis) in results:
+            stocks[symbol].strategy.apply_analysis(analysis)
+            self.analyses[symbol] = analysis
+            if self.cache_directory is not None:
+                self.writeCache(symbol, keys[symbol], analysis)
+        if self.cache_directory is not None and self.max_age is not None:
+            self.prune()
+        self.report("Warmed up {:d} stocks: {:d} analyses from the cache, {:d} analysed".format(
+            len(stocks),
+            self.hits,
+            self.misses
+        ))
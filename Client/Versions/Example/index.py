@@ -10,4 +10,9 @@ settings = {
     "processes": 4,
     "trade_amount": 25000,
     "stop_loss_threshold": 0.004, # e.g. 0.4% stoploss
+    "executor": "serial", # or "threads" / "processes" to process stocks concurrently
+    "risk_ledger": False, # share each process' profit in shared memory, for a "global_monitor"
+    "log_level": "INFO", # or "DEBUG" to log every message, bar and trade
+    "snapshots": False, # restore each stock's state from its last snapshot, rather than replaying its history
+    "streaming": False, # process each stock's live bar as soon as it arrives, rather than once all are in
 }
@@ -0,0 +1,198 @@
+""" Runs a grid of full backtests, over several settings and dates, in parallel.
+
+Copyright (c) Cambridge Quantum Computing ltd. All rights reserved.
+Licensed under the MIT License. See LICENSE file
+in the project root for full license information.
+
+Usage: grid.py [version] [environment] [grid file] [date] [date] ...
+
+The grid file is a Python file which defines `grid`, either as a dictionary of
+setting -> list of values, in which case every combination is run, or as a list
+of dictionaries of settings. Each set of settings overrides those of the version
+and environment, as an environment file does. The file can also define
+`workers`, the number of backtests to run at the same time (2 by default).
+
+Every set of settings is run on every date, each as a separate backtest with its
+own server and clients, exactly as run.py would launch them. The backtests are
+placed on a shared queue, and each worker takes the next one as soon as it is
+free, so that long and short backtests balance out across the workers. Each
+backtest is given its own connection port, so that backtests running at the
+same time don't connect to each other's servers.
+
+The results of every backtest are printed as a table, and written to
+Logs/Grid-[version]-[environment].csv. A backtest whose server or clients
+exited with an error (or that couldn't be launched) has the status "failed",
+the exit codes of its processes, and no results, rather than results which
+would look like a backtest that made no trades.
+"""
+import sys
+import os
+import csv
+import shutil
+import itertools
+import tempfile
+import importlib.util
+from copy import deepcopy
+from multiprocessing import Process, Queue
+
+import ujson
+
+from run import loadVersions, loadSymbols, loadSettings, filterSymbols, launch
+
+COLUMNS = ["job", "date", "settings", "status", "exit_codes", "clients", "trades", "open_trades", "hits", "hit_rate", "profit", "total_return"]
+RESULTS = ["trades", "open_trades", "hits", "profit", "total_return"]
+
+""" Load the grid file, returning the list of settings overrides and the number of workers """
+def loadGrid(filename):
+    specification = importlib.util.spec_from_file_location("grid", filename)
+    grid_file = importlib.util.module_from_spec(specification)
+    specification.loader.exec_module(grid_file)
+    grid = grid_file.grid
+    if isinstance(grid, dict):
+        names = list(grid)
+        grid = [
+            dict(zip(names, values))
+            for values in itertools.product(*[grid[name] for name in names])
+        ]
+    return grid, getattr(grid_file, "workers", 2)
+
+""" Run a single backtest, and collect the results written by each of its clients """
+def runJob(version, environment, symbols, overrides, date, job, results_directory):
+    global_settings = deepcopy(loadSettings(version, environment))
+    global_settings.update(deepcopy(overrides))
+    global_settings["connection_port"] = global_settings.get("connection_port", 92482) + job
+    global_settings["log_tag"] = "-Grid{:d}".format(job)
+    global_settings["results_file"] = os.path.join(
+        results_directory,
+        "Job-{:d}".format(job) + "-{:d}.json"
+    )
+    job_symbols = filterSymbols(symbols, global_settings)
+    row = {
+        "job": job,
+        "date": date,
+        "settings": ujson.dumps(overrides, sort_keys=True),
+        "status": "ok",
+        "exit_codes": "",
+        "clients": 0,
+        "trades": 0,
+        "open_trades": 0,
+        "hits": 0,
+        "profit": 0.0,
+        "total_return": 0.0
+    }
+    exit_codes = []
+    if len(job_symbols) > 0:
+        processes, risk_ledger = launch(version, environment, job_symbols, global_settings, [date])
+        for process in processes:
+            process.join()
+            exit_codes.append(process.exitcode)
+        if risk_ledger is not None:
+            risk_ledger.close()
+            risk_ledger.unlink()
+    for filename in os.listdir(results_directory):
+        if filename.startswith("Job-{:d}-".format(job)):
+            with open(os.path.join(results_directory, filename)) as results_file:
+                results = ujson.loads(results_file.read())
+            row["clients"] += 1
+            for key in RESULTS:
+                row[key] += results[key]
+    row["exit_codes"] = ",".join(str(code) for code in exit_codes)
+    if any(code != 0 for code in exit_codes):
+        # a crashed client didn't write its results, so the totals are incomplete
+        print("Job {:d} failed: its processes exited with {:s}".format(job, row["exit_codes"]))
+        row["status"] = "failed"
+        for key in RESULTS:
+            row[key] = None
+    row["hit_rate"] = row["hits"] / row["trades"] if row["trades"] else None
+    return row
+
+""" A worker process: run backtests from the job queue until it is empty """
+def work(version, environment, symbols, jobs, job_queue, result_queue, results_directory):
+    while True:
+        job = job_queue.get()
+        if job is None:
+            return
+        (overrides, date) = jobs[job]
+        try:
+            result_queue.put(
+                runJob(version, environment, symbols, overrides, date, job, results_directory)
+            )
+        except Exception as error:
+            print("Job {:d} failed: {:s}".format(job, str(error)))
+            result_queue.put({
+                "job": job,
+                "date": date,
+                "settings": ujson.dumps(overrides, sort_keys=True),
+                "status": "failed"
+            })
+
+""" Run every job on a pool of worker processes, returning the rows of results in job order """
+def runGrid(version, environment, symbols, grid, dates, workers):
+    jobs = [(overrides, date) for overrides in grid for date in dates]
+    # Workers launch servers and clients of their own, which daemonic processes
+    # (such as those of multiprocessing.Pool) aren't allowed to do.
+    job_queue = Queue()
+    result_queue = Queue()
+    for job in range(len(jobs)):
+        job_queue.put(job)
+    workers = max(1, min(workers, len(jobs)))
+    for _ in range(workers):
+        job_queue.put(None)
+    results_directory = tempfile.mkdtemp(prefix="grid-")
+    processes = []
+    for _ in range(workers):
+        process = Process(
+            target=work,
+            args=[version, environment, symbols, jobs, job_queue, result_queue, results_directory]
+        )
+        process.start()
+        processes.append(process)
+    rows = []
+    for _ in range(len(jobs)):
+        row = result_queue.get()
+        print("Finished job {:d} of {:d}".format(len(rows) + 1, len(jobs)))
+        rows.append(row)
+    for process in processes:
+        process.join()
+    shutil.rmtree(results_directory, ignore_errors=True)
+    return sorted(rows, key=lambda row: row["job"])
+
+""" Format the rows of results for printing """
+def formatTable(rows):
+    lines = [" ".join("{:>12s}".format(column) for column in COLUMNS[:2] + COLUMNS[3:]) + "  settings"]
+    for row in rows:
+        values = []
+        for column in COLUMNS[:2] + COLUMNS[3:]:
+            value = row.get(column)
+            if isinstance(value, float):
+                values.append("{:12.4f}".format(value))
+            else:
+                values.append("{:>12s}".format("-" if value is None else str(value)))
+        lines.append(" ".join(values) + "  " + row["settings"])
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print("Input must be in the form of grid.py [version] [environment] [grid file] [date] [date] ...")
+        quit()
+    (input_version, input_environment, grid_filename) = sys.argv[1:4]
+    dates = sys.argv[4:]
+    versions = loadVersions()
+    if input_version not in versions:
+        print("Version '{:s}' does not exist".format(input_version))
+        quit()
+    if input_environment not in versions[input_version]["environments"]:
+        print("Version '{:s}' has no environment {:s}".format(input_version, input_environment))
+        quit()
+    (grid, workers) = loadGrid(grid_filename)
+    symbols = sorted(loadSymbols(input_version, input_environment))
+    rows = runGrid(input_version, input_environment, symbols, grid, dates, workers)
+    print(formatTable(rows))
+    os.makedirs("Logs", exist_ok=True)
+    filename = "Logs/Grid-{:s}-{:s}.csv".format(input_version, input_environment)
+    with open(filename, "w", newline="") as output:
+        writer = csv.DictWriter(output, fieldnames=COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    print("Results written to", filename)
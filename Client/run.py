@@ -20,14 +20,20 @@ import time
 import sys
 
 from Core.controller import Controller
+from Core.loggable import flushLogs
+from Core.settings import SettingsResolver
+from Core.profiler import PhaseProfiler
+from Core.riskledger import RiskLedger
 
 
 """ Create a client from a set of symbols, a version and an environment.
     The client will write to it's own log file, not to the main process' stdout.
 """
 def spawnClient(version, environment, global_settings, client_id, symbols):
-    outname = "Logs/Client-{:s}-{:s}-{:d}.out".format(version, environment, client_id)
-    errname = "Logs/Client-{:s}-{:s}-{:d}.error".format(version, environment, client_id)
+    # the log tag keeps the logs of runs that share a version and environment apart
+    tag = global_settings.get("log_tag", "")
+    outname = "Logs/Client-{:s}-{:s}{:s}-{:d}.out".format(version, environment, tag, client_id)
+    errname = "Logs/Client-{:s}-{:s}{:s}-{:d}.error".format(version, environment, tag, client_id)
     if os.path.exists(outname) or os.path.exists(errname):
         tmpoutname = outname + ".{:d}"
         tmperrname = errname + ".{:d}"
@@ -41,101 +47,74 @@ def spawnClient(version, environment, global_settings, client_id, symbols):
             pass
     sys.stdout = open(outname, 'w')
     sys.stderr = open(errname, "w")
-    interface = Controller(version, environment, global_settings, client_id, symbols)
-    interface.goLive()
+    try:
+        interface = Controller(version, environment, global_settings, client_id, symbols)
+        interface.goLive()
+    finally:
+        # the process exits without running atexit handlers
+        flushLogs()
 
 """ Create an arrow server dedicated to backtesting. """
-def spawnBacktestServer(number_of_processes, backtest_date):
-    sys.stdout = open("Logs/Server-Backtest.out", 'w')
-    sys.stderr = open("Logs/Server-Backtest.error", "w")
+def spawnBacktestServer(number_of_processes, backtest_date, tick_bus=False, connection_port=92482, tag=""):
+    sys.stdout = open("Logs/Server-Backtest{:s}.out".format(tag), 'w')
+    sys.stderr = open("Logs/Server-Backtest{:s}.error".format(tag), "w")
     # Load the backtest module
     sys.path.insert(0, '..')
     from Servers.backtest import BacktestServer
     # run the backtesting server
-    server = BacktestServer(number_of_processes, backtest_date)
+    server = BacktestServer(number_of_processes, backtest_date, tick_bus, connection_port)
     server.listenForConnectionRequests()
     server.start()
 
-if __name__ == "__main__":
-    # collect available versions, environments, and symbols, from the Versions directory
+""" Collect the available versions, with their environments, from the Versions directory.
+    Only the top two levels are listed: the stocks are found by loadSymbols.
+"""
+def loadVersions():
     versions = {}
-    dirs = [x for x in os.walk("Versions")][0][1]
+    dirs = sorted(entry.name for entry in os.scandir("Versions") if entry.is_dir() and entry.name != "__pycache__")
     for version in dirs:
-        files = [x for x in os.walk("Versions/{:s}".format(version))][0][2]
         environments = []
-        for file in files:
-            if file[-3:] == ".py" and file not in ["index.py", "__init__.py"]:
-                environments.append(file.replace(".py", ""))
-        symbols = [x for x in os.walk("Versions/{:s}/Stocks".format(version))]
-        if len(symbols) == 0:
-            symbols = []
-        else:
-            symbols = symbols[0][1]
+        for entry in os.scandir("Versions/{:s}".format(version)):
+            if entry.is_file() and entry.name[-3:] == ".py" and entry.name not in ["index.py", "__init__.py"]:
+                environments.append(entry.name.replace(".py", ""))
         versions[version] = {
-            "environments" : environments,
-            "symbols" : symbols
+            "environments" : sorted(environments)
         }
-    # Validate user input, making sure the version and environment is present and accounted for
-    problem = False
-    input_version = None
-    input_environment = None
-    backtest_date = None
-    processes = []
-    if len(sys.argv) < 3:
-        print("Input must be in the form of run.py [version] [environment]")
-        problem = True
-    else:
-        input_version = sys.argv[1]
-        input_environment = sys.argv[2]
-        if input_version not in versions:
-            print("Version '{:s}' does not exist".format(input_version))
-            problem = True
-        elif input_environment not in versions[input_version]["environments"]:
-            print("Version '{:s}' has no environment {:s}".format(input_version, input_environment))
-            problem = True
-        if input_environment == "Backtest":
-            if len(sys.argv) < 4:
-                print("If [version] is \"Backtest\", then a third parameter")
-                print("needs to be given for the date. An optional fourth")
-                print("parameter can be used for an end date for multiple")
-                print("day simulations.")
-                problem = True
-            else:
-                backtest_date = sys.argv[3:]
-    if problem is True:
-        print("\nAvailable versions:")
-        for version in versions:
-            if len(versions[version]["environments"]) == 0:
-                print("  {:18s}   No environments defined".format(version))
-            else:
-                print(
-                    "  {:18s}   environments: {:s}".format(
-                        version,
-                        ", ".join(list(versions[version]['environments']))
-                    )
-                )
-        quit()
-    symbols = sorted(versions[input_version]["symbols"])
-    # import the version file and the environment file, overriding
-    # settings from the former with settings in the latter in the
-    # case of a clash.
+    return versions
+
+""" The symbols of a version: those with a directory in Versions/[version]/Stocks
+    or a row in its Stocks.csv / Stocks.toml manifest (see Core/settings.py).
+"""
+def loadSymbols(version, environment):
+    return SettingsResolver(version, environment).symbols()
+
+""" Import the version file and the environment file, overriding
+    settings from the former with settings in the latter in the
+    case of a clash.
+"""
+def loadSettings(version, environment):
     global_settings = {}
 
     version_file = importlib.import_module(
         "Versions.{:s}.index".format(
-            input_version,
-            input_environment
+            version,
+            environment
         )
     )
     global_settings.update(version_file.settings)
 
     environment_file = importlib.import_module(
         "Versions.{:s}.{:s}".format(
-            input_version,
-            input_environment
+            version,
+            environment
         )
     )
     global_settings.update(environment_file.settings)
+    return global_settings
+
+""" Apply the include_symbols whitelist, or the exclude_symbols blacklist, from the settings """
+def filterSymbols(symbols, global_settings):
+    symbols = list(symbols)
     # check if there is an include_symbols property. if so, we only use those symbols
     if 'include_symbols' in global_settings:
         print("Symbols before whitelist:", len(symbols))
@@ -159,9 +138,15 @@ if __name__ == "__main__":
         for i in reversed(to_remove):
             del symbols[i]
         print("symbols after blacklist:", len(symbols))
-    if len(symbols) == 0:
-        print("No symbols are set to load, quitting.")
-        quit()
+    return symbols
+
+""" Launch the client processes, and the backtest server if there is a backtest date.
+    Returns the list of started processes, and the risk ledger shared by the clients
+    (or None if the risk_ledger setting is off), which must be unlinked once the
+    processes have finished.
+"""
+def launch(version, environment, symbols, global_settings, backtest_date=None):
+    processes = []
     if backtest_date is not None:
         global_settings['backtest_date'] = backtest_date
     # if global_settings provides a number of processes, use that.
@@ -170,14 +155,19 @@ if __name__ == "__main__":
     number_of_processes = min(number_of_processes, len(symbols))
     # split symbols into lists of symbols
     process_symbols = [symbols[n::number_of_processes] for n in range(number_of_processes)]
+    # the clients share their profit and exposure through a ledger in shared memory
+    risk_ledger = None
+    if global_settings.get("risk_ledger", False):
+        risk_ledger = RiskLedger.create(number_of_processes)
+        global_settings["risk_ledger_name"] = risk_ledger.name
     # for each child process, launch it and add it to the stored list of processes
     for i in range(len(process_symbols)):
         stock_set = process_symbols[i]
         p = Process(
             target=spawnClient,
             args=[
-                input_version,
-                input_environment,
+                version,
+                environment,
                 deepcopy(global_settings),
                 i+1,
                 stock_set
@@ -190,9 +180,81 @@ if __name__ == "__main__":
             target=spawnBacktestServer,
             args=[
                 number_of_processes,
-                backtest_date
+                backtest_date,
+                global_settings.get("tick_bus", False),
+                global_settings.get("connection_port", 92482),
+                global_settings.get("log_tag", "")
             ]
         )
         p.start()
         processes.append(p)
         time.sleep(0.1)
+    return processes, risk_ledger
+
+if __name__ == "__main__":
+    # --profile-startup reports the time spent in each phase of starting up,
+    # here and in each client's log
+    profiler = PhaseProfiler("--profile-startup" in sys.argv)
+    sys.argv = [argument for argument in sys.argv if argument != "--profile-startup"]
+    with profiler.phase("versions"):
+        versions = loadVersions()
+    # Validate user input, making sure the version and environment is present and accounted for
+    problem = False
+    input_version = None
+    input_environment = None
+    backtest_date = None
+    if len(sys.argv) < 3:
+        print("Input must be in the form of run.py [version] [environment] [--profile-startup]")
+        problem = True
+    else:
+        input_version = sys.argv[1]
+        input_environment = sys.argv[2]
+        if input_version not in versions:
+            print("Version '{:s}' does not exist".format(input_version))
+            problem = True
+        elif input_environment not in versions[input_version]["environments"]:
+            print("Version '{:s}' has no environment {:s}".format(input_version, input_environment))
+            problem = True
+        if input_environment == "Backtest":
+            if len(sys.argv) < 4:
+                print("If [version] is \"Backtest\", then a third parameter")
+                print("needs to be given for the date. An optional fourth")
+                print("parameter can be used for an end date for multiple")
+                print("day simulations.")
+                problem = True
+            else:
+                backtest_date = sys.argv[3:]
+    if problem is True:
+        print("\nAvailable versions:")
+        for version in versions:
+            if len(versions[version]["environments"]) == 0:
+                print("  {:18s}   No environments defined".format(version))
+            else:
+                print(
+                    "  {:18s}   environments: {:s}".format(
+                        version,
+                        ", ".join(list(versions[version]['environments']))
+                    )
+                )
+        quit()
+    with profiler.phase("symbols"):
+        symbols = sorted(loadSymbols(input_version, input_environment))
+    with profiler.phase("settings"):
+        global_settings = loadSettings(input_version, input_environment)
+        symbols = filterSymbols(symbols, global_settings)
+    if len(symbols) == 0:
+        print("No symbols are set to load, quitting.")
+        quit()
+    if profiler.enabled:
+        global_settings["profile_startup"] = True
+    with profiler.phase("launch"):
+        processes, risk_ledger = launch(input_version, input_environment, symbols, global_settings, backtest_date)
+    if profiler.enabled:
+        print("Startup of {:d} symbols. Time per phase:".format(len(symbols)))
+        print(profiler.format())
+    if risk_ledger is not None:
+        # the ledger lives as long as this process, so wait for the clients to finish.
+        for process in processes:
+            process.join()
+        risk_ledger.close()
+        risk_ledger.unlink()
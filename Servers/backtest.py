@@ -12,9 +12,13 @@ import sys
 import zmq
 import ujson
 
+from Client.Core.tickbus import TickBus
+
 class BacktestServer:
-    def __init__(self, num_clients, dates):
+    def __init__(self, num_clients, dates, tick_bus=False, connection_port=92482):
         self.num_clients = num_clients
+        # Backtests that run at the same time need their own connection port.
+        self.connection_port = connection_port
         dates = [datetime.datetime.strptime(date, "%Y-%m-%d") for date in dates]
         if len(dates) == 1:
             self.dates = dates
@@ -34,6 +38,11 @@ class BacktestServer:
         self.bars = {}
         self.symbols_to_requests = {}
         self.do_listen = True
+        # When the clients run on the same machine, bars can be written once into
+        # shared memory rather than being sent to each client in JSON format.
+        self.use_tick_bus = tick_bus
+        self.tick_bus = None
+        self.symbols_to_slots = {}
 
     """
     Send a JSON message to a given connection ID.
@@ -226,8 +235,58 @@ class BacktestServer:
             }
         )
     """
+    Create the shared memory tick bus, giving each symbol its own slot, and tell
+    every client where to find it and which slot belongs to each of its requests.
+    """
+    def createTickBus(self):
+        symbols = sorted(self.symbols_to_requests)
+        self.symbols_to_slots = {symbol: slot for (slot, symbol) in enumerate(symbols)}
+        self.tick_bus = TickBus.create(len(symbols))
+        self.report("Created tick bus {:s} with {:d} slots".format(self.tick_bus.name, len(symbols)))
+        connection_slots = {}
+        for symbol in symbols:
+            for (connectionID, requestID) in self.symbols_to_requests[symbol]:
+                connection_slots.setdefault(connectionID, []).append(
+                    [requestID, self.symbols_to_slots[symbol]]
+                )
+        for connectionID in connection_slots:
+            self.send(
+                connectionID,
+                {
+                    "RequestID" : self.ready[connectionID],
+                    "Type" : "Tick Bus",
+                    "Name" : self.tick_bus.name,
+                    "Slots" : connection_slots[connectionID]
+                }
+            )
+
+    """
+    Write a tick's bars into the tick bus once, then ring each connection's doorbell
+    with the tick's sequence number. Only this small control message goes over ZMQ.
+    \param connection_bars A dict of connection ID -> list of (requestID, symbol, bar)
+    """
+    def publishLiveBars(self, connection_bars):
+        slot_bars = {}
+        for connectionID in connection_bars:
+            for (requestID, symbol, bar) in connection_bars[connectionID]:
+                slot_bars[self.symbols_to_slots[symbol]] = bar
+        sequence = self.tick_bus.publish(slot_bars)
+        for connectionID in connection_bars:
+            self.send(
+                connectionID,
+                {
+                    "RequestID" : self.ready[connectionID],
+                    "Type" : "Shared Live Bars",
+                    "Sequence" : sequence
+                }
+            )
+
+    """
     A client can request historical data from a stock.
     In the backtester, there is no benefit in this, so we just send empty bars.
+    Bars are sent in columns, one list per field, which the client converts in bulk.
+    Clients restored from a snapshot add a "Since" time (nanoseconds since the epoch),
+    and only want the bars after it.
     \param connectionID The ID of the connection that a request was sent from
     \param input The dict generated from the connection's message.
     """
@@ -240,7 +299,14 @@ class BacktestServer:
                 "Type" : "HistoricalBars",
                 "Exchange" : self.requireParam(input, "Exchange"),
                 "Symbol" : self.requireParam(input, "Symbol"),
-                "Bars" : []
+                "Columns" : {
+                    "Time" : [],
+                    "Open" : [],
+                    "High" : [],
+                    "Low" : [],
+                    "Close" : [],
+                    "Volume" : []
+                }
             }
         )
     """
@@ -280,7 +346,7 @@ class BacktestServer:
 
     """
     Connections are formed initially when a connection request is received through a fixed
-    listening port (:92482 was picked at random).
+    listening port (:92482 by default, which was picked at random).
 
     When a message is received on this channel, we respond to it with a JSON message,
     providing it with a port to send messages to and a port to receive messages from. This
@@ -294,7 +360,7 @@ class BacktestServer:
     """     
     def listenForConnectionRequests(self):
         initial_connection_socket = self.context.socket(zmq.REP)
-        initial_connection_socket.bind("tcp://127.0.0.1:92482")
+        initial_connection_socket.bind("tcp://127.0.0.1:{:d}".format(self.connection_port))
         connection_poller = zmq.Poller()
         connection_poller.register(initial_connection_socket, zmq.POLLIN)
         for _ in range(self.num_clients):
@@ -386,8 +452,11 @@ class BacktestServer:
                         connection_bars[connectionID] = [package]
                     else:
                         connection_bars[connectionID].append(package)
-            for connectionID in connection_bars:
-                self.sendLiveBars(connectionID, connection_bars[connectionID])
+            if self.tick_bus is not None:
+                self.publishLiveBars(connection_bars)
+            else:
+                for connectionID in connection_bars:
+                    self.sendLiveBars(connectionID, connection_bars[connectionID])
             do_continue = False
             for symbol in self.bars:
                 if self.bars[symbol] and len(self.bars[symbol]) > 1:
@@ -403,7 +472,7 @@ class BacktestServer:
     """
     Before we can send the data, we need to have some data to send!
     This is where you will need to load data for the day and store OHLCV bars
-    in self.bars[symbol][]
+    in self.bars[symbol][]. Bar times are sent as integer nanoseconds since the epoch.
     """
     def start(self):
         while self.do_listen:
@@ -414,7 +483,7 @@ class BacktestServer:
             self.report("Loading data for {:s}".format(symbol))
             #
             #    day_bars.append({
-            #        'Time'      : str(bar_index),
+            #        'Time'      : bar_time, # integer nanoseconds since the epoch
             #        'Open'      : bar['Open'],
             #        'Close'     : bar['Close'],
             #        'High'      : bar['High'],
@@ -424,6 +493,8 @@ class BacktestServer:
             #    })
             self.bars[symbol] = day_bars
             self.report("Loaded {:d} records for {:s}".format(len(day_bars), symbol))
+        if self.use_tick_bus:
+            self.createTickBus()
         self.sendBars()
     """
     When all the data has been sent, we should inform the clients that we're shutting down,
@@ -442,6 +513,9 @@ class BacktestServer:
             self.sockets_out[connectionID].close()
             self.pollers_in[connectionID].unregister(self.sockets_in[connectionID])
             self.sockets_in[connectionID].close()
+        if self.tick_bus is not None:
+            self.tick_bus.close()
+            self.tick_bus.unlink()
         sys.exit(0)
 
 